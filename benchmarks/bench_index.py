@@ -0,0 +1,229 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+'''
+Benchmarks the search index hot paths over a synthetic notebook tree and
+writes the timings as JSON.
+
+    python benchmarks/bench_index.py --dirs 50 --notebooks 2000 -o bench.json
+'''
+from __future__ import print_function
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+WORDS = ('alpha bravo charlie delta echo foxtrot golf hotel india juliet kilo '
+         'lima mike november oscar papa quebec romeo sierra tango uniform '
+         'victor whiskey xray yankee zulu pandas numpy matplotlib plot chart '
+         'frame series model train predict cluster').split()
+
+
+def _sentence(rng, n):
+    return u' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+def _notebook(rng, cells, output_bytes):
+    '''Builds a v4 notebook dict with code cells that carry image outputs.'''
+    nb_cells = []
+    for i in range(cells):
+        if i % 3 == 0:
+            nb_cells.append({
+                'cell_type': 'markdown',
+                'metadata': {},
+                'source': u'# ' + _sentence(rng, 8)
+            })
+        else:
+            outputs = []
+            if output_bytes:
+                outputs.append({
+                    'output_type': 'display_data',
+                    'metadata': {},
+                    'data': {
+                        'image/png': u'iVBORw0KGgo' * (output_bytes // 11 + 1),
+                        'text/plain': u'<Figure>'
+                    }
+                })
+            nb_cells.append({
+                'cell_type': 'code',
+                'execution_count': i,
+                'metadata': {},
+                'outputs': outputs,
+                'source': u'{} = {}({})'.format(rng.choice(WORDS), rng.choice(WORDS), _sentence(rng, 4))
+            })
+    return {
+        'cells': nb_cells,
+        'metadata': {},
+        'nbformat': 4,
+        'nbformat_minor': 0
+    }
+
+
+def save(path, data):
+    '''
+    Writes a file by replacing it the way the notebook server saves, so the
+    change shows in its directory's mtime.
+    '''
+    tmp_path = path + '.~tmp'
+    with io.open(tmp_path, 'wb') as fh:
+        fh.write(data)
+    getattr(os, 'replace', os.rename)(tmp_path, path)
+
+
+def generate_tree(root, dirs, notebooks, cells, output_bytes, hidden_dirs, binary_files, seed=0):
+    '''
+    Generates a synthetic notebook tree under root and returns the paths of
+    the notebooks in it. Directory mtimes are set in the past, as in a tree
+    that has been quiet for a while.
+    '''
+    rng = random.Random(seed)
+    dir_paths = [root]
+    for i in range(dirs):
+        parent = rng.choice(dir_paths)
+        path = os.path.join(parent, 'dir{}'.format(i))
+        os.makedirs(path)
+        dir_paths.append(path)
+
+    nb_paths = []
+    for i in range(notebooks):
+        path = os.path.join(rng.choice(dir_paths), '{}_{}.ipynb'.format(rng.choice(WORDS), i))
+        nb = _notebook(rng, cells, output_bytes)
+        with io.open(path, 'wb') as fh:
+            fh.write(json.dumps(nb).encode('utf-8'))
+        nb_paths.append(path)
+
+    for i in range(hidden_dirs):
+        path = os.path.join(rng.choice(dir_paths), '.hidden{}'.format(i))
+        os.makedirs(path)
+        with io.open(os.path.join(path, 'skipped.ipynb'), 'wb') as fh:
+            fh.write(json.dumps(_notebook(rng, cells, 0)).encode('utf-8'))
+
+    for i in range(binary_files):
+        path = os.path.join(rng.choice(dir_paths), 'data{}.bin'.format(i))
+        with io.open(path, 'wb') as fh:
+            fh.write(os.urandom(rng.randint(1, 64) * 1024))
+
+    past = time.time() - 3600
+    for dirpath, dirnames, filenames in os.walk(root):
+        os.utime(dirpath, (past, past))
+    return nb_paths
+
+
+def timed(func, *args, **kwargs):
+    start = time.time()
+    func(*args, **kwargs)
+    return time.time() - start
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+
+    def pick(p):
+        return samples[min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))]
+    return dict(
+        count=len(samples),
+        p50=pick(50),
+        p90=pick(90),
+        p99=pick(99),
+        max=samples[-1],
+        mean=sum(samples) / len(samples)
+    )
+
+
+def run(args):
+    root = tempfile.mkdtemp(prefix='cms-bench-tree-')
+    data_dir = tempfile.mkdtemp(prefix='cms-bench-data-')
+    # the index lives under the jupyter data dir
+    os.environ['JUPYTER_DATA_DIR'] = data_dir
+    from jupyter_cms import index as index_module
+    import whoosh
+
+    try:
+        start = time.time()
+        nb_paths = generate_tree(root, args.dirs, args.notebooks, args.cells, args.output_bytes,
+                                 args.hidden_dirs, args.binary_files, args.seed)
+        generate_seconds = time.time() - start
+
+        index = index_module.Index(root, workers=args.workers)
+        results = {}
+        results['cold_build'] = dict(seconds=timed(index.update_index))
+        results['noop_update'] = percentiles([timed(index.update_index) for _ in range(args.repeat)])
+        results['noop_full_update'] = percentiles([timed(index.update_index, True) for _ in range(args.repeat)])
+
+        rng = random.Random(args.seed)
+        samples = []
+        for _ in range(args.repeat):
+            for path in rng.sample(nb_paths, min(args.touch, len(nb_paths))):
+                save(path, json.dumps(_notebook(rng, args.cells, args.output_bytes)).encode('utf-8'))
+            samples.append(timed(index.update_index))
+        results['incremental_update'] = percentiles(samples)
+        results['incremental_update']['touched'] = args.touch
+
+        queries = ['pandas', 'plot OR chart', 'matplo*', 'alpha AND bravo', 'basename:zulu*', 'nomatch']
+        cache_size = index.result_cache_size
+        # time the index itself with the result cache off, then the cache
+        for name, size in [('search', 0), ('search_cached', cache_size)]:
+            index.result_cache_size = size
+            samples = []
+            by_query = {}
+            for query in queries:
+                query_samples = [timed(index.search, query) for _ in range(args.queries)]
+                by_query[query] = percentiles(query_samples)
+                samples.extend(query_samples)
+            results[name] = percentiles(samples)
+            results[name]['by_query'] = by_query
+
+        report = dict(
+            params=vars(args),
+            environment=dict(
+                python=platform.python_version(),
+                platform=platform.platform(),
+                whoosh=whoosh.versionstring(),
+                ijson=index_module.ijson and index_module.ijson.backend
+            ),
+            generate_seconds=generate_seconds,
+            results=results
+        )
+    finally:
+        if args.keep:
+            print('Kept tree in', root, 'and index in', data_dir, file=sys.stderr)
+        else:
+            shutil.rmtree(root, True)
+            shutil.rmtree(data_dir, True)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the jupyter_cms search index.')
+    parser.add_argument('--dirs', type=int, default=20, help='number of directories')
+    parser.add_argument('--notebooks', type=int, default=500, help='number of notebooks')
+    parser.add_argument('--cells', type=int, default=20, help='cells per notebook')
+    parser.add_argument('--output-bytes', type=int, default=10000,
+                        help='size of the image output on each code cell')
+    parser.add_argument('--hidden-dirs', type=int, default=5, help='number of hidden directories')
+    parser.add_argument('--binary-files', type=int, default=50, help='number of binary files')
+    parser.add_argument('--touch', type=int, default=10, help='notebooks changed per incremental update')
+    parser.add_argument('--repeat', type=int, default=5, help='runs of each update benchmark')
+    parser.add_argument('--queries', type=int, default=20, help='runs of each search query')
+    parser.add_argument('--workers', type=int, default=1, help='index worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the tree')
+    parser.add_argument('--keep', action='store_true', help='keep the generated tree and index')
+    parser.add_argument('-o', '--output', help='JSON file to write (default: stdout)')
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,19 @@
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
 import errno
+import logging
 import os.path
+import signal
 import sys
+import threading
+import time
 
 from ._version import __version__
+from .indexer import IndexManager
+from . import index as index_module
 
-from jupyter_core.paths import jupyter_config_dir
+from jupyter_core.application import JupyterApp, base_aliases
+from jupyter_core.paths import jupyter_config_dir, jupyter_runtime_dir
 from notebook.services.config import ConfigManager
 from notebook.nbextensions import (InstallNBExtensionApp, EnableNBExtensionApp,
     DisableNBExtensionApp, flags, aliases)
@@ -23,7 +30,7 @@ except ImportError:
         BaseExtensionApp = object
         _new_extensions = False
 
-from traitlets import Unicode
+from traitlets import Dict, Float, Int, Unicode
 from traitlets.config.application import catch_config_error
 from traitlets.config.application import Application
 
@@ -219,13 +226,279 @@ class ExtensionQuickRemovalApp(BaseExtensionApp):
         install.start()
 
 
+class IndexServeApp(JupyterApp):
+    '''Runs the shared search index daemon.'''
+    name = u'jupyter-cms-index-serve'
+    description = u'''Index a notebook directory and answer searches for every
+    notebook server under it, so that they stop scanning it themselves. Point
+    the servers at it with c.IndexManager.server.'''
+
+    examples = """
+        jupyter cms index serve --root-dir=/home
+        jupyter cms index serve --root-dir=/srv/notebooks --socket=/run/jupyter_cms/index.sock
+        jupyter cms index serve --root-dir=/srv/notebooks --port=8899
+    """
+
+    aliases = dict(base_aliases, **{
+        'root-dir': 'IndexServeApp.root_dir',
+        'socket': 'IndexServeApp.socket',
+        'port': 'IndexServeApp.port',
+        'ip': 'IndexServeApp.ip'
+    })
+
+    classes = [IndexManager]
+
+    root_dir = Unicode(help='''
+        Directory to index. Notebook servers rooted in it or beneath it can
+        share the daemon.
+        ''').tag(config=True)
+
+    def _root_dir_default(self):
+        return os.getcwd()
+
+    socket = Unicode(help='''
+        Unix socket to serve on.
+        ''').tag(config=True)
+
+    def _socket_default(self):
+        return os.path.join(jupyter_runtime_dir(), 'jupyter_cms-index.sock')
+
+    socket_mode = Int(0o600, help='''
+        Permissions of the Unix socket. Widen them to let other users'
+        notebook servers connect.
+        ''').tag(config=True)
+
+    port = Int(0, help='''
+        Serve over HTTP on this port instead of the Unix socket.
+        ''').tag(config=True)
+
+    ip = Unicode('127.0.0.1', help='''
+        Interface to serve HTTP on when a port is given.
+        ''').tag(config=True)
+
+    token = Unicode('', help='''
+        Token clients must send to search the whole index. Set
+        c.IndexManager.server_token to match in the notebook servers.
+        ''').tag(config=True)
+
+    client_roots = Dict(help='''
+        Tokens of clients that may only search under one directory, mapped to
+        that directory. Without these or a token, the daemon is single-tenant:
+        every client that can connect may search the whole index.
+        ''').tag(config=True)
+
+    def _log_level_default(self):
+        return logging.INFO
+
+    def _config_file_name_default(self):
+        # share the IndexManager settings of the notebook servers
+        return 'jupyter_notebook_config'
+
+    def start(self):
+        from tornado.ioloop import IOLoop
+        from .indexserver import listen
+
+        root_dir = os.path.abspath(self.root_dir)
+        manager = IndexManager(parent=self, log=self.log, work_dir=root_dir, server='')
+        if self.port:
+            listen(manager, port=self.port, ip=self.ip, token=self.token,
+                   client_roots=self.client_roots)
+            self.log.info('Serving the search index of %s at http://%s:%d', root_dir, self.ip, self.port)
+        else:
+            makedirs(os.path.dirname(self.socket))
+            listen(manager, socket_path=self.socket, mode=self.socket_mode, token=self.token,
+                   client_roots=self.client_roots)
+            self.log.info('Serving the search index of %s on %s', root_dir, self.socket)
+        manager.start()
+
+        loop = IOLoop.current()
+        signal.signal(signal.SIGTERM, lambda sig, frame: loop.add_callback_from_signal(loop.stop))
+        try:
+            loop.start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            manager.stop()
+            if not self.port and os.path.exists(self.socket):
+                os.remove(self.socket)
+
+
+class IndexCommandApp(JupyterApp):
+    '''Base class for commands that work on the index of a directory in process.'''
+    aliases = dict(base_aliases, **{
+        'root-dir': 'IndexCommandApp.root_dir',
+        'workers': 'IndexManager.workers'
+    })
+
+    classes = [IndexManager]
+
+    root_dir = Unicode(help='''
+        Notebook directory whose index to work on.
+        ''').tag(config=True)
+
+    def _root_dir_default(self):
+        return os.getcwd()
+
+    progress_interval = Float(5.0, help='''
+        Seconds between progress reports while updating the index.
+        ''').tag(config=True)
+
+    def _log_level_default(self):
+        return logging.INFO
+
+    def _config_file_name_default(self):
+        # share the IndexManager settings of the notebook servers
+        return 'jupyter_notebook_config'
+
+    def get_index(self):
+        '''Gets the index of root_dir configured like a notebook server's.'''
+        manager = IndexManager(parent=self, log=self.log, server='', watch=False,
+                               work_dir=os.path.abspath(self.root_dir))
+        manager.executor.shutdown()
+        if manager.in_memory:
+            self.log.error('The index is configured to live in memory, not on disk')
+            self.exit(1)
+        # unlike a notebook server, this process may fork writers
+        manager.index.fork_writers = True
+        return manager.index
+
+    def run_update(self, func, *args):
+        '''Runs an index update, reporting progress until it finishes.'''
+        counts = lambda: dict((op, index_module.DOCUMENTS.value(op=op))
+                              for op in ('add', 'update', 'remove'))
+        before = counts()
+        statted = index_module.FILES_STATTED.value()
+        start = time.time()
+        done = threading.Event()
+
+        def report():
+            while not done.wait(self.progress_interval):
+                self.log.info('Indexed %d files after checking %d',
+                    sum(counts().values()) - sum(before.values()),
+                    index_module.FILES_STATTED.value() - statted)
+        reporter = threading.Thread(target=report)
+        reporter.daemon = True
+        reporter.start()
+        try:
+            updated = func(*args)
+        finally:
+            done.set()
+            reporter.join()
+        if not updated:
+            self.log.error('The index of %s is locked by another process', self.root_dir)
+            self.exit(1)
+        after = counts()
+        self.log.info('Added %d, updated %d, and removed %d files in %.1f seconds',
+            after['add'] - before['add'], after['update'] - before['update'],
+            after['remove'] - before['remove'], time.time() - start)
+
+
+class IndexBuildApp(IndexCommandApp):
+    '''Builds or reconciles the index by checking every file.'''
+    name = u'jupyter-cms-index-build'
+    description = u'''Build the search index of a notebook directory, checking
+    every file, so that the first search is fast.'''
+
+    examples = """
+        jupyter cms index build --root-dir=/srv/notebooks
+        jupyter cms index build --root-dir=/srv/notebooks --workers=8
+    """
+
+    def start(self):
+        self.run_update(self.get_index().update_index, True)
+
+
+class IndexUpdateApp(IndexCommandApp):
+    '''Updates the index from the directories that changed.'''
+    name = u'jupyter-cms-index-update'
+    description = u'''Update the search index of a notebook directory, listing
+    only the directories that changed since the last update.'''
+
+    examples = """
+        jupyter cms index update --root-dir=/srv/notebooks
+    """
+
+    def start(self):
+        self.run_update(self.get_index().update_index)
+
+
+class IndexResetApp(IndexCommandApp):
+    '''Clears the index.'''
+    name = u'jupyter-cms-index-reset'
+    description = u'Clear the search index of a notebook directory.'
+
+    examples = """
+        jupyter cms index reset --root-dir=/srv/notebooks
+    """
+
+    def start(self):
+        self.get_index().reset_index()
+        self.log.info('Cleared the index of %s', self.root_dir)
+
+
+class IndexStatsApp(IndexCommandApp):
+    '''Prints the size of the index.'''
+    name = u'jupyter-cms-index-stats'
+    description = u'Show the document count, segments, and size of the search index.'
+
+    examples = """
+        jupyter cms index stats --root-dir=/srv/notebooks
+    """
+
+    def start(self):
+        stats = self.get_index().stats()
+        print('documents:  %d' % stats['documents'])
+        print('segments:   %d' % stats['segments'])
+        print('size_bytes: %d' % stats['size_bytes'])
+
+
+class IndexApp(Application):
+    '''CLI for the search index.'''
+    name = u'jupyter_cms index'
+    description = u'Utilities for managing the jupyter_cms search index'
+
+    subcommands = dict(
+        build=(
+            IndexBuildApp,
+            "Build the index, checking every file"
+        ),
+        update=(
+            IndexUpdateApp,
+            "Update the index from the directories that changed"
+        ),
+        reset=(
+            IndexResetApp,
+            "Clear the index"
+        ),
+        stats=(
+            IndexStatsApp,
+            "Show the size of the index"
+        ),
+        serve=(
+            IndexServeApp,
+            "Run a search index daemon shared by notebook servers"
+        )
+    )
+
+    def start(self):
+        if self.subapp is None:
+            self.print_help()
+            sys.exit(1)
+        super(IndexApp, self).start()
+
+
 class ExtensionApp(Application):
     '''CLI for extension management.'''
     name = u'jupyter_cms extension'
     description = u'Utilities for managing the jupyter_cms extension'
     examples = ""
 
-    subcommands = dict()
+    subcommands = dict(
+        index=(
+            IndexApp,
+            "Build, inspect, and serve the search index"
+        )
+    )
 
     if _new_extensions:
         subcommands.update({
@@ -1,15 +1,27 @@
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
+from . import metrics
+from .suggest import PathSuggester
+from .scanrules import ScanRules, VENV_MARKER
 from jupyter_core.paths import jupyter_data_dir
 from whoosh.index import create_in, open_dir, exists_in, LockError
+from whoosh.filedb.filestore import RamStorage
 from whoosh.fields import Schema, TEXT, ID, STORED
-from whoosh.query import AndMaybe, Term
+from whoosh.query import And, AndMaybe, MultiTerm, Or, Term
+from whoosh.collectors import TimeLimitCollector, TimeLimit, TopCollector
 from whoosh.qparser import MultifieldParser
-import nbformat
+import hashlib
 import io
+import multiprocessing
 import os
 import json
 import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
 
 # Use the built-in version of scandir if possible, otherwise
 # use the scandir module version
@@ -18,136 +30,1314 @@ try:
 except ImportError:
     from scandir import scandir
 
+
+# Atomically replace the manifest on Python 3, settle for rename on Python 2
+_replace = getattr(os, 'replace', os.rename)
+
+# Manifest of directory mtimes and file signatures stored with the index
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 2
+# Notebooks whose mtime changed since they were indexed but whose content did not
+TOUCHED_NAME = 'touched.json'
+# Journal of the directory records changed since the manifest was written
+JOURNAL_NAME = 'manifest.log'
+# Bytes the journal may grow to before the manifest is rewritten, at least
+JOURNAL_MIN_BYTES = 64*1024
+# Seconds within which a directory mtime may not reflect its latest change
+RACY_SECONDS = 2.0
+
+# Stream notebook JSON with ijson, which picks its fastest backend, if it is
+# installed, otherwise fall back on loading it whole with the json module
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# JSON paths of notebook cells and their sources in nbformat v4 and v3
+CELL_PREFIXES = frozenset(['cells.item', 'worksheets.item.cells.item'])
+SOURCE_PREFIXES = frozenset([
+    'cells.item.source',
+    'cells.item.source.item',
+    'worksheets.item.cells.item.source',
+    'worksheets.item.cells.item.source.item',
+    'worksheets.item.cells.item.input',
+    'worksheets.item.cells.item.input.item'
+])
+
+# Process-wide instrumentation of the index hot paths
+SCAN_SECONDS = metrics.Histogram('jupyter_cms_index_scan_seconds',
+    'Seconds per index update, from walking the notebook directory to committing')
+FILES_STATTED = metrics.Counter('jupyter_cms_index_files_statted_total',
+    'Files stat\'d while walking the notebook directory')
+DOCUMENTS = metrics.Counter('jupyter_cms_index_documents_total',
+    'Documents added, updated, and removed from the index')
+SKIPPED_DIRS = metrics.Counter('jupyter_cms_index_dirs_skipped_total',
+    'Directories skipped as too large, virtualenvs, or symlink loops')
+LOCK_SKIPS = metrics.Counter('jupyter_cms_index_lock_skips_total',
+    'Index updates skipped because another update held the index or update lock')
+COMMIT_SECONDS = metrics.Histogram('jupyter_cms_index_commit_seconds',
+    'Seconds per index writer commit')
+PARSE_SECONDS = metrics.Histogram('jupyter_cms_search_parse_seconds',
+    'Seconds spent parsing search query strings')
+SEARCH_SECONDS = metrics.Histogram('jupyter_cms_search_seconds',
+    'Seconds per search, including parsing')
+TRUNCATED = metrics.Counter('jupyter_cms_search_truncated_total',
+    'Searches cut short by the time limit (time) or with wildcards only partly expanded (expansion)')
+RESULT_CACHE = metrics.Counter('jupyter_cms_search_cache_total',
+    'Searches answered from the result cache (hit) or the index (miss)')
+INDEX_DOCUMENTS = metrics.Gauge('jupyter_cms_index_documents',
+    'Documents in the index')
+INDEX_SEGMENTS = metrics.Gauge('jupyter_cms_index_segments',
+    'Segments in the index')
+INDEX_SIZE_BYTES = metrics.Gauge('jupyter_cms_index_size_bytes',
+    'Size of the index files on disk')
+
+
+class _RamStorage(RamStorage):
+    '''
+    Keeps the temporary files of index writers in memory too. Whoosh puts
+    them in a directory under the system temp dir named for the index, which
+    in-memory indexes committing at the same time would share.
+    '''
+    def temp_storage(self, name=None):
+        return RamStorage()
+
+
+class QueryError(ValueError):
+    '''
+    Raised for a query the index refuses to run.
+    '''
+    pass
+
+
+class _BudgetReader(object):
+    '''
+    Reads at most budget bytes of a file, then reports end of file. Keeps a
+    digest of the bytes read.
+    '''
+    def __init__(self, f, budget):
+        self.f = f
+        self.remaining = budget
+        self.digest = hashlib.sha1()
+        # True once the budget cut a read short
+        self.exhausted = False
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size) if size else b''
+        self.digest.update(data)
+        self.remaining -= len(data)
+        if not self.remaining and not self.exhausted:
+            # tell a cut read from one that ended the file
+            self.exhausted = bool(self.f.read(1))
+        return data
+
+    def hexdigest(self):
+        '''
+        Reads what is left of the budget and gets the digest of every byte
+        read.
+        '''
+        for chunk in iter(lambda: self.read(65536), b''):
+            pass
+        return self.digest.hexdigest()
+
+
+def _stream_cell_sources(f, limit):
+    '''
+    Streams cell sources out of notebook JSON without building the rest of
+    the document, stopping once the limit is reached. Keeps the sources
+    found so far if a read budget cut the JSON short.
+    '''
+    chunks = []
+    size = 0
+    try:
+        for prefix, event, value in ijson.parse(f):
+            if event == 'start_map' and prefix in CELL_PREFIXES:
+                if chunks:
+                    chunks.append(u'\n')
+            elif event == 'string' and prefix in SOURCE_PREFIXES:
+                chunks.append(value)
+                size += len(value)
+                if size >= limit:
+                    break
+    except ijson.common.IncompleteJSONError:
+        if not getattr(f, 'exhausted', False):
+            raise
+    return u''.join(chunks)[:limit]
+
+
+def _load_cell_sources(f, limit):
+    '''
+    Loads notebook JSON without validating it and joins the cell sources.
+    '''
+    data = f.read()
+    if getattr(f, 'exhausted', False):
+        # a partial document does not parse, so give up on its content
+        return u''
+    notebook = json.loads(data.decode('utf-8'))
+    cells = notebook.get('cells')
+    if cells is None:
+        cells = [cell for ws in notebook.get('worksheets', []) for cell in ws.get('cells', [])]
+    sources = []
+    for cell in cells:
+        source = cell.get('source', cell.get('input', u''))
+        if isinstance(source, list):
+            source = u''.join(source)
+        sources.append(source)
+    return u'\n'.join(sources)[:limit]
+
+
+def file_digest(filename, limit):
+    '''
+    Computes a digest of the first limit bytes of a notebook, the ones its
+    content is extracted from, for telling real changes from touches that
+    only change its mtime.
+    '''
+    with io.open(filename, 'rb') as f:
+        return _BudgetReader(f, limit).hexdigest()
+
+
+def root_digest(work_dir):
+    '''
+    Gets a name for the index data of a notebook root that no other root
+    shares.
+    '''
+    return hashlib.sha1(os.path.abspath(work_dir).encode('utf-8')).hexdigest()
+
+
+def ancestors(dirname):
+    '''
+    Gets dirname and every directory above it, for matching the files
+    under any of them with one term.
+    '''
+    dirs = [dirname]
+    parent = os.path.dirname(dirname)
+    while parent != dirs[-1]:
+        dirs.append(parent)
+        parent = os.path.dirname(parent)
+    return dirs
+
+
+def file_to_document(filename, m_time, content_limit=1024*1024, read_limit=16*1024*1024):
+    '''
+    Builds the index document for a file, indexing at most content_limit
+    characters of cell source out of the first read_limit bytes. A module
+    function so that worker processes can run it.
+    '''
+    content = u''
+    # only notebooks get a digest: other files have no content to protect
+    # from needless rewrites, so reading them would cost more than it saves
+    digest = None
+
+    try:
+        if filename.endswith('.ipynb'):
+            # get content for notebooks only, digesting the bytes it came from
+            with io.open(filename, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                reader = _BudgetReader(f, read_limit)
+                # the json module needs the whole file, so skip the content
+                # of any larger than the budget without reading it
+                if ijson is not None or size <= read_limit:
+                    try:
+                        if ijson is None:
+                            content = _load_cell_sources(reader, content_limit)
+                        else:
+                            content = _stream_cell_sources(reader, content_limit)
+                    except (Exception):
+                        pass
+                    digest = reader.hexdigest()
+        else:
+            size = os.path.getsize(filename)
+    except (IOError, OSError):
+        size = digest = None
+    return dict(
+        basename=os.path.basename(filename),
+        dirname=os.path.dirname(filename),
+        ancestors=ancestors(os.path.dirname(filename)),
+        path=filename,
+        content=content,
+        time=m_time,
+        size=size,
+        digest=digest
+    )
+
+
+def _remove_legacy_index(index_root):
+    '''
+    Removes the index every notebook root shared before each got its own
+    directory under index_root, leaving those directories and any lock a
+    server of an older version may still hold.
+    '''
+    try:
+        names = os.listdir(index_root)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(index_root, name)
+        if (name.startswith(('MAIN', '_MAIN', MANIFEST_NAME)) and
+            not name.endswith('WRITELOCK') and os.path.isfile(path)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _process_pool(workers):
+    '''
+    Starts a pool of worker processes without forking this one: the
+    notebook server's other threads may hold locks that a forked child
+    would inherit held.
+    '''
+    methods = getattr(multiprocessing, 'get_all_start_methods', lambda: [])()
+    if not methods:
+        # Python 2 can only fork
+        return ProcessPoolExecutor(workers)
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    try:
+        return ProcessPoolExecutor(workers, mp_context=context)
+    except TypeError:
+        # no mp_context before Python 3.7
+        return ProcessPoolExecutor(workers)
+
+
+class _StreamingWriter(object):
+    '''
+    Applies index operations as a diff emits them. Opens the writer on the
+    first operation so that a diff with no changes never takes the index
+    lock, and extracts documents in bounded batches.
+    '''
+    def __init__(self, index, cold=False):
+        self.index = index
+        # hand a cold build to worker processes if the index has them
+        self.cold = cold
+        self.writer = None
+        self.to_add = {}
+        self.to_update = {}
+
+    def _get_writer(self):
+        if self.writer is None:
+            batch_size = self.index.parallel_min_batch if self.cold else 0
+            self.writer = self.index._writer(batch_size)
+        return self.writer
+
+    def add(self, path, m_time):
+        self.to_add[path] = m_time
+        if len(self.to_add) >= self.index.stream_batch:
+            self.flush()
+
+    def update(self, path, m_time):
+        self.to_update[path] = m_time
+        if len(self.to_update) >= self.index.stream_batch:
+            self.flush()
+
+    def remove(self, path):
+        self.index._remove_from_index(self._get_writer(), [path])
+
+    def flush(self):
+        if self.to_add:
+            self.index._add_to_index(self._get_writer(), self.to_add, self.to_add)
+            self.to_add = {}
+        if self.to_update:
+            self.index._update_in_index(self._get_writer(), self.to_update, self.to_update)
+            self.to_update = {}
+
+    def commit(self):
+        self.flush()
+        if self.writer is not None:
+            self.index._commit(self.writer)
+            self.writer = None
+
+    def cancel(self):
+        if self.writer is not None:
+            self.writer.cancel()
+            self.writer = None
+
 class Index(object):
-    def __init__(self, work_dir):
+    # shared instances by absolute notebook root
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    # smallest batch of files worth handing to worker processes
+    parallel_min_batch = 64
+    # let whoosh fork writer processes to analyze large batches too, which
+    # is only safe in a process running no other threads, like the offline
+    # commands: a fork copies the locks other threads hold
+    fork_writers = False
+
+    # number of files to extract and index at a time during a streaming update
+    stream_batch = 1000
+
+    # bytes of each notebook read to extract its cell sources
+    read_limit = 16*1024*1024
+
+    # number of recent result pages to keep until the next commit
+    result_cache_size = 128
+
+    # seconds a search may collect hits before returning what it has, or 0
+    # for no limit
+    search_time_limit = 2.0
+    # longest query string accepted, or 0 for no limit
+    max_query_length = 1000
+    # terms a wildcard, prefix, or fuzzy term may expand to, or 0 for no limit
+    max_expansions = 512
+
+    # globs of file and directory names or root-relative paths to skip
+    exclude = ['node_modules', '__pycache__']
+    # .gitignore style files whose patterns apply to their directory's tree
+    ignore_files = ['.jupyterignore']
+    # directory levels below the scan root to descend, or 0 for no limit
+    max_depth = 0
+    # entries past which a directory is skipped whole, or 0 for no limit
+    max_dir_files = 0
+    # directory the exclude rules and depth are relative to, if not work_dir
+    scan_root = None
+
+    def __init__(self, work_dir, workers=1, limitmb=128, content_limit=1024*1024,
+                 use_manifest=True, index_dir=None, recursive=True, storage_dir=None,
+                 in_memory=False):
         self.work_dir = work_dir
+        # where to keep the index, by default a directory named for work_dir
+        # under storage_dir or the Jupyter data dir
+        self.index_dir = index_dir
+        self.storage_dir = storage_dir
+        # keep the index in RAM, rebuilding it in each process, if True
+        self.in_memory = in_memory
+        # index only the files directly in work_dir if False
+        self.recursive = recursive
+        self.use_manifest = use_manifest
+        self.workers = workers
+        self.limitmb = limitmb
+        self.content_limit = content_limit
+        # per-thread searchers
+        self._local = threading.local()
+        self._update_lock = threading.Lock()
+        # worker processes of the update in progress, if it needs them
+        self._pool = None
+        # filename completions, built on first use and kept in step with
+        # each commit after that
+        self._suggest_lock = threading.Lock()
+        self._pending = []
+        self._results = OrderedDict()
+        self._results_lock = threading.Lock()
+        self._rules = self._make_rules()
         self._init_index()
-        
+
+    @classmethod
+    def for_root(cls, work_dir, **kwargs):
+        '''
+        Gets the Index shared by everything serving the given notebook root,
+        creating it with the keyword arguments on first use.
+        '''
+        key = os.path.abspath(work_dir)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(work_dir, **kwargs)
+            return cls._instances[key]
+
+    def _index_path(self):
+        if self.index_dir:
+            return self.index_dir
+        return os.path.join(self.storage_dir or jupyter_data_dir(), 'index',
+                            root_digest(self.work_dir))
+
     def _init_index(self, reset=False):
-        index_path = os.path.join(jupyter_data_dir(), 'index')
+        index_path = None if self.in_memory else self._index_path()
+        # an in-memory manifest only lives as long as the index
+        self._manifest_path = index_path and os.path.join(index_path, MANIFEST_NAME)
+        self._journal_path = index_path and os.path.join(index_path, JOURNAL_NAME)
+        self._manifest = None
+        # bytes in the manifest and its journal on disk
+        self._manifest_size = self._journal_size = 0
+        self._touched_path = index_path and os.path.join(index_path, TOUCHED_NAME)
+        self._touched = {}
+        self._touched_dirty = False
+        if index_path and not reset:
+            try:
+                with io.open(self._touched_path, 'rb') as f:
+                    self._touched = json.loads(f.read().decode('utf-8'))
+            except (IOError, OSError, ValueError):
+                pass
+        self._suggester = None
+        self._suggest_generation = None
+        # tells this index apart from the one a reset or restart replaces
+        self._epoch = uuid.uuid4().hex
+        self._results = OrderedDict()
         
         # clear out old index if requested
-        if reset:
+        if reset and index_path:
             shutil.rmtree(index_path, True)
         
         # make sure there's a path to store the index data
-        if not os.path.exists(index_path):
+        if index_path and not os.path.exists(index_path):
             os.makedirs(index_path)
+            if not self.index_dir and not self.storage_dir:
+                _remove_legacy_index(os.path.dirname(index_path))
             
-        if not exists_in(index_path):
-            # create an index with the current schema
-            schema = Schema(basename=TEXT(stored=True, field_boost=5.0), 
-                            dirname=ID(stored=True),
-                            path=ID(stored=True, unique=True), 
-                            content=TEXT(stored=False), 
-                            time=STORED)
-            self.ix = create_in(index_path, schema)
-        else:
+        schema = Schema(basename=TEXT(stored=True, field_boost=5.0), 
+                        dirname=ID(stored=True),
+                        ancestors=ID(stored=False),
+                        path=ID(stored=True, unique=True), 
+                        content=TEXT(stored=False), 
+                        time=STORED,
+                        size=STORED,
+                        digest=STORED)
+
+        if index_path is None:
+            # start empty every time: a reset drops the old storage
+            self.ix = _RamStorage().create_index(schema)
+        elif exists_in(index_path):
             # open the existing index
             self.ix = open_dir(index_path)
+            if set(self.ix.schema.names()) != set(schema.names()):
+                # built by an older version: start over with the current schema
+                self.ix.close()
+                self.ix = create_in(index_path, schema)
+        else:
+            # create an index with the current schema
+            self.ix = create_in(index_path, schema)
             
         # build a query parser based on the current schema
         self.query_parser = MultifieldParser(["content", "basename", "dirname"], self.ix.schema)
+
+    def _get_searcher(self):
+        '''
+        Gets a long-lived searcher for the calling thread, refreshing it only
+        if there has been a commit since it was opened, by this process or
+        any other. Whoosh searchers share open files, so threads cannot share
+        one.
+        '''
+        local = self._local
+        searcher = getattr(local, 'searcher', None)
+        if searcher is not None and local.ix is not self.ix:
+            # the index was reset under us
+            searcher.close()
+            searcher = None
+        if searcher is None:
+            local.ix = self.ix
+            local.searcher = searcher = self.ix.searcher()
+        elif not searcher.up_to_date():
+            local.searcher = searcher = searcher.refresh()
+        return searcher
+
+    def _commit(self, writer):
+        start = time.time()
+        writer.commit()
+        COMMIT_SECONDS.observe(time.time() - start)
+        with self._results_lock:
+            self._results.clear()
+        # replay the committed changes on the filename completions
+        pending, self._pending = self._pending, []
+        with self._suggest_lock:
+            if self._suggester is not None:
+                for op, path in pending:
+                    getattr(self._suggester, op)(path)
+                # the generation the writer committed, which the completions
+                # now reflect
+                self._suggest_generation = writer.generation
     
     def _file_to_document(self, filename, m_time):
-        content = u''
-        
-        # get content for notebooks only
-        if filename.endswith('.ipynb'):
-            with io.open(filename, 'r', encoding='utf-8') as f:
-                try:
-                    notebook = nbformat.read(f, 4)
-                    content = u'\n'.join(cell.get('source', u'') for cell in notebook['cells'])
-                except (Exception):
-                    pass
-        return dict(
-            basename=os.path.basename(filename),
-            dirname=os.path.dirname(filename),
-            path=filename,
-            content=content,
-            time=m_time
-        )
+        return file_to_document(filename, m_time, self.content_limit, self.read_limit)
+
+    def _documents(self, filenames, on_disk):
+        '''
+        Yields documents for the given files, extracting them in a pool of
+        worker processes when the batch is large enough to pay for it.
+        '''
+        filenames = list(filenames)
+        if self.workers > 1 and len(filenames) >= self.parallel_min_batch:
+            m_times = [on_disk[filename] for filename in filenames]
+            chunksize = max(1, len(filenames) // (self.workers * 4))
+            if self._pool is None:
+                # one pool serves every batch of the update
+                self._pool = _process_pool(self.workers)
+            for meta in self._pool.map(file_to_document, filenames, m_times,
+                                       repeat(self.content_limit), repeat(self.read_limit),
+                                       chunksize=chunksize):
+                yield meta
+        else:
+            for filename in filenames:
+                yield self._file_to_document(filename, on_disk[filename])
+
+    def _close_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _writer(self, batch_size):
+        '''
+        Gets an index writer, one that analyzes documents in forked worker
+        processes when that is allowed and the batch is large enough to pay
+        for it.
+        '''
+        # forget changes from a writer that never committed
+        self._pending = []
+        # worker processes can't write segments into this process's memory
+        if (self.fork_writers and self.workers > 1 and batch_size >= self.parallel_min_batch and
+            not self.in_memory):
+            return self.ix.writer(procs=self.workers, limitmb=self.limitmb, multisegment=True)
+        return self.ix.writer(limitmb=self.limitmb)
     
-    def _scan_disk(self, on_disk, path):
-        for entry in scandir(path):
-            if not entry.name.startswith('.') and entry.is_dir():
-                self._scan_disk(on_disk, entry.path)
+    def _make_rules(self):
+        return ScanRules(self.scan_root or self.work_dir, self.exclude, self.ignore_files,
+                         self.max_depth, self.max_dir_files)
+
+    def _list_dir(self, path):
+        '''
+        Lists the signatures of the files and the names of the non-hidden
+        subdirectories in a directory that pass the scan rules. Lists
+        nothing for virtualenvs and directories with too many entries.
+        '''
+        rules = self._rules
+        descend = self.recursive and rules.descend(path)
+        files = {}
+        dirs = []
+        venv = False
+        limit = rules.max_dir_files if path != rules.root else 0
+        real_path = None
+        for count, entry in enumerate(scandir(path), 1):
+            if limit and count > limit:
+                SKIPPED_DIRS.inc(reason='size')
+                return {}, []
+            if entry.is_symlink():
+                if real_path is None:
+                    real_path = os.path.realpath(path)
+                if not self._link_within(real_path, entry.path):
+                    continue
+            if entry.is_dir():
+                if (descend and not entry.name.startswith('.') and
+                    not rules.excluded(os.path.join(path, entry.name), True)):
+                    dirs.append(entry.name)
             elif entry.is_file():
-                on_disk[entry.path] = entry.stat().st_mtime
+                if entry.name == VENV_MARKER:
+                    venv = True
+                if rules.excluded(os.path.join(path, entry.name), False):
+                    continue
+                stat = entry.stat()
+                files[entry.name] = [stat.st_mtime, stat.st_size]
+        if venv and path != rules.root:
+            SKIPPED_DIRS.inc(reason='virtualenv')
+            return {}, []
+        FILES_STATTED.inc(len(files))
+        return files, dirs
+
+    def _dir_record(self, dir_mtime, files, dirs, now):
+        return dict(
+            # a directory modified this recently may change again within
+            # the same mtime tick, so don't trust it next time
+            mtime=dir_mtime if now - dir_mtime > RACY_SECONDS else None,
+            files=files,
+            dirs=dirs
+        )
+
+    def _link_within(self, real_dir, link):
+        '''
+        Gets if a symlink resolves to a path below the directory holding it,
+        given that directory's real path. Links leading anywhere else are
+        not followed: the tree they lead to is indexed under its own path,
+        if at all, and nobody can pull files from outside their notebook
+        directory into it with a link.
+        '''
+        return os.path.realpath(link).startswith(real_dir.rstrip(os.sep) + os.sep)
+
+    def _visit(self, stat, above):
+        '''
+        Adds a directory to the directories above the ones beneath it,
+        returning None if it is already one of them: a symlink led back up
+        the tree.
+        '''
+        key = (stat.st_dev, stat.st_ino)
+        if key in above:
+            SKIPPED_DIRS.inc(reason='loop')
+            return None
+        return above | frozenset([key])
+
+    def _walk(self, path, old, new, on_disk, removed_files, removed_dirs, now, above=frozenset()):
+        '''
+        Walks the tree under path, recording each directory in the new
+        manifest. Only directories that are not in the old manifest or whose
+        mtime changed since get listed. Files that are new or changed go into
+        on_disk and entries that disappeared go into removed_files and
+        removed_dirs.
+        '''
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # removed since its parent was listed
+            return
+        above = self._visit(stat, above)
+        if above is None:
+            return
+        dir_mtime = stat.st_mtime
+        record = old.get(path)
+        if record is not None and record['mtime'] == dir_mtime:
+            # nothing added, removed, or renamed here: trust the manifest
+            new[path] = record
+        else:
+            files, dirs = self._list_dir(path)
+            new[path] = self._dir_record(dir_mtime, files, dirs, now)
+            old_files = record['files'] if record is not None else {}
+            for name, sig in files.items():
+                if old_files.get(name) != sig:
+                    on_disk[os.path.join(path, name)] = sig[0]
+            removed_files.extend(os.path.join(path, name) for name in old_files if name not in files)
+            if record is not None:
+                removed_dirs.extend(os.path.join(path, name) for name in record['dirs'] if name not in dirs)
+        for name in new[path]['dirs']:
+            self._walk(os.path.join(path, name), old, new, on_disk, removed_files, removed_dirs,
+                       now, above)
+
+    def _iter_disk(self, path, manifest, now, above=frozenset()):
+        '''
+        Yields (path, mtime) for every file under path in sorted path order,
+        holding only one directory listing per level in memory. Records each
+        directory in manifest if given.
+        '''
+        try:
+            stat = os.stat(path)
+            above = self._visit(stat, above)
+            if above is None:
+                return
+            dir_mtime = stat.st_mtime
+            files, dirs = self._list_dir(path)
+        except OSError:
+            # removed since its parent was listed
+            return
+        if manifest is not None:
+            manifest[path] = self._dir_record(dir_mtime, files, dirs, now)
+        # sort directory names as if they ended in a separator so that the
+        # entries come out in the same order as their full paths
+        entries = [(name, sig[0]) for name, sig in files.items()]
+        entries.extend((name + os.sep, None) for name in dirs)
+        entries.sort()
+        for name, m_time in entries:
+            if m_time is None:
+                for item in self._iter_disk(os.path.join(path, name[:-1]), manifest, now, above):
+                    yield item
+            else:
+                yield os.path.join(path, name), m_time
+
+    def _iter_paths(self, reader):
+        '''
+        Yields (path, docnum) for every document in the index in sorted path
+        order, straight from the terms of the path field.
+        '''
+        for path in reader.field_terms('path'):
+            postings = reader.postings('path', path)
+            # terms of deleted documents linger until their segment merges
+            if postings.is_active():
+                yield path, postings.id()
+
+    def _iter_index(self, reader):
+        '''
+        Yields (path, mtime) for every document in the index in sorted path
+        order.
+        '''
+        for path, docnum in self._iter_paths(reader):
+            yield path, reader.stored_fields(docnum)['time']
+
+    def _merge_update(self):
+        '''
+        Updates the index from a streaming merge of a sorted walk of the disk
+        with the sorted paths in the index. Operations go to the writer as
+        they are found, so memory does not grow with the size of the tree
+        apart from the manifest, if enabled.
+
+        Returns False if the index was locked and nothing was updated.
+        '''
+        new = {} if self.use_manifest else None
+        with self.ix.searcher() as searcher:
+            reader = searcher.reader()
+            ops = _StreamingWriter(self, cold=reader.doc_count() == 0)
+            disk = self._iter_disk(self.work_dir, new, time.time())
+            index = self._iter_index(reader)
+            on_disk = next(disk, None)
+            in_index = next(index, None)
+            try:
+                while on_disk is not None or in_index is not None:
+                    if in_index is None or (on_disk is not None and on_disk[0] < in_index[0]):
+                        ops.add(*on_disk)
+                        on_disk = next(disk, None)
+                    elif on_disk is None or in_index[0] < on_disk[0]:
+                        ops.remove(in_index[0])
+                        in_index = next(index, None)
+                    else:
+                        # only update if modification time and content differ
+                        if on_disk[1] != in_index[1] and self._content_changed(searcher, *on_disk):
+                            ops.update(*on_disk)
+                        on_disk = next(disk, None)
+                        in_index = next(index, None)
+                ops.commit()
+            except LockError:
+                # skip index updates: locked by another process
+                ops.cancel()
+                LOCK_SKIPS.inc(lock='index')
+                return False
+            except Exception:
+                ops.cancel()
+                raise
+        if new is not None:
+            self._save_manifest(new)
+        return True
+
+    def _scan_disk(self, on_disk, path, manifest=None):
+        '''
+        Collects the mtimes of all files under path, recording the
+        directories walked in manifest if given.
+        '''
+        self._walk(path, {}, {} if manifest is None else manifest, on_disk, [], [], time.time())
         return on_disk
-                
-    def _scan_index(self):
-        in_index = {}
+
+    def _load_manifest(self):
+        '''
+        Gets the manifest of directories and file signatures recorded by the
+        last update or None if there isn't a usable one.
+        '''
+        if self._manifest is None:
+            if self._manifest_path is None:
+                return None
+            try:
+                with io.open(self._manifest_path, 'rb') as f:
+                    data = f.read()
+                self._manifest = json.loads(data.decode('utf-8'))
+            except (IOError, OSError, ValueError):
+                return None
+            self._manifest_size = len(data)
+            self._replay_journal()
+        # the manifest only describes the index generation it was saved with
+        if (self._manifest.get('version') != MANIFEST_VERSION or
+            self._manifest.get('root') != os.path.abspath(self.work_dir) or
+            self._manifest.get('rules') != self._rules.key() or
+            self._manifest.get('generation') != self.ix.latest_generation()):
+            self._manifest = None
+            return None
+        return self._manifest['dirs']
+
+    def _replay_journal(self):
+        '''
+        Applies the directory records journaled since the manifest was
+        written, up to the first torn or unreadable entry.
+        '''
+        self._journal_size = 0
+        try:
+            with io.open(self._journal_path, 'rb') as f:
+                lines = f.readlines()
+        except (IOError, OSError):
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line.decode('utf-8'))
+            except ValueError:
+                break
+            # skip what was journaled against a manifest since rewritten
+            if entry.get('journal') != self._manifest.get('journal'):
+                continue
+            for path, record in entry['dirs'].items():
+                if record is None:
+                    self._manifest['dirs'].pop(path, None)
+                else:
+                    self._manifest['dirs'][path] = record
+            self._manifest['generation'] = entry['generation']
+            self._journal_size += len(line)
+
+    def _save_manifest(self, dirs):
+        '''
+        Persists the manifest for the current index generation next to the
+        index, starting a new journal.
+        '''
+        self._manifest = dict(
+            version=MANIFEST_VERSION,
+            root=os.path.abspath(self.work_dir),
+            rules=self._rules.key(),
+            generation=self.ix.latest_generation(),
+            journal=uuid.uuid4().hex,
+            dirs=dirs
+        )
+        if self._manifest_path is None:
+            return
+        tmp_path = self._manifest_path + '.tmp'
+        try:
+            data = json.dumps(self._manifest).encode('utf-8')
+            with io.open(tmp_path, 'wb') as f:
+                f.write(data)
+            _replace(tmp_path, self._manifest_path)
+            self._manifest_size = len(data)
+            self._journal_size = 0
+            # entries left behind name the old journal, so losing this is fine
+            os.remove(self._journal_path)
+        except (IOError, OSError):
+            # not fatal: the next update falls back on a full scan
+            pass
+
+    def _journal_manifest(self, dirs, changed):
+        '''
+        Persists the records of the changed directories and the current
+        index generation by appending them to the manifest's journal, and
+        nothing if neither changed. Rewrites the manifest instead once the
+        journal outgrows it.
+        '''
+        generation = self.ix.latest_generation()
+        if self._manifest is None:
+            return self._save_manifest(dirs)
+        if not changed and self._manifest['generation'] == generation:
+            return
+        self._manifest['dirs'] = dirs
+        self._manifest['generation'] = generation
+        if self._manifest_path is None:
+            return
+        line = json.dumps(dict(
+            journal=self._manifest['journal'],
+            generation=generation,
+            dirs=dict((path, dirs.get(path)) for path in changed)
+        )).encode('utf-8') + b'\n'
+        if self._journal_size + len(line) > max(self._manifest_size, JOURNAL_MIN_BYTES):
+            return self._save_manifest(dirs)
+        try:
+            with io.open(self._journal_path, 'ab') as f:
+                f.write(line)
+            self._journal_size += len(line)
+        except (IOError, OSError):
+            # not fatal: the generation won't match, so the next update
+            # falls back on a full scan
+            pass
+
+    def _update_manifest(self, dirs, on_disk, removed, walked):
+        '''
+        Updates the manifest with paths indexed outside of a full tree walk:
+        files in on_disk, paths in removed, and directory records in walked.
+        Journals only the directories whose records changed.
+        '''
+        changed = set(dirname for dirname in walked if dirs.get(dirname) != walked[dirname])
+        dirs.update(walked)
+        for dirname in walked:
+            parent = os.path.dirname(dirname)
+            record = dirs.get(parent)
+            if (record is not None and parent not in walked and
+                os.path.basename(dirname) not in record['dirs']):
+                record['dirs'].append(os.path.basename(dirname))
+                changed.add(parent)
+        for filename in on_disk:
+            parent = os.path.dirname(filename)
+            record = dirs.get(parent)
+            if record is not None and parent not in walked:
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    sig = None
+                else:
+                    sig = [stat.st_mtime, stat.st_size]
+                if record['files'].get(os.path.basename(filename)) != sig:
+                    if sig is None:
+                        del record['files'][os.path.basename(filename)]
+                    else:
+                        record['files'][os.path.basename(filename)] = sig
+                    changed.add(parent)
+        for path in removed:
+            parent = os.path.dirname(path)
+            record = dirs.get(parent)
+            if record is not None:
+                if record['files'].pop(os.path.basename(path), None) is not None:
+                    changed.add(parent)
+                if os.path.basename(path) in record['dirs']:
+                    record['dirs'].remove(os.path.basename(path))
+                    changed.add(parent)
+            self._drop_from_manifest(dirs, path, changed)
+        self._journal_manifest(dirs, changed)
+
+    def _drop_from_manifest(self, dirs, path, changed):
+        record = dirs.pop(path, None)
+        if record is not None:
+            changed.add(path)
+            for name in record['dirs']:
+                self._drop_from_manifest(dirs, os.path.join(path, name), changed)
+
+    def _changed_dirs(self, old, new):
+        '''
+        Gets the directories whose records differ between two manifests. A
+        walk carries unchanged records over as they are, so only new
+        records need comparing.
+        '''
+        changed = set(path for path in old if path not in new)
+        changed.update(path for path, record in new.items()
+            if record is not old.get(path) and record != old.get(path))
+        return changed
+
+    def _content_changed(self, searcher, filename, m_time):
+        '''
+        Gets if the size or content digest of a notebook whose mtime changed
+        to m_time differs from what the index holds for it. Files without a
+        digest always count as changed, without reading them.
+
+        Whoosh cannot rewrite the stored time alone, so a touched but
+        unchanged notebook keeps its old one. Instead, the touched mtime is
+        remembered along with the stored time it was checked against, so
+        that the notebook is not read again until either changes.
+        '''
+        fields = searcher.document(path=filename)
+        if not fields or fields.get('digest') is None:
+            return True
+        try:
+            size = os.path.getsize(filename)
+            if size != fields['size']:
+                return True
+            if self._touched.get(filename) == [fields['time'], m_time, size]:
+                return False
+            if file_digest(filename, self.read_limit) != fields['digest']:
+                return True
+        except (IOError, OSError):
+            return True
+        self._touched[filename] = [fields['time'], m_time, size]
+        self._touched_dirty = True
+        return False
+
+    def _filter_changed(self, on_disk):
+        '''
+        Filters files whose mtime changed down to those whose content did.
+        '''
         with self.ix.searcher() as searcher:
-            for fields in searcher.all_stored_fields():
-                in_index[fields['path']] = fields['time']
-        return in_index
-                
-    def _compute_ops(self, on_disk, in_index):
-        in_index_set = set(in_index.keys())
-        on_disk_set = set(on_disk.keys())
-
-        to_remove = in_index_set - on_disk_set
-        to_add = on_disk_set - in_index_set
-        to_update = on_disk_set.intersection(in_index_set)
-        
-        return to_add, to_remove, to_update
-        
+            return [filename for filename, m_time in on_disk.items()
+                if self._content_changed(searcher, filename, m_time)]
+
+    def _save_touched(self):
+        '''
+        Persists the touched notebooks next to the index if they changed.
+        '''
+        if not self._touched_dirty:
+            return
+        self._touched_dirty = False
+        if self._touched_path is None:
+            return
+        tmp_path = self._touched_path + '.tmp'
+        try:
+            with io.open(tmp_path, 'wb') as f:
+                f.write(json.dumps(self._touched).encode('utf-8'))
+            _replace(tmp_path, self._touched_path)
+        except (IOError, OSError):
+            # not fatal: the touched notebooks get read once more
+            pass
+
     def _add_to_index(self, writer, to_add, on_disk):
-        for filename in to_add:
-            meta = self._file_to_document(filename, on_disk[filename])
+        for meta in self._documents(to_add, on_disk):
             writer.add_document(**meta)
+            self._pending.append(('add', meta['path']))
+            DOCUMENTS.inc(op='add')
         
     def _remove_from_index(self, writer, to_remove):
+        count = 0
         for filename in to_remove:
-            writer.delete_by_term('path', filename)
+            count += writer.delete_by_term('path', filename) or 0
+            self._pending.append(('remove', filename))
+            if self._touched.pop(filename, None) is not None:
+                self._touched_dirty = True
+        DOCUMENTS.inc(count, op='remove')
+
+    def _remove_dirs_from_index(self, writer, to_remove):
+        count = 0
+        for dirname in to_remove:
+            count += writer.delete_by_term('ancestors', dirname) or 0
+            self._pending.append(('remove_dir', dirname))
+            prefix = dirname.rstrip(os.sep) + os.sep
+            for filename in [f for f in self._touched if f.startswith(prefix)]:
+                del self._touched[filename]
+                self._touched_dirty = True
+        DOCUMENTS.inc(count, op='remove')
             
-    def _update_in_index(self, writer, to_update, on_disk, in_index):
-        for filename in to_update:
-            # only update if modification time differs
-            if on_disk[filename] == in_index[filename]:
-                continue
-            meta = self._file_to_document(filename, on_disk[filename])
+    def _update_in_index(self, writer, to_update, on_disk):
+        for meta in self._documents(to_update, on_disk):
             writer.update_document(**meta)
+            self._pending.append(('add', meta['path']))
+            DOCUMENTS.inc(op='update')
     
-    def update_index(self):
+    def _is_hidden(self, path):
         '''
-        Updates the index based on the disk/index delta.
+        Gets if the path is outside the work_dir, under one of its hidden
+        directories, excluded by the scan rules, or reached through a
+        symlink that leads out of the directory holding it, the same places
+        _scan_disk never visits.
         '''
-        on_disk = {}
-        on_disk = self._scan_disk(on_disk, self.work_dir)
-        in_index = self._scan_index()
-        to_add, to_remove, to_update = self._compute_ops(on_disk, in_index)
-        
-        #print(len(to_add), len(to_remove), len(to_update)) 
-        
+        rel_path = os.path.relpath(path, self.work_dir)
+        if rel_path == os.pardir or rel_path.startswith(os.pardir + os.sep):
+            return True
+        if not self.recursive and os.sep in rel_path:
+            return True
+        if any(seg.startswith('.') for seg in rel_path.split(os.sep)[:-1]):
+            return True
+        if not self._rules.within(path):
+            return True
+        parent = self.work_dir
+        for seg in rel_path.split(os.sep):
+            child = os.path.join(parent, seg)
+            if os.path.islink(child) and not self._link_within(os.path.realpath(parent), child):
+                return True
+            parent = child
+        return False
+
+    def update_paths(self, paths):
+        '''
+        Updates the index for the given file or directory paths only, without
+        scanning the rest of the work_dir. Paths that no longer exist are
+        removed from the index along with anything beneath them.
+
+        Returns False if the index was locked and nothing was updated.
+        '''
+        if not self._update_lock.acquire(False):
+            LOCK_SKIPS.inc(lock='update')
+            return False
+        start = time.time()
+        # pick up changes to the rules and the ignore files
+        self._rules = self._make_rules()
         try:
-            writer = self.ix.writer()
-        except LockError:
-            # skip index updates: locked by another process
-            pass
+            on_disk = {}
+            walked = {}
+            to_remove = []
+            for path in paths:
+                if self._is_hidden(path):
+                    continue
+                if os.path.isdir(path):
+                    if self.recursive and not os.path.basename(path).startswith('.'):
+                        self._scan_disk(on_disk, path, walked)
+                    continue
+                try:
+                    on_disk[path] = os.stat(path).st_mtime
+                except OSError:
+                    # gone before we got to it
+                    to_remove.append(path)
+
+            to_update = self._filter_changed(on_disk)
+            dirs = self._load_manifest() if self.use_manifest else None
+            if to_update or to_remove:
+                try:
+                    writer = self._writer(len(to_update))
+                except LockError:
+                    LOCK_SKIPS.inc(lock='index')
+                    return False
+
+                self._remove_from_index(writer, to_remove)
+                self._remove_dirs_from_index(writer, to_remove)
+                self._update_in_index(writer, to_update, on_disk)
+                self._commit(writer)
+            if dirs is not None:
+                self._update_manifest(dirs, on_disk, to_remove, walked)
+            return True
+        finally:
+            self._close_pool()
+            self._save_touched()
+            SCAN_SECONDS.observe(time.time() - start)
+            self._update_lock.release()
+
+    def update_index(self, full=False):
+        '''
+        Updates the index based on the disk/index delta. Unless full is True,
+        uses the manifest from the last update, if enabled, to skip listing
+        directories whose mtime has not changed. Edits to files in place do not change
+        their directory's mtime, so run a full update now and then to catch
+        any the caller has not passed to update_paths.
+
+        Returns False if the index was locked and nothing was updated.
+        '''
+        if not self._update_lock.acquire(False):
+            LOCK_SKIPS.inc(lock='update')
+            return False
+        start = time.time()
+        # pick up changes to the rules and the ignore files
+        self._rules = self._make_rules()
+        try:
+            old = None if full or not self.use_manifest else self._load_manifest()
+            if old is None:
+                # no record of what is in the index: compare with its contents
+                return self._merge_update()
+
+            new = {}
+            on_disk = {}
+            to_remove = []
+            to_remove_dirs = []
+            self._walk(self.work_dir, old, new, on_disk, to_remove, to_remove_dirs, time.time())
+            # the manifest and index agree, so changed files are updates
+            # and new ones are adds, but update_document handles both
+            to_update = self._filter_changed(on_disk)
+
+            if not (to_remove or to_remove_dirs or to_update):
+                # nothing to commit, but remember any newly trusted directories
+                self._journal_manifest(new, self._changed_dirs(old, new))
+                return True
+
+            try:
+                writer = self._writer(len(to_update))
+            except LockError:
+                # skip index updates: locked by another process
+                LOCK_SKIPS.inc(lock='index')
+                return False
+            else:
+                self._remove_from_index(writer, to_remove)
+                self._remove_dirs_from_index(writer, to_remove_dirs)
+                self._update_in_index(writer, to_update, on_disk)
+                self._commit(writer)
+                self._journal_manifest(new, self._changed_dirs(old, new))
+                return True
+        finally:
+            self._close_pool()
+            self._save_touched()
+            SCAN_SECONDS.observe(time.time() - start)
+            self._update_lock.release()
+
+    def generation(self):
+        '''
+        Gets a token that changes whenever search results may have, for
+        tagging responses. It follows the generation of the index on disk,
+        so commits by other processes, like an offline build or another
+        server on the same root, change it too.
+        '''
+        return '%s-%d' % (self._epoch, self.ix.latest_generation())
+
+    def search(self, query_string, limit=25, cwd=None, offset=0, root=None):
+        '''
+        Searches the index given a query string. Returns up to limit hits
+        starting at offset, the total number of matches, and whether the
+        search was cut short by the time limit or expansion cap so that both
+        may be incomplete. If root is given, only files under it match. If
+        cwd is given, files in it rank higher, then files below it.
+        Recent complete pages are answered from a cache until the next commit
+        by any process.
+
+        Raises QueryError if the query string is too long.
+        '''
+        if self.max_query_length and len(query_string) > self.max_query_length:
+            raise QueryError('query must be at most %d characters' % self.max_query_length)
+        if cwd is not None:
+            cwd = os.path.normpath(cwd)
+        if root is not None:
+            root = os.path.normpath(root)
+        key = (self.ix.latest_generation(), ' '.join(query_string.split()), limit, cwd, offset, root)
+        with self._results_lock:
+            cached = self._results.pop(key, None)
+            if cached is not None:
+                self._results[key] = cached
+        if cached is not None:
+            RESULT_CACHE.inc(result='hit')
         else:
-            self._add_to_index(writer, to_add, on_disk)
-            self._remove_from_index(writer, to_remove)
-            self._update_in_index(writer, to_update, on_disk, in_index)
-            writer.commit()
+            RESULT_CACHE.inc(result='miss')
+            cached = self._search(query_string, limit, cwd, offset, root)
+            with self._results_lock:
+                # skip pages a commit made stale while we searched, and
+                # partial ones a retry may complete
+                if key[0] == self.ix.latest_generation() and not cached[2]:
+                    self._results[key] = cached
+                    while len(self._results) > self.result_cache_size:
+                        self._results.popitem(last=False)
+        hits, total, truncated = cached
+        # callers may decorate the hits, so hand out copies
+        return [dict(hit) for hit in hits], total, truncated
 
-    def search(self, query_string, limit=25, cwd=os.getcwd()):
+    def _cap_expansions(self, query, reader):
         '''
-        Searches the index given a query string.
+        Replaces each term in the query that expands to more than
+        max_expansions terms, like a wildcard matching most of the index,
+        with the first max_expansions of them. Returns the query and whether
+        any term was cut.
         '''
-        with self.ix.searcher() as searcher:
-            # parse user query
-            query = self.query_parser.parse(query_string)
-            # improve the score of files in the same directory
-            query = AndMaybe(query, Term('dirname', cwd))
-            results = searcher.search(query, limit=limit)
-            # return dict copies: results not valid outside of context
-            return ([dict(
-                basename=result['basename'],
-                dirname=result['dirname'],
-                path=result['path']
-            ) for result in results], len(results))
+        capped = []
+        def cap(q):
+            if not isinstance(q, MultiTerm) or not q.field() or q.field() not in reader.schema:
+                return q
+            terms = list(islice(q.expanded_terms(reader), self.max_expansions + 1))
+            if len(terms) <= self.max_expansions:
+                return q
+            capped.append(q)
+            field = reader.schema[q.field()]
+            return Or([Term(fieldname, field.from_bytes(btext))
+                       for fieldname, btext in terms[:-1]], boost=q.boost)
+        if self.max_expansions:
+            query = query.accept(cap)
+        return query, bool(capped)
+
+    def _search(self, query_string, limit, cwd, offset, root):
+        start = time.time()
+        searcher = self._get_searcher()
+        # parse user query
+        query = self.query_parser.parse(query_string)
+        PARSE_SECONDS.observe(time.time() - start)
+        query, truncated = self._cap_expansions(query, searcher.reader())
+        if truncated:
+            TRUNCATED.inc(reason='expansion')
+        if cwd is not None:
+            # improve the score of files in the same directory, and less so
+            # of those further down
+            query = AndMaybe(query, Or([Term('dirname', cwd, boost=2.0),
+                                        Term('ancestors', cwd)]))
+        if root is not None:
+            # intersect with the one posting list of the files under root, so
+            # that the query skips over the rest instead of scoring them; the
+            # zero boost leaves scores alone (Whoosh 2.7's Require is broken)
+            query = And([query, Term('ancestors', root, boost=0.0)])
+        # skip the block quality optimization: the total needs every match
+        # counted anyway, and this way the count stops with the time limit
+        top = collector = TopCollector(offset + limit, usequality=False)
+        if self.search_time_limit:
+            # poll a timer thread: an alarm signal would need the main thread
+            collector = TimeLimitCollector(collector, self.search_time_limit,
+                                           use_alarm=False)
+        try:
+            searcher.search_with_collector(query, collector)
+        except TimeLimit:
+            # keep the best hits collected so far, counting only the matches
+            # seen before the limit
+            TRUNCATED.inc(reason='time')
+            truncated = True
+        results = top.results()
+        total = top.total
+        # return dict copies: results not valid after a searcher refresh
+        hits = [dict(
+            basename=result['basename'],
+            dirname=result['dirname'],
+            path=result['path'],
+            score=result.score
+        ) for result in results[offset:offset + limit]]
+        SEARCH_SECONDS.observe(time.time() - start)
+        return hits, total, truncated
+
+    def suggest(self, prefix, limit=10, root=None):
+        '''
+        Gets up to limit files whose basename or path relative to the
+        work_dir, or to root if given, starts with prefix. Does not parse a
+        query, and only reads the index again after another process commits
+        to it.
+        '''
+        with self._suggest_lock:
+            if (self._suggester is None or
+                self._suggest_generation != self.ix.latest_generation()):
+                # first use, or another process committed: commits here
+                # wait on the lock, so none can slip in unreplayed
+                with self.ix.reader() as reader:
+                    self._suggest_generation = reader.generation()
+                    self._suggester = PathSuggester(self.work_dir,
+                        [path for path, docnum in self._iter_paths(reader)])
+            suggester = self._suggester
+        return [dict(
+            basename=os.path.basename(path),
+            dirname=os.path.dirname(path),
+            path=path
+        ) for path in suggester.suggest(prefix, limit, root)]
+
+    def stats(self):
+        '''
+        Gets the number of documents and segments in the index and the size
+        of its files, recording them in the index gauges as well.
+        '''
+        with self.ix.reader() as reader:
+            documents = reader.doc_count()
+            segments = sum(1 for leaf, _ in reader.leaf_readers() if leaf.doc_count_all())
+        storage = self.ix.storage
+        size = 0
+        for name in storage.list():
+            try:
+                size += storage.file_length(name)
+            except (IOError, OSError):
+                # a lock or temp file came and went
+                pass
+        INDEX_DOCUMENTS.set(documents)
+        INDEX_SEGMENTS.set(segments)
+        INDEX_SIZE_BYTES.set(size)
+        return dict(documents=documents, segments=segments, size_bytes=size)
 
     def reset_index(self):
         '''
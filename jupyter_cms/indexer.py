@@ -0,0 +1,398 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+from .index import Index
+from .indexserver import IndexClient
+from .scanrules import ScanRules, VENV_MARKER
+from .shards import ShardedIndex
+from traitlets import Bool, Float, Int, List, Unicode
+from traitlets.config import LoggingConfigurable
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+
+# Use watchdog for filesystem events if it is installed, otherwise
+# fall back on periodic reconciliation scans alone
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+# Watchdog events that mean a path changed. Opening, reading, and closing a
+# file without writing it fire events too, and the indexer reads every file
+# it indexes, so forwarding those would make it index its own reads.
+CHANGE_EVENTS = frozenset(['created', 'deleted', 'moved', 'modified', 'closed'])
+
+
+class _EventHandler(object):
+    '''
+    Forwards watchdog filesystem events to the index manager as dirty paths.
+    '''
+    def __init__(self, manager):
+        self.manager = manager
+
+    def dispatch(self, event):
+        if event.event_type not in CHANGE_EVENTS:
+            return
+        # a directory is "modified" whenever its listing changes; the events
+        # for the entries themselves carry everything we need
+        if event.is_directory and event.event_type == 'modified':
+            return
+        paths = [event.src_path]
+        dest_path = getattr(event, 'dest_path', None)
+        if dest_path:
+            paths.append(dest_path)
+        self.manager.notify(paths)
+
+
+class IndexManager(LoggingConfigurable):
+    '''
+    Keeps the search index for a notebook directory current from a background
+    thread so that search requests only have to query it.
+    '''
+    work_dir = Unicode()
+
+    watch = Bool(True, help='''
+        Update the index from filesystem events as they happen. Requires the
+        watchdog package; without it, only reconciliation scans run.
+        ''').tag(config=True)
+
+    reconcile_interval = Float(300.0, help='''
+        Seconds between full scans of the notebook directory that reconcile
+        the index with the disk.
+        ''').tag(config=True)
+
+    full_scan_interval = Float(3600.0, help='''
+        Seconds between reconciliation scans that check every file instead of
+        only listing directories whose mtime changed. These catch in-place
+        edits the filesystem watcher missed.
+        ''').tag(config=True)
+
+    scan_manifest = Bool(True, help='''
+        Keep a manifest of directory mtimes and file signatures next to the
+        index so that updates only list directories that changed. Disable it
+        to keep memory flat on very large trees at the cost of full scans.
+        ''').tag(config=True)
+
+    event_delay = Float(1.0, help='''
+        Seconds to let a burst of filesystem events settle before indexing
+        the paths they touched.
+        ''').tag(config=True)
+
+    retry_delay = Float(2.0, help='''
+        Seconds to wait before indexing changed paths again after an update
+        skipped them because the index was locked or failed.
+        ''').tag(config=True)
+
+    workers = Int(1, help='''
+        Number of worker processes that extract documents when a large batch
+        of files needs indexing, such as on a cold build. The offline index
+        commands analyze documents in forked writer processes as well.
+        ''').tag(config=True)
+
+    limitmb = Int(128, help='''
+        Maximum memory in megabytes each index writer may use for buffering
+        documents before flushing them to disk.
+        ''').tag(config=True)
+
+    content_limit = Int(1024*1024, help='''
+        Maximum number of characters of cell source indexed per notebook.
+        ''').tag(config=True)
+
+    read_limit = Int(16*1024*1024, help='''
+        Maximum number of bytes read from each notebook to extract its cell
+        sources. Without ijson, notebooks larger than this are indexed by name
+        only.
+        ''').tag(config=True)
+
+    search_threads = Int(4, help='''
+        Number of threads that run searches and client-requested updates off
+        the notebook server's IOLoop.
+        ''').tag(config=True)
+
+    min_update_interval = Float(5.0, help='''
+        Seconds after an index update finishes during which requests for
+        another update share its result instead of rescanning the disk.
+        ''').tag(config=True)
+
+    result_cache_size = Int(128, help='''
+        Number of recent result pages to answer repeated searches from until
+        the index next changes.
+        ''').tag(config=True)
+
+    search_time_limit = Float(2.0, help='''
+        Seconds a search may spend collecting hits before it returns the best
+        ones found so far, marked as truncated, or 0 for no limit.
+        ''').tag(config=True)
+
+    max_query_length = Int(1000, help='''
+        Longest query string a search accepts, or 0 for no limit.
+        ''').tag(config=True)
+
+    max_expansions = Int(512, help='''
+        Number of indexed terms a wildcard, prefix, or fuzzy term in a query
+        may match. Past it, only the first ones are searched and the results
+        are marked as truncated. 0 for no limit.
+        ''').tag(config=True)
+
+    exclude = List(Unicode(), ['node_modules', '__pycache__'], help='''
+        Globs of file and directory names, or of paths relative to the
+        notebook directory, that the indexer skips along with everything
+        beneath them. Virtualenvs are always skipped.
+        ''').tag(config=True)
+
+    ignore_files = List(Unicode(), ['.jupyterignore'], help='''
+        Names of .gitignore style files whose patterns exclude paths in the
+        tree of the directory holding them. Add '.gitignore' to skip what git
+        ignores.
+        ''').tag(config=True)
+
+    max_depth = Int(0, help='''
+        Directory levels below the notebook directory to index, or 0 for no
+        limit.
+        ''').tag(config=True)
+
+    max_dir_files = Int(0, help='''
+        Number of entries past which a directory below the notebook directory
+        is skipped whole, such as a dataset of many part files, or 0 for no
+        limit.
+        ''').tag(config=True)
+
+    sharded = Bool(False, help='''
+        Keep a separate index for each top-level directory of the notebook
+        directory, so that changes in one only lock and rewrite its index.
+        Searches query all of them in parallel on search_threads threads.
+        ''').tag(config=True)
+
+    storage_dir = Unicode('', help='''
+        Directory to keep the search indexes in, each in a subdirectory named
+        for a hash of its notebook directory. Defaults to the Jupyter data
+        directory. Point it at a tmpfs such as /dev/shm when the data
+        directory is on a slow network filesystem.
+        ''').tag(config=True)
+
+    in_memory = Bool(False, help='''
+        Keep the search index in memory instead of on disk. The index is
+        rebuilt each time the server starts, which costs less than keeping
+        it on slow storage for short-lived servers such as those in
+        containers.
+        ''').tag(config=True)
+
+    server = Unicode('', help='''
+        Unix socket path or http:// URL of a shared index daemon started with
+        `jupyter cms index serve`. When set, searches go to the daemon and
+        this process does not scan or index anything itself.
+        ''').tag(config=True)
+
+    server_token = Unicode('', help='''
+        Token the shared index daemon requires of its clients, if any.
+        ''').tag(config=True)
+
+    def __init__(self, **kwargs):
+        super(IndexManager, self).__init__(**kwargs)
+        self.executor = ThreadPoolExecutor(self.search_threads)
+        if self.server:
+            self.index = IndexClient(self.server, self.work_dir, self.server_token)
+        else:
+            storage = dict(storage_dir=self.storage_dir or None, in_memory=self.in_memory)
+            if self.sharded:
+                self.index = ShardedIndex.for_root(self.work_dir, **storage)
+                self.index.threads = self.search_threads
+            else:
+                self.index = Index.for_root(self.work_dir, **storage)
+            self.index.workers = self.workers
+            self.index.limitmb = self.limitmb
+            self.index.content_limit = self.content_limit
+            self.index.read_limit = self.read_limit
+            self.index.use_manifest = self.scan_manifest
+            self.index.result_cache_size = self.result_cache_size
+            self.index.search_time_limit = self.search_time_limit
+            self.index.max_query_length = self.max_query_length
+            self.index.max_expansions = self.max_expansions
+            self.index.exclude = self.exclude
+            self.index.ignore_files = self.ignore_files
+            self.index.max_depth = self.max_depth
+            self.index.max_dir_files = self.max_dir_files
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._observer = None
+        self._watches = {}
+        self._update_lock = threading.Lock()
+        self._update_future = None
+        self._last_update = 0
+
+    def start(self):
+        '''
+        Starts the indexing thread and, if enabled, the filesystem watcher.
+        The index daemon does both when there is one.
+        '''
+        if self.server:
+            return
+        self._thread = threading.Thread(target=self._run, name='jupyter_cms-indexer')
+        self._thread.daemon = True
+        self._thread.start()
+
+        if self.watch:
+            if Observer is None:
+                self.log.info('Install watchdog to keep the jupyter_cms search index current between scans')
+            else:
+                self._observer = Observer()
+                self._observer.daemon = True
+                self._sync_watches()
+                self._observer.start()
+
+    @property
+    def watching(self):
+        '''
+        Gets if something keeps the index current between reconciliation
+        scans: a filesystem watcher or the shared index daemon.
+        '''
+        return bool(self.server) or self._observer is not None
+
+    def _watch_dirs(self):
+        '''
+        Gets the top-level directories of the work_dir that the scan rules
+        let the indexer into, each to watch with its whole tree.
+        '''
+        rules = ScanRules(self.work_dir, self.exclude, self.ignore_files,
+                          self.max_depth, self.max_dir_files)
+        if not rules.descend(self.work_dir):
+            return set()
+        dirs = set()
+        try:
+            for name in os.listdir(self.work_dir):
+                path = os.path.join(self.work_dir, name)
+                if (not name.startswith('.') and os.path.isdir(path) and
+                    not rules.excluded(path, True) and
+                    not os.path.isfile(os.path.join(path, VENV_MARKER))):
+                    dirs.add(path)
+        except OSError:
+            pass
+        return dirs
+
+    def _sync_watches(self):
+        '''
+        Watches the files directly in the work_dir and the trees of its
+        top-level directories that pass the scan rules, so that hidden,
+        excluded, and virtualenv trees at the top take no inotify watches.
+        Watchdog cannot exclude subtrees of a recursive watch, so those
+        deeper down are only filtered out when their events arrive.
+        '''
+        observer = self._observer
+        if observer is None:
+            return
+        handler = _EventHandler(self)
+        wanted = self._watch_dirs()
+        wanted.add(self.work_dir)
+        for path in set(self._watches) - wanted:
+            try:
+                observer.unschedule(self._watches.pop(path))
+            except Exception:
+                # the watch went with its directory
+                pass
+        for path in wanted - set(self._watches):
+            try:
+                self._watches[path] = observer.schedule(handler, path,
+                    recursive=path != self.work_dir)
+            except OSError:
+                # gone since it was listed
+                self.log.debug('Could not watch %s', path)
+
+    def stop(self):
+        '''
+        Stops the filesystem watcher, the indexing thread, and the executor.
+        '''
+        self._stopped = True
+        self._wakeup.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+            self._watches = {}
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.executor.shutdown()
+
+    def request_update(self):
+        '''
+        Requests an incremental index update on the executor and returns its
+        future. Concurrent requests share the update in flight, and requests
+        within min_update_interval of the last update share its result.
+        '''
+        with self._update_lock:
+            future = self._update_future
+            if future is not None and (not future.done() or
+                time.time() - self._last_update < self.min_update_interval):
+                return future
+            self._update_future = future = self.executor.submit(self._update)
+            return future
+
+    def _update(self):
+        try:
+            return self.index.update_index()
+        finally:
+            self._last_update = time.time()
+
+    def notify(self, paths):
+        '''
+        Queues paths that changed on disk for indexing.
+        '''
+        with self._dirty_lock:
+            self._dirty.update(paths)
+        self._wakeup.set()
+
+    def _call(self, func, *args):
+        '''
+        Runs an update, returning False if it was skipped or failed.
+        '''
+        try:
+            if func(*args):
+                return True
+            self.log.debug('Search index locked, skipped an update')
+        except Exception:
+            self.log.exception('Failed to update the search index')
+        return False
+
+    def _run(self):
+        # reconcile right away to pick up changes made while we were not running
+        next_reconcile = 0
+        next_full_scan = time.time() + self.full_scan_interval
+        # when to index paths again that a skipped or failed update left dirty
+        next_retry = None
+        while not self._stopped:
+            wake_at = next_reconcile if next_retry is None else min(next_reconcile, next_retry)
+            self._wakeup.wait(max(0, wake_at - time.time()))
+            self._wakeup.clear()
+            if self._stopped:
+                break
+
+            if self._dirty and (next_retry is None or time.time() >= next_retry):
+                next_retry = None
+                time.sleep(self.event_delay)
+                with self._dirty_lock:
+                    paths, self._dirty = self._dirty, set()
+                work_dir = os.path.normpath(self.work_dir)
+                if self._observer is not None and any(
+                        os.path.dirname(path) == work_dir for path in paths):
+                    # a top-level directory may have come or gone
+                    self._sync_watches()
+                if not self._call(self.index.update_paths, paths):
+                    # put them back: edits in place don't change their
+                    # directory's mtime, so only a full scan would find them
+                    with self._dirty_lock:
+                        self._dirty.update(paths)
+                    next_retry = time.time() + self.retry_delay
+
+            if time.time() >= next_reconcile:
+                full = time.time() >= next_full_scan
+                if full:
+                    self._call(self.index.update_index, True)
+                else:
+                    self._call(lambda: self.request_update().result())
+                next_reconcile = time.time() + self.reconcile_interval
+                if full:
+                    next_full_scan = time.time() + self.full_scan_interval
@@ -0,0 +1,265 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+'''
+Shared index daemon that serves searches for every notebook server on a
+host, and the client notebook servers use to query it.
+'''
+from . import metrics
+from .index import QueryError
+from tornado import gen, web
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_unix_socket
+import hmac
+import json
+import os
+import socket
+import threading
+
+try:
+    import http.client as httplib
+    from urllib.parse import urlencode, urlparse
+except ImportError:
+    import httplib
+    from urllib import urlencode
+    from urlparse import urlparse
+
+# most results a client may fetch in one request
+MAX_PAGE_SIZE = 100
+# most filename completions a client may fetch in one request
+MAX_SUGGESTIONS = 50
+
+
+def _same_token(a, b):
+    '''
+    Compares tokens in time that does not depend on where they differ.
+    '''
+    return hmac.compare_digest(a.encode('utf-8'), b.encode('utf-8'))
+
+
+class _IndexHandler(web.RequestHandler):
+    def initialize(self, manager, token, client_roots):
+        self.manager = manager
+        self.index = manager.index
+        self.executor = manager.executor
+        self.token = token
+        self.client_roots = client_roots
+
+    def prepare(self):
+        # the root this client may search under, or None for all of them
+        self.client_root = None
+        if not self.token and not self.client_roots:
+            # single-tenant: anyone who can connect is trusted
+            return
+        auth = self.request.headers.get('Authorization', '')
+        token = auth[len('token '):] if auth.startswith('token ') else ''
+        if token and self.token and _same_token(token, self.token):
+            return
+        for client_token, root in self.client_roots.items():
+            if token and _same_token(token, client_token):
+                self.client_root = os.path.abspath(root)
+                return
+        raise web.HTTPError(403)
+
+    def get_root(self):
+        '''
+        Gets the root argument, defaulting to the client's root and refusing
+        any outside it.
+        '''
+        root = self.get_query_argument('root', None)
+        if self.client_root is None:
+            return root
+        if root is None:
+            return self.client_root
+        rel_path = os.path.relpath(os.path.abspath(root), self.client_root)
+        if rel_path == os.pardir or rel_path.startswith(os.pardir + os.sep):
+            raise web.HTTPError(403, 'root is outside the client root')
+        return root
+
+    def get_int(self, name, default):
+        try:
+            return int(self.get_query_argument(name, str(default)))
+        except ValueError:
+            raise web.HTTPError(400, '%s must be an integer' % name)
+
+
+class SearchHandler(_IndexHandler):
+    @gen.coroutine
+    def get(self):
+        if not self.manager.watching:
+            # without a filesystem watcher, keep searches fresh by updating
+            # first, sharing the update with the other servers' requests
+            yield self.manager.request_update()
+        limit = self.get_int('limit', 25)
+        offset = self.get_int('offset', 0)
+        if offset < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+            raise web.HTTPError(400, 'offset must be >= 0 and limit in 1..%d' % MAX_PAGE_SIZE)
+        try:
+            results, total, truncated = yield self.executor.submit(self.index.search,
+                self.get_query_argument('qs'),
+                limit=limit,
+                offset=offset,
+                cwd=self.get_query_argument('cwd', None),
+                root=self.get_root())
+        except QueryError as e:
+            raise web.HTTPError(400, reason=str(e))
+        self.write(dict(results=results, total=total, truncated=truncated))
+
+
+class SuggestHandler(_IndexHandler):
+    @gen.coroutine
+    def get(self):
+        limit = self.get_int('limit', 10)
+        if not 0 < limit <= MAX_SUGGESTIONS:
+            raise web.HTTPError(400, 'limit must be in 1..%d' % MAX_SUGGESTIONS)
+        results = yield self.executor.submit(self.index.suggest,
+            self.get_query_argument('prefix'),
+            limit=limit,
+            root=self.get_root())
+        self.write(dict(results=results))
+
+
+class UpdateHandler(_IndexHandler):
+    @gen.coroutine
+    def post(self):
+        # share the update with every other server that asked for one
+        updated = yield self.manager.request_update()
+        self.write(dict(updated=updated))
+
+
+class GenerationHandler(_IndexHandler):
+    def get(self):
+        self.write(dict(generation=self.index.generation()))
+
+
+class StatsHandler(_IndexHandler):
+    @gen.coroutine
+    def get(self):
+        stats = yield self.executor.submit(self.index.stats)
+        self.write(stats)
+
+
+class MetricsHandler(_IndexHandler):
+    @gen.coroutine
+    def get(self):
+        yield self.executor.submit(self.index.stats)
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(metrics.REGISTRY.render())
+
+
+def make_app(manager, token='', client_roots=None):
+    '''
+    Builds the web application that serves the index of an IndexManager.
+    Clients sending token may search the whole index, and those sending a
+    token in client_roots only the tree under the root it maps to. Without
+    either, every client may search everything.
+    '''
+    kwargs = dict(manager=manager, token=token, client_roots=client_roots or {})
+    return web.Application([
+        (r'/search', SearchHandler, kwargs),
+        (r'/suggest', SuggestHandler, kwargs),
+        (r'/update', UpdateHandler, kwargs),
+        (r'/generation', GenerationHandler, kwargs),
+        (r'/stats', StatsHandler, kwargs),
+        (r'/metrics', MetricsHandler, kwargs)
+    ])
+
+
+def listen(manager, socket_path=None, port=None, ip='127.0.0.1', mode=0o600, token='',
+           client_roots=None):
+    '''
+    Serves the index of an IndexManager on a Unix socket or a TCP port on
+    the current IOLoop, returning the HTTPServer.
+    '''
+    server = HTTPServer(make_app(manager, token, client_roots))
+    if socket_path:
+        server.add_socket(bind_unix_socket(socket_path, mode))
+    else:
+        server.listen(port, ip)
+    return server
+
+
+class _UnixHTTPConnection(httplib.HTTPConnection):
+    '''
+    HTTP connection over a Unix socket.
+    '''
+    def __init__(self, socket_path, timeout):
+        httplib.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class IndexClient(object):
+    '''
+    Stands in for an Index by querying the index daemon at address, either
+    a Unix socket path or an http URL. Results are limited to files under
+    root. Each thread keeps its connection open across requests.
+    '''
+    def __init__(self, address, root, token='', timeout=30):
+        self.address = address
+        self.root = os.path.abspath(root)
+        self.token = token
+        self.timeout = timeout
+        self._local = threading.local()
+        if address.startswith('http://'):
+            url = urlparse(address)
+            self._prefix = url.path.rstrip('/')
+            self._connect = lambda: httplib.HTTPConnection(url.hostname, url.port or 80,
+                                                           timeout=timeout)
+        else:
+            self._prefix = ''
+            self._connect = lambda: _UnixHTTPConnection(address, timeout)
+
+    def _request(self, method, path, **params):
+        url = self._prefix + path + '?' + urlencode(params)
+        headers = {'Authorization': 'token ' + self.token} if self.token else {}
+        for attempt in (0, 1):
+            conn = getattr(self._local, 'conn', None)
+            reused = conn is not None
+            if conn is None:
+                conn = self._local.conn = self._connect()
+            try:
+                conn.request(method, url, body='' if method == 'POST' else None, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                self._local.conn = None
+                # the daemon may have closed an idle connection: retry once
+                # on a fresh one
+                if reused and attempt == 0:
+                    continue
+                raise
+            if response.status == 400 and path == '/search':
+                raise QueryError(response.reason)
+            if response.status != 200:
+                raise IOError('Index server returned %d for %s' % (response.status, path))
+            return json.loads(body.decode('utf-8'))
+
+    def search(self, query_string, limit=25, cwd=None, offset=0, root=None):
+        '''
+        Searches the files under root, which must lie within the client
+        root, or under the client root if not given.
+        '''
+        params = dict(qs=query_string, limit=limit, offset=offset, root=root or self.root)
+        if cwd is not None:
+            params['cwd'] = cwd
+        resp = self._request('GET', '/search', **params)
+        return resp['results'], resp['total'], resp['truncated']
+
+    def suggest(self, prefix, limit=10):
+        return self._request('GET', '/suggest', prefix=prefix, limit=limit,
+                             root=self.root)['results']
+
+    def update_index(self, full=False):
+        return self._request('POST', '/update')['updated']
+
+    def generation(self):
+        return self._request('GET', '/generation')['generation']
+
+    def stats(self):
+        return self._request('GET', '/stats')
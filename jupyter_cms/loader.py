@@ -3,7 +3,9 @@
 '''
 Extended from http://nbviewer.ipython.org/github/ipython/ipython/blob/master/examples/notebooks/Importing%20Notebooks.ipynb.
 '''
-import io, os, sys, types, re, warnings, hashlib
+import io, os, sys, types, re, warnings, hashlib, marshal, threading
+from collections import OrderedDict
+import IPython
 import nbformat
 from nbformat import v4 as nb_v4
 from nbformat import reader, converter
@@ -12,12 +14,38 @@ from traitlets.config import Config
 from IPython.display import display, HTML
 from IPython.core.interactiveshell import InteractiveShell
 
+try:
+    from importlib.machinery import ModuleSpec
+except ImportError:
+    # Python 2 and 3.3 import through find_module and load_module alone
+    ModuleSpec = None
+
+# Use the built-in version of scandir if possible, otherwise
+# use the scandir module version
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+try:
+    from importlib.util import cache_from_source
+except ImportError:
+    # no __pycache__ on Python 2: go without the compiled notebook cache
+    cache_from_source = None
+
+# Atomically replace cache files on Python 3, settle for rename on Python 2
+_replace = getattr(os, 'replace', os.rename)
+
 UNBOUND_HELP_DOCSTRING_TMPL = 'Run "{name}()" to see this example. Run "%inject {name}()" to inject the example into your notebook.'
 BOUND_HELP_DOCSTRING_TMPL = 'Run this function to see a rich example.'
 API_DOCSTRING_TMPL = 'Run {name}.help() for a detailed example.'
 MODULE_API_DOCSTRING_TMPL = 'Run help() for a detailed example.'
 MODULE_DOCSTRING_TMPL = 'Run this function to see rich help about this importable notebook.'
 
+# Version of the compiled notebook format in __pycache__
+CACHE_FORMAT = 1
+CACHE_SUFFIX = '.nbc'
+
 export_html = HTMLExporter(config=Config({
     'CSSHTMLHeaderPreprocessor': {
         'enabled': False
@@ -28,28 +56,51 @@ export_html = HTMLExporter(config=Config({
 }))
 
 
-def rich_help():
-    def _rich_help(*args):
-        with warnings.catch_warnings():
-            # ignore warnings about pandoc, nodejs, etc.
-            warnings.filterwarnings('ignore', message='Node.js')
-            output, resources = export_html.from_notebook_node(_rich_help.__richdoc__)
-        # include style in every output; tried it global on import, but if the import is
-        # re-run it's lost because there is no output on a repeat module import
-        output = '''<style>
+# Serializes renders with the shared exporter, on threads pre-rendering
+# help as well as on the kernel's
+_render_lock = threading.Lock()
+
+def render_richdoc(f):
+    '''
+    Gets the HTML that a help function displays, rendering its __richdoc__
+    only if the notebook changed since it was last rendered.
+    '''
+    f = getattr(f, '__func__', f)
+    with _render_lock:
+        if f.__richhtml__ is None:
+            with warnings.catch_warnings():
+                # ignore warnings about pandoc, nodejs, etc.
+                warnings.filterwarnings('ignore', message='Node.js')
+                output, resources = export_html.from_notebook_node(f.__richdoc__)
+            # include style in every output; tried it global on import, but if the import is
+            # re-run it's lost because there is no output on a repeat module import
+            f.__richhtml__ = '''<style>
     .output .input_prompt,
     .output .output .output_prompt,
     .output .output .prompt { display: none; }
     .output .input_area pre { padding: 0.4em; }
 </style>
 ''' + output
-        display(HTML(output))
+        return f.__richhtml__
+
+def rich_help():
+    def _rich_help(*args):
+        display(HTML(render_richdoc(_rich_help)))
+    _rich_help.__richhtml__ = None
     return _rich_help
 
 def convert_notebook(notebook):
     '''Converts IPython notebook to current version.'''
     return converter.convert(notebook, nbformat.current_nbformat)
 
+def _plain(node):
+    '''Copies a notebook node into the plain dicts and lists marshal accepts.'''
+    if isinstance(node, dict):
+        return dict((key, _plain(value)) for key, value in node.items())
+    if isinstance(node, list):
+        return [_plain(value) for value in node]
+    return node
+
 class NotebookLoader(object):
     '''Module loader for IPython Notebooks with support for rich help.'''
     API_REX = re.compile('#\s*<api>')
@@ -57,6 +108,18 @@ class NotebookLoader(object):
     # immediately below a cell magic
     HELP_REX = re.compile('(%%[^\n]+\n)?(#\s*<help(:([^>]+))?>\s*)')
 
+    # keep the compiled cells of each notebook in a __pycache__ directory next
+    # to it, like Python does for modules, unless sys.dont_write_bytecode
+    use_cache = True
+
+    # render the rich help of each notebook module in a background thread as
+    # soon as the module is built, so that the first help() call is instant
+    prerender_help = False
+
+    # number of notebooks load_notebook keeps modules of in sys.modules,
+    # dropping the least recently loaded ones
+    max_loaded_notebooks = 64
+
     def __init__(self, path, nb_path, inject_locals={}):
         self.shell = InteractiveShell.instance()
         self.path = path
@@ -114,27 +177,27 @@ class NotebookLoader(object):
         # add this cell to the help notebook if it's non-empty
         if cell.source.strip():
             f.__richdoc__.cells.append(cell)
+        # render the notebook again with the new cells
+        getattr(f, '__func__', f).__richhtml__ = None
 
         return f
 
-    def eval_notebook(self, nb, mod):
+    def compile_notebook(self, nb):
         '''
-        Evaluate notebook cells.
+        Compiles the notebook into the steps that build its module: markdown
+        that may become the module docstring, code objects of the API cells,
+        and the help cells with the markdown before them.
         '''
-        mod.__dict__.update(self.inject_locals)
+        steps = []
         prev = None
-        if not len(nb.cells):
-            # notebook is new and has no cells
-            return
         for cell in nb.cells:
-            if not mod.__doc__ and cell.cell_type == 'markdown':
-                mod.__doc__ = cell.source
+            if cell.cell_type == 'markdown':
+                steps.append(('doc', cell.source))
             elif cell.cell_type == 'code' and len(cell.source):
                 if self.API_REX.match(cell.source):
                     # transform the input to executable Python
                     code = self.shell.input_transformer_manager.transform_cell(cell.source)
-                    # run the code in the module
-                    exec(code, mod.__dict__)
+                    steps.append(('api', compile(code, self.nb_path, 'exec')))
                 else:
                     match = self.HELP_REX.match(cell.source)
                     if match:
@@ -143,40 +206,138 @@ class NotebookLoader(object):
                         name = match.group(4)
                         if name is not None:
                             name = name.strip()
-                            try:
-                                obj = mod.__dict__[name]
-                            except KeyError:
-                                # attach to a new named function on the module itself
-                                obj = self.attach_richdoc(None, cell, prev, name)
-                                mod.__dict__[name] = obj
-                            else:
-                                # attach to an existing object, assuming that it comes
-                                # before the help in the notebook
-                                self.attach_richdoc(obj, cell, prev, name)
-                        else:
-                            # attach to the module itself
-                            self.attach_richdoc(mod, cell, prev, name)
+                        # only markdown before the cell goes in the help
+                        intro = prev if prev is not None and prev.cell_type == 'markdown' else None
+                        steps.append(('help', name, cell, intro))
 
             # store previous
             prev = cell
+        return steps
 
-    def load_module(self, fullname):
+    def run_steps(self, steps, mod):
         '''
-        Creates a module containing the exposed API content of a notebook
-        by evaluating those notebook cells.
+        Builds the module from compiled notebook steps.
+        '''
+        mod.__dict__.update(self.inject_locals)
+        helps = []
+        for step in steps:
+            if step[0] == 'doc':
+                if not mod.__doc__:
+                    mod.__doc__ = step[1]
+            elif step[0] == 'api':
+                # run the code in the module
+                exec(step[1], mod.__dict__)
+            else:
+                kind, name, cell, prev = step
+                if name is not None:
+                    try:
+                        obj = mod.__dict__[name]
+                    except KeyError:
+                        # attach to a new named function on the module itself
+                        f = obj = self.attach_richdoc(None, cell, prev, name)
+                        mod.__dict__[name] = obj
+                    else:
+                        # attach to an existing object, assuming that it comes
+                        # before the help in the notebook
+                        f = self.attach_richdoc(obj, cell, prev, name)
+                else:
+                    # attach to the module itself
+                    f = self.attach_richdoc(mod, cell, prev, name)
+                # unwrap the bound help methods of classes
+                f = getattr(f, '__func__', f)
+                if not any(f is other for other in helps):
+                    helps.append(f)
+
+        if self.prerender_help and helps:
+            self.prerender(helps)
+
+    def prerender(self, helps):
+        '''
+        Renders the rich help of help functions in a background thread.
+        '''
+        def render():
+            for f in helps:
+                try:
+                    render_richdoc(f)
+                except Exception:
+                    # help() will raise it again in the foreground
+                    pass
+        thread = threading.Thread(target=render, name='jupyter_cms-prerender')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def eval_notebook(self, nb, mod):
+        '''
+        Evaluate notebook cells.
         '''
+        self.run_steps(self.compile_notebook(nb), mod)
+
+    def cache_path(self):
+        '''
+        Gets the path of the compiled notebook in __pycache__, or None if
+        there is nowhere to keep it.
+        '''
+        if cache_from_source is None:
+            return None
+        # name it like the .pyc of a module named for the whole filename, so
+        # it can't collide with that of a .py of the same name
+        pyc_path = cache_from_source(self.nb_path + '.py', optimization='')
+        return os.path.splitext(pyc_path)[0] + CACHE_SUFFIX
+
+    def load_steps(self):
+        '''
+        Gets the compiled steps that build the notebook's module, from the
+        cache if the notebook is the same size and age as when it was
+        compiled by the same IPython, otherwise by reading and compiling it.
+        '''
+        stat = os.stat(self.nb_path)
+        key = [CACHE_FORMAT, IPython.__version__, stat.st_size, stat.st_mtime]
+        cache_path = self.cache_path() if self.use_cache else None
+        if cache_path is not None:
+            try:
+                with io.open(cache_path, 'rb') as f:
+                    cached_key, steps = marshal.load(f)
+            except (IOError, OSError, EOFError, ValueError, TypeError):
+                pass
+            else:
+                if cached_key == key:
+                    return [step[:2] + tuple(nbformat.from_dict(cell) if cell else cell
+                                             for cell in step[2:])
+                            for step in steps]
+
         # parse the notebook json
         with io.open(self.nb_path, 'r', encoding='utf-8') as f:
             notebook = reader.read(f)
         # convert to current notebook version
         notebook = convert_notebook(notebook)
-
-        # create the module
-        mod = types.ModuleType(fullname)
-        mod.__file__ = self.nb_path
-        mod.__package__ = '.'.join(fullname.split('.')[:-1])
-        mod.__loader__ = self
-        sys.modules[fullname] = mod
+        steps = self.compile_notebook(notebook)
+
+        if cache_path is not None and not sys.dont_write_bytecode:
+            tmp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+            try:
+                if not os.path.isdir(os.path.dirname(cache_path)):
+                    os.makedirs(os.path.dirname(cache_path))
+                with io.open(tmp_path, 'wb') as f:
+                    marshal.dump((key, [step[:2] + tuple(_plain(cell) for cell in step[2:])
+                                        for step in steps]), f)
+                _replace(tmp_path, cache_path)
+            except (IOError, OSError):
+                # not fatal, like an unwritable __pycache__ for modules
+                pass
+        return steps
+
+    def create_module(self, spec):
+        # let the import system create a plain module
+        return None
+
+    def exec_module(self, mod):
+        '''
+        Fills a module with the exposed API content of a notebook by
+        evaluating those notebook cells.
+        '''
+        # parse and compile the notebook, unless it's cached
+        steps = self.load_steps()
 
         # extra work to ensure that magics that would affect the user_ns
         # actually affect the notebook module's ns
@@ -184,35 +345,62 @@ class NotebookLoader(object):
         self.shell.user_ns = mod.__dict__
 
         try:
-            self.eval_notebook(notebook, mod)
+            self.run_steps(steps, mod)
         finally:
             self.shell.user_ns = save_user_ns
-        return mod
 
-    def load_module_by_path(self):
-        # parse the notebook json
-        with io.open(self.nb_path, 'r', encoding='utf-8') as f:
-            notebook = reader.read(f)
-        # convert to current notebook version
-        notebook = convert_notebook(notebook)
+    def load_module(self, fullname):
+        '''
+        Creates a module containing the exposed API content of a notebook
+        by evaluating those notebook cells. Used where the import system
+        predates exec_module.
+        '''
+        mod = types.ModuleType(fullname)
+        mod.__file__ = self.nb_path
+        mod.__package__ = '.'.join(fullname.split('.')[:-1])
+        mod.__loader__ = self
+        sys.modules[fullname] = mod
+        self.exec_module(mod)
+        return mod
 
-        # create the module and generate a hash from the name
-        fullname = hashlib.sha1().hexdigest()
+    def load_module_by_path(self, reuse=False):
+        '''
+        Creates a module for the notebook outside of any package, named for
+        its path and content. If reuse is True, returns the module loaded
+        last from the same path instead if the notebook has not changed.
+        '''
+        path = os.path.abspath(self.nb_path)
+        with io.open(self.nb_path, 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        if reuse:
+            with _loaded_lock:
+                loaded = _loaded.get(path)
+                if loaded is not None and loaded[0] == digest:
+                    # mark it as recently used
+                    del _loaded[path]
+                    _loaded[path] = loaded
+                    return loaded[1]
+
+        # name the module for the notebook's path and content
+        fullname = '_notebook_' + hashlib.sha1((path + digest).encode('utf-8')).hexdigest()
         mod = types.ModuleType(fullname)
         mod.__file__ = self.nb_path
         mod.__package__ = None
         mod.__loader__ = self
         sys.modules[fullname] = mod
-
-        # extra work to ensure that magics that would affect the user_ns
-        # actually affect the notebook module's ns
-        save_user_ns = self.shell.user_ns
-        self.shell.user_ns = mod.__dict__
-
-        try:
-            self.eval_notebook(notebook, mod)
-        finally:
-            self.shell.user_ns = save_user_ns
+        self.exec_module(mod)
+
+        with _loaded_lock:
+            # replace the last module loaded from the path, even if the
+            # notebook changed since, and drop the least recently used ones
+            # past the limit
+            stale = [_loaded.pop(path, (None, None))[1]]
+            _loaded[path] = (digest, mod)
+            while len(_loaded) > self.max_loaded_notebooks:
+                stale.append(_loaded.popitem(last=False)[1][1])
+            for old in stale:
+                if old is not None and old is not mod and sys.modules.get(old.__name__) is old:
+                    del sys.modules[old.__name__]
         return mod
 
 class BlankPackageLoader(object):
@@ -222,6 +410,13 @@ class BlankPackageLoader(object):
     def __init__(self, path, *args):
         self.path = path
 
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, mod):
+        # nothing to run: the spec already made the module a package
+        pass
+
     def load_module(self, fullname):
         mod = types.ModuleType(fullname)
         mod.__path__ = self.path
@@ -230,58 +425,132 @@ class BlankPackageLoader(object):
         sys.modules[fullname] = mod
         return mod
 
+class DirectoryListings(object):
+    '''
+    Caches the files and subdirectories of directories so that finding a
+    module takes a stat of its directory instead of a stat per candidate.
+    Like importlib's FileFinder, relists a directory when its mtime changes.
+    '''
+    def __init__(self):
+        self._listings = {}
+
+    def get(self, path):
+        '''
+        Gets the sets of file and subdirectory names in a directory, both
+        empty if it does not exist.
+        '''
+        path = os.path.abspath(path)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return frozenset(), frozenset()
+        listing = self._listings.get(path)
+        if listing is not None and listing[0] == mtime:
+            return listing[1:]
+
+        files = set()
+        dirs = set()
+        try:
+            for entry in scandir(path):
+                try:
+                    if entry.is_dir():
+                        dirs.add(entry.name)
+                    elif entry.is_file():
+                        files.add(entry.name)
+                except OSError:
+                    # a broken symlink, say
+                    pass
+        except OSError:
+            return frozenset(), frozenset()
+        listing = (mtime, frozenset(files), frozenset(dirs))
+        self._listings[path] = listing
+        return listing[1:]
+
+    def clear(self):
+        self._listings.clear()
+
 class NotebookFinder(object):
     '''
     Treats IPython Notebooks as importable modules.
     '''
-    def __init__(self, loader_cls):
+    def __init__(self, loader_cls, listings=None):
         self.loader_cls = loader_cls
+        self.listings = DirectoryListings() if listings is None else listings
 
-    def find_module(self, fullname, path=None):
-        '''
-        Find a notebook, given its fully qualified name and an optional path
-        '''
-        loader = None
-        # print('*** finding fullname:', fullname, 'path:', path)
+    def _find_loader(self, fullname, path):
         if fullname.startswith('mywb.'):
             name = fullname.rsplit('.', 1)[-1]
-            path = [''] if path is None or not len(path) else path
+            path = [''] if path is None or not len(path) else list(path)
             fullpath = os.path.join(*path)
 
-            nb_path = os.path.join(fullpath, name + ".ipynb")
-            if os.path.isfile(nb_path):
-                loader = self.loader_cls(path, nb_path)
-        return loader
+            filename = name + '.ipynb'
+            if filename in self.listings.get(fullpath)[0]:
+                return self.loader_cls(path, os.path.join(fullpath, filename))
+        return None
+
+    def find_spec(self, fullname, path=None, target=None):
+        '''
+        Find a notebook, given its fully qualified name and an optional path
+        '''
+        loader = self._find_loader(fullname, path)
+        if loader is None:
+            return None
+        spec = ModuleSpec(fullname, loader, origin=loader.nb_path)
+        spec.has_location = True
+        return spec
+
+    def find_module(self, fullname, path=None):
+        '''
+        Find a notebook for import systems that predate find_spec.
+        '''
+        return self._find_loader(fullname, path)
+
+    def invalidate_caches(self):
+        self.listings.clear()
 
 
 class NotebookPathFinder(object):
     '''
     Treats the resources root folder and subdirectories as blank modules.
     '''
-    def __init__(self, root, loader_cls):
+    def __init__(self, root, loader_cls, listings=None):
         self.root = root
         self.loader_cls = loader_cls
+        self.listings = DirectoryListings() if listings is None else listings
 
-    def find_module(self, fullname, ns_path=None):
+    def _find_loader(self, fullname, ns_path):
         if fullname == 'mywb' and ns_path is None:
             # bootstrap the top level fake dir for mywb
-            loader = self.loader_cls([self.root])
+            return self.loader_cls([self.root])
         elif fullname.startswith('mywb.') and ns_path:
-            segs = fullname.split('.')
-            path = ns_path._path if hasattr(ns_path, '_path') else ns_path
-            fullpath = os.path.join(*(path + segs[-1:]))
+            name = fullname.rsplit('.', 1)[-1]
+            path = list(ns_path._path if hasattr(ns_path, '_path') else ns_path)
+            fullpath = os.path.join(*path)
 
-            if os.path.isdir(fullpath):
-                loader = self.loader_cls([fullpath])
-            else:
-                loader = None
-        else:
-            loader = None
+            if name in self.listings.get(fullpath)[1]:
+                return self.loader_cls([os.path.join(fullpath, name)])
+        return None
+
+    def find_spec(self, fullname, ns_path=None, target=None):
+        loader = self._find_loader(fullname, ns_path)
+        if loader is None:
+            return None
+        spec = ModuleSpec(fullname, loader, is_package=True)
+        spec.submodule_search_locations = loader.path
+        return spec
 
-        return loader
+    def find_module(self, fullname, ns_path=None):
+        return self._find_loader(fullname, ns_path)
+
+    def invalidate_caches(self):
+        self.listings.clear()
 
 _enabled = None
 
+# Modules load_notebook built, by notebook path, least recently loaded first
+_loaded = OrderedDict()
+_loaded_lock = threading.Lock()
+
 
 def enable(root,
            notebook_path_loader_cls=BlankPackageLoader,
@@ -292,8 +561,10 @@ def enable(root,
     '''
     global _enabled
     if _enabled is None:
-        nb_path_finder = NotebookPathFinder(root, notebook_path_loader_cls)
-        nb_finder = NotebookFinder(notebook_loader_cls)
+        # share directory listings between the finders
+        listings = DirectoryListings()
+        nb_path_finder = NotebookPathFinder(root, notebook_path_loader_cls, listings)
+        nb_finder = NotebookFinder(notebook_loader_cls, listings)
         sys.meta_path.append(nb_path_finder)
         sys.meta_path.append(nb_finder)
         _enabled = (nb_path_finder, nb_finder)
@@ -314,11 +585,14 @@ def disable():
         raise RuntimeError('loader not enabled')
 
 
-def load_notebook(path, inject_locals={}):
+def load_notebook(path, inject_locals={}, reuse=False):
     '''
     Loads a notebook as a module given its absolute path. Returns a new instance
     of the module every time it is called unlike normal imports which
-    sys.modules caches based on name.
+    sys.modules caches based on name. If reuse is True, returns the module
+    from the last call for the path instead, as long as the notebook has not
+    changed since. That module keeps the inject_locals of the call that
+    built it.
     '''
     loader = NotebookLoader([], path, inject_locals=inject_locals)
-    return loader.load_module_by_path()
+    return loader.load_module_by_path(reuse)
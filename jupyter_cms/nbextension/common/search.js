@@ -17,6 +17,12 @@ define([
     // Constants
     var template = _.template([
         '<input type="text" class="form-control urth-search-input" placeholder="<%= messages.search_placeholder %>" />',
+        '<% if(scope_label) { %>',
+        '<div class="checkbox urth-search-scope">',
+        '  <label><input type="checkbox" class="urth-search-scope-input" /> <%- scope_label %></label>',
+        '</div>',
+        '<% } %>',
+        '<div class="urth-search-suggestions"></div>',
         '<div class="urth-search-input-help">',
         '  <a href="http://whoosh.readthedocs.org/en/latest/querylang.html" target="_blank"><%= messages.search_query_link %> ',
         '    <i class="fa fa-external-link"></i>',
@@ -26,25 +32,186 @@ define([
         '<div class="urth-search-results"></div>'
     ].join(''));
     var search_url = utils.url_join_encode(utils.get_body_data("baseUrl"), 'search');
+    // Number of results to fetch per request
+    var page_size = 25;
+    // Distance in pixels from the bottom of the results at which to fetch more
+    var scroll_margin = 200;
+    var suggest_url = utils.url_join_encode(utils.get_body_data("baseUrl"), 'search', 'suggest');
+    // Milliseconds after the last keystroke to wait before fetching completions
+    var suggest_delay = 100;
+    // Number of filename completions to show
+    var suggest_limit = 8;
+    // Number of result pages to keep in session storage for revalidation
+    var cache_size = 50;
+    var cache_prefix = 'urth.search.cache.';
 
     // Configuration
     var can_insert;
-        
+    // Folder the dialog was opened from, relative to the notebook directory
+    var folder;
+
+    // State of the query whose results are showing
+    var query = {
+        text: null,
+        loaded: 0,
+        total: 0,
+        pending: null
+    };
+
+    // Forget the current query and abandon any request in flight for it
+    var reset_query = function(text) {
+        if(query.pending) {
+            query.pending.abort();
+        }
+        query.text = text;
+        query.loaded = 0;
+        query.total = 0;
+        query.pending = null;
+    };
+
+    // Input text to complete and the completion request in flight for it
+    var suggest_text = null;
+    var suggest_pending = null;
+
+    // Hide completions and abandon any request in flight for them
+    var clear_suggestions = function() {
+        suggest_text = null;
+        if(suggest_pending) {
+            suggest_pending.abort();
+            suggest_pending = null;
+        }
+        $('.urth-search-suggestions').empty();
+    };
+
+    // Fetch filename completions once typing pauses
+    var fetch_suggestions = _.debounce(function(text) {
+        // typing moved on or the query was submitted while we waited
+        if(text !== suggest_text) return;
+        if(suggest_pending) {
+            suggest_pending.abort();
+        }
+        var xhr = suggest_pending = $.ajax({
+            url: suggest_url,
+            data: {prefix: text.replace(/\*$/, ''), limit: suggest_limit},
+            dataType: 'json'
+        });
+        xhr.then(function(resp) {
+            if(xhr !== suggest_pending) return;
+            suggest_pending = null;
+            on_suggestions(resp);
+        });
+    }, suggest_delay);
+
+    // Completions response handler that lists matching files under the input
+    var on_suggestions = function(resp) {
+        var $suggestions = $('.urth-search-suggestions').empty();
+        for(var i=0; i < resp.results.length; i++) {
+            var result = resp.results[i];
+            var $row = $('<div>')
+                .addClass('urth-search-suggestion')
+                .appendTo($suggestions);
+            $('<a>')
+                .attr('href', result.url)
+                .attr('target', '_blank')
+                .text(result.basename)
+                .appendTo($row);
+            $('<span>')
+                .addClass('urth-search-result-actions urth-search-result-location')
+                .text(result.rel_dirname + '/')
+                .appendTo($row);
+        }
+    };
+
+    // Get a result page and its ETag from session storage
+    var get_cached = function(key) {
+        try {
+            return JSON.parse(sessionStorage[cache_prefix + key] || 'null');
+        } catch(e) {
+            return null;
+        }
+    };
+
+    // Put a result page in session storage, evicting the oldest beyond cache_size
+    var put_cached = function(key, etag, resp) {
+        if(!etag) return;
+        try {
+            var keys = _.without(JSON.parse(sessionStorage[cache_prefix + 'keys'] || '[]'), key);
+            keys.push(key);
+            while(keys.length > cache_size) {
+                delete sessionStorage[cache_prefix + keys.shift()];
+            }
+            sessionStorage[cache_prefix + key] = JSON.stringify({etag: etag, resp: resp});
+            sessionStorage[cache_prefix + 'keys'] = JSON.stringify(keys);
+        } catch(e) {
+            // storage is full or disabled: go without
+        }
+    };
+
+    // Fetch the next page of results for the current query, revalidating
+    // a cached copy of it if there is one
+    var fetch_page = function() {
+        var text = query.text;
+        var data = {qs: text, offset: query.loaded, limit: page_size};
+        if(folder) {
+            // rank files near the folder first, or only search under it
+            data.cwd = folder;
+            if($('.urth-search-scope-input').is(':checked')) {
+                data.scope = folder;
+            }
+        }
+        var key = JSON.stringify([data.qs, data.offset, data.limit, data.cwd, data.scope]);
+        var cached = get_cached(key);
+        query.pending = $.ajax({
+            url: search_url,
+            data: data,
+            dataType: 'json',
+            headers: cached ? {'If-None-Match': cached.etag} : {}
+        });
+        query.pending.then(function(resp, status, xhr) {
+            // ignore responses for queries that have since been replaced
+            if(text !== query.text) return;
+            query.pending = null;
+            if(xhr.status === 304 && cached) {
+                resp = cached.resp;
+            } else if(xhr.getResponseHeader('Etag')) {
+                // partial results come without a tag: fetch them afresh
+                put_cached(key, xhr.getResponseHeader('Etag'), resp);
+            }
+            on_result(resp);
+        }, function(xhr, status) {
+            if(status === 'abort' || text !== query.text) return;
+            query.pending = null;
+            on_error(xhr);
+        });
+    };
+
+    // Fetch more results if the user has scrolled near the end of the list
+    var on_scroll = function() {
+        var el = $('.urth-search-results').get(0);
+        if(!el || query.pending || query.loaded >= query.total) return;
+        if(el.scrollTop + el.clientHeight >= el.scrollHeight - scroll_margin) {
+            fetch_page();
+        }
+    };
+
     // Search response handler that populates the dialog
     var on_result = function(resp) {
         var $results = $('.urth-search-results');
 
         if(resp.total === 0) {
-            $('.urth-search-summary').text(messages.search_no_hits);
+            $('.urth-search-summary').text(messages.search_no_hits +
+                (resp.truncated ? messages.search_truncated : ''));
             return;
         }
 
         var results = resp.results;
+        query.loaded = resp.offset + results.length;
+        query.total = resp.total;
         $('.urth-search-summary')
             .text(_.template(messages.search_hits_tmpl)({
-                hits: results.length,
+                hits: query.loaded,
                 total: resp.total
-            }));
+            }) + (resp.truncated ? messages.search_truncated : ''));
 
         for(var i=0; i < results.length; i++) {
             var result = results[i];
@@ -53,7 +220,7 @@ define([
                 .appendTo($results);
             $('<div>')
                 .addClass('col-xs-1')
-                .text((i+1)+'.')
+                .text((resp.offset+i+1)+'.')
                 .appendTo($row);
             var $info = $('<div>')
                 .addClass('col-xs-11')
@@ -95,25 +262,51 @@ define([
                     .appendTo($actions);
             }
         }
+
+        // keep going if the first page does not fill the list
+        on_scroll();
     };
 
     // Search error handler that shows an brief error message in the dialog
-    var on_error = function() {
+    var on_error = function(xhr) {
+        if(xhr && xhr.status === 400) {
+            $('.urth-search-summary').text(messages.search_bad_query);
+            return;
+        }
         $('.urth-search-summary').text('Error fetching results');
     };
 
+    // Replace the results showing with the first page for a query
+    var run_query = function(text) {
+        clear_suggestions();
+        $('.urth-search-summary').text(messages.search_status);
+        $('.urth-search-results').empty();
+        localStorage['urth.last_query_string'] = text;
+        reset_query(text);
+        fetch_page();
+    };
+
+    // Run the query again when the search is narrowed to the folder or widened
+    $(document).on('change', '.urth-search-scope-input', function() {
+        if(query.text) {
+            run_query(query.text);
+        }
+    });
+
     // Register a listener once for keypress on the search input
     $(document).on('keyup', '.urth-search-input', function(event) {
+        var text = $.trim($(event.target).val());
         if(event.keyCode === keyboard.keycodes.enter) {
-            var text = $.trim($(event.target).val());
-            $('.urth-search-summary').text(messages.search_status);
-            $('.urth-search-results').empty();
-            localStorage['urth.last_query_string'] = text;
-            $.ajax({
-                url: search_url,
-                data: {qs: text},
-                dataType: 'json'
-            }).then(on_result, on_error);
+            run_query(text);
+        } else if(text !== suggest_text) {
+            // only complete what looks like the start of a filename, not a
+            // query with several terms or fields
+            if(!text || /[\s:]/.test(text)) {
+                clear_suggestions();
+            } else {
+                suggest_text = text;
+                fetch_suggestions(text);
+            }
         }
     });
 
@@ -122,18 +315,28 @@ define([
     //      * notebook: Instance of notebook over which to show the dialog
     //      * keyboard_manager: Keyboard manager for the notebook
     //      * can_insert: Show insertion action links for results
+    //      * folder: Path of the current folder relative to the notebook
+    //        directory, to rank results in it first and offer to search only it
     exports.show_dialog = function(args) {
         // Prevent overlapping dialogs
         if($('.urth-search-input').length) return;
 
         can_insert = args.can_insert === undefined ? true : args.can_insert;
+        folder = args.folder || '';
         var dlg = dialog.modal({
             title: messages.search_dialog_title,
-            body: template({messages: messages}),
+            body: template({
+                messages: messages,
+                scope_label: folder ? _.template(messages.search_scope_tmpl)({folder: folder}) : ''
+            }),
             sanitize: false,
             keyboard_manager: args.keyboard_manager,
             notebook: args.notebook,
             open: function() {
+                reset_query(null);
+                clear_suggestions();
+                // scroll events do not bubble, so bind to the list itself
+                $('.urth-search-results').on('scroll', _.throttle(on_scroll, 100));
                 $('.urth-search-input').focus();
                 var qs = localStorage['urth.last_query_string'];
                 if(qs) {
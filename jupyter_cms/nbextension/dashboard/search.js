@@ -6,9 +6,18 @@
 define([
     'base/js/events',
     'base/js/keyboard',
+    'base/js/utils',
     'notebook/js/actions',
     '../common/search'
-], function(events, keyboard, actions, search) {
+], function(events, keyboard, utils, actions, search) {
+    // Show the search dialog for the folder being listed
+    var show_dialog = function() {
+        search.show_dialog({
+            can_insert: false,
+            folder: utils.get_body_data('notebookPath')
+        });
+    };
+
     // Create a shortcut manager
     var acts = new actions.init();
     var shortcut_manager = new keyboard.ShortcutManager(undefined, events, acts, {});
@@ -18,7 +27,7 @@ define([
         help: 'Show search dialog',
         handler: function(env) {
             // Show search dialog without insert actions
-            search.show_dialog({can_insert: false});
+            show_dialog();
         }
     });
 
@@ -33,8 +42,6 @@ define([
         .attr('title', 'Search files')
         .addClass('btn btn-default btn-xs')
         .text('Search')
-        .on('click', function() {
-            search.show_dialog({can_insert: false});
-        })
+        .on('click', show_dialog)
         .prependTo($toolbar);
 });
\ No newline at end of file
@@ -6,11 +6,12 @@
 define([
     'base/js/events',
     'base/js/keyboard',
+    'base/js/utils',
     'notebook/js/actions',
     '../common/search',
     '../common/importer',
     '../common/topics'
-], function(events, keyboard, actions, search, importer) {
+], function(events, keyboard, utils, actions, search, importer) {
     // Create a shortcut manager
     var acts = new actions.init();
     var shortcut_manager = new keyboard.ShortcutManager(undefined, events, acts, {});
@@ -19,7 +20,9 @@ define([
     shortcut_manager.add_shortcut('ctrl-cmd-s', {
         help: 'Show search dialog',
         handler: function(env) {
-            search.show_dialog({});
+            // the folder of the file being edited
+            var path = utils.get_body_data('filePath');
+            search.show_dialog({folder: path.substring(0, path.lastIndexOf('/'))});
         }
     });
 
@@ -12,7 +12,10 @@ define({
     search_query_link: 'Query Help',
     search_hits_tmpl: 'Showing <%= hits %> of <%= total %> matches',
     search_no_hits: 'No matches',
-    search_status: 'Indexing and searching ...',
+    search_scope_tmpl: 'Only search in <%= folder %>/',
+    search_truncated: ' (partial: the query was too broad or slow to finish)',
+    search_bad_query: 'The query is too long',
+    search_status: 'Searching ...',
 
     insert_path: 'Insert Path',
     insert_import: 'Insert Import',
@@ -10,13 +10,20 @@ define([
     '../common/importer',
     '../common/topics'
 ], function(IPython, events, search, importer) {
+    // Show the search dialog for the folder of the notebook
+    var show_dialog = function() {
+        var path = IPython.notebook.notebook_path;
+        search.show_dialog({
+            notebook: IPython.notebook,
+            keyboard_manager: IPython.notebook.keyboard_manager,
+            folder: path.substring(0, path.lastIndexOf('/'))
+        });
+    };
+
     IPython.keyboard_manager.command_shortcuts.add_shortcut('ctrl-cmd-s', {
         help: 'Show search dialog',
         handler: function(env) {
-            search.show_dialog({
-                notebook: IPython.notebook,
-                keyboard_manager: IPython.notebook.keyboard_manager
-            });
+            show_dialog();
         }
     });
 
@@ -25,12 +32,7 @@ define([
     var $search = $('<button>')
         .attr('title', 'Search files')
         .addClass('btn btn-default')
-        .on('click', function() {
-            search.show_dialog({
-                notebook: IPython.notebook,
-                keyboard_manager: IPython.notebook.keyboard_manager
-            });
-        })
+        .on('click', show_dialog)
         .prependTo($toolbar);
     $('<i>')
         .addClass('fa-search fa')
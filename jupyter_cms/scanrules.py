@@ -0,0 +1,134 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+'''
+Rules that keep the index scanner out of trees nobody searches.
+'''
+from fnmatch import fnmatchcase
+import io
+import os
+
+# File whose presence marks a directory as a virtualenv
+VENV_MARKER = 'pyvenv.cfg'
+
+
+class _IgnorePattern(object):
+    '''
+    One line of a .gitignore style file: a glob matched against the
+    basename, or against the path relative to the file's directory if it
+    contains a slash. A trailing slash matches only directories and a
+    leading ! re-includes what an earlier pattern excluded.
+    '''
+    def __init__(self, line):
+        self.negate = line.startswith('!')
+        if self.negate:
+            line = line[1:]
+        self.dir_only = line.endswith('/')
+        line = line.rstrip('/')
+        self.anchored = '/' in line
+        self.glob = line.lstrip('/')
+
+    def matches(self, rel_path, is_dir):
+        if self.dir_only and not is_dir:
+            return False
+        if self.anchored:
+            return fnmatchcase(rel_path, self.glob)
+        return fnmatchcase(rel_path.rsplit('/', 1)[-1], self.glob)
+
+
+class ScanRules(object):
+    '''
+    Decides which files and directories under root the scanner skips:
+    those matching an exclude glob or a pattern in an ignore file of an
+    enclosing directory, and directories below max_depth. Ignore files are
+    read once per instance, so make a new one for each scan.
+    '''
+    def __init__(self, root, exclude=(), ignore_files=(), max_depth=0, max_dir_files=0):
+        self.root = root
+        self.exclude = list(exclude)
+        self.ignore_files = list(ignore_files)
+        self.max_depth = max_depth
+        self.max_dir_files = max_dir_files
+        self._patterns = {}
+
+    def key(self):
+        '''
+        Gets a value that changes whenever the configured rules do.
+        '''
+        return [self.exclude, self.ignore_files, self.max_depth, self.max_dir_files]
+
+    def _rel_path(self, path):
+        rel_path = os.path.relpath(path, self.root)
+        return '' if rel_path == os.curdir else rel_path.replace(os.sep, '/')
+
+    def _load_patterns(self, dirpath):
+        patterns = []
+        for name in self.ignore_files:
+            try:
+                with io.open(os.path.join(dirpath, name), 'r', encoding='utf-8', errors='replace') as f:
+                    lines = f.read().splitlines()
+            except (IOError, OSError):
+                continue
+            lines = [line.strip() for line in lines]
+            patterns.extend(_IgnorePattern(line) for line in lines
+                            if line and not line.startswith('#'))
+        return patterns
+
+    def _dir_patterns(self, dirpath):
+        patterns = self._patterns.get(dirpath)
+        if patterns is None:
+            patterns = self._patterns[dirpath] = self._load_patterns(dirpath)
+        return patterns
+
+    def excluded(self, path, is_dir):
+        '''
+        Gets if the scanner should skip the file or directory at path.
+        '''
+        rel_path = self._rel_path(path)
+        if not rel_path:
+            return False
+        name = rel_path.rsplit('/', 1)[-1]
+        for glob in self.exclude:
+            if fnmatchcase(name, glob) or fnmatchcase(rel_path, glob):
+                return True
+        if not self.ignore_files:
+            return False
+        # apply the ignore files from the root down, the nearest one last
+        excluded = False
+        segments = rel_path.split('/')
+        for depth in range(len(segments)):
+            dirpath = os.path.join(self.root, *segments[:depth])
+            rel_to_dir = '/'.join(segments[depth:])
+            for pattern in self._dir_patterns(dirpath):
+                if pattern.matches(rel_to_dir, is_dir):
+                    excluded = not pattern.negate
+        return excluded
+
+    def descend(self, path):
+        '''
+        Gets if the scanner should list the subdirectories of path.
+        '''
+        if not self.max_depth:
+            return True
+        rel_path = self._rel_path(path)
+        depth = len(rel_path.split('/')) if rel_path else 0
+        return depth < self.max_depth
+
+    def within(self, path):
+        '''
+        Gets if path and every directory between it and root pass the rules
+        and none of those directories is a virtualenv.
+        '''
+        rel_path = self._rel_path(path)
+        if not rel_path:
+            return True
+        segments = rel_path.split('/')
+        if self.max_depth and len(segments) - 1 > self.max_depth:
+            return False
+        for depth in range(1, len(segments) + 1):
+            ancestor = os.path.join(self.root, *segments[:depth])
+            is_dir = depth < len(segments) or os.path.isdir(path)
+            if self.excluded(ancestor, is_dir):
+                return False
+            if is_dir and os.path.isfile(os.path.join(ancestor, VENV_MARKER)):
+                return False
+        return True
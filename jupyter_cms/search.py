@@ -1,27 +1,105 @@
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
-from .index import Index
+from .indexer import IndexManager
+from .index import QueryError
+from .indexserver import MAX_PAGE_SIZE, MAX_SUGGESTIONS
+from . import metrics
 from notebook.utils import url_path_join
 from notebook.base.handlers import IPythonHandler
-from tornado import web
+from tornado import gen, web
+import hashlib
+import json
 import os
 
 class SearchHandler(IPythonHandler):
-    def initialize(self, work_dir):
-        self.index = Index(work_dir)
+    def initialize(self, work_dir, manager):
+        self.manager = manager
+        self.index = manager.index
+        self.executor = manager.executor
         self.work_dir = work_dir
         self.work_dir_len = len(self.work_dir)+1
+        self.truncated = False
 
     @web.authenticated
+    @gen.coroutine
     def get(self):
         query_string = self.get_query_argument('qs')
-        reindex = bool(self.get_query_argument('reindex', 'true') == 'true')
+        # the background indexer keeps the index current; only rescan the
+        # disk when a client explicitly asks for it or nothing watches it
+        reindex = bool(self.get_query_argument('reindex', 'false') == 'true')
+        try:
+            offset = int(self.get_query_argument('offset', '0'))
+            limit = int(self.get_query_argument('limit', '25'))
+        except ValueError:
+            raise web.HTTPError(400, 'offset and limit must be integers')
+        if offset < 0 or not 0 < limit <= MAX_PAGE_SIZE:
+            raise web.HTTPError(400, 'offset must be >= 0 and limit in 1..%d' % MAX_PAGE_SIZE)
+        # folder to rank first and subtree to limit the search to, relative
+        # to the notebook directory
+        cwd = self.get_folder('cwd')
+        scope = self.get_folder('scope')
 
-        if reindex:
-            self.index.update_index()
+        # scan, write, and search on the executor to keep the IOLoop free;
+        # without a filesystem watcher, update before searching as well so
+        # that new files show up without waiting for a reconciliation scan
+        if reindex or not self.manager.watching:
+            yield self.manager.request_update()
 
-        results, total = self.index.search(query_string)
+        # tag the response with the index generation and the query so that
+        # clients can revalidate what they have instead of fetching it again
+        generation = yield self.executor.submit(self.index.generation)
+        self.set_header('Cache-Control', 'private, no-cache')
+        self.set_header('Etag', self.search_etag(generation, query_string, offset, limit,
+                                                 cwd, scope))
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+            return
 
+        try:
+            results, total, truncated = yield self.executor.submit(self.index.search,
+                query_string, limit=limit, offset=offset, cwd=cwd, root=scope)
+        except QueryError as e:
+            raise web.HTTPError(400, str(e))
+        if truncated:
+            # a retry may get further, so don't let clients keep partial results
+            self.truncated = True
+            self.clear_header('Etag')
+        self.add_urls(results)
+        self.write(dict(results=results, total=total, offset=offset, limit=limit,
+                        truncated=truncated))
+        self.finish()
+
+    def compute_etag(self):
+        # without this, finish() would tag partial results by their body
+        if self.truncated:
+            return None
+        return super(SearchHandler, self).compute_etag()
+
+    def search_etag(self, generation, query_string, offset, limit, cwd, scope):
+        key = json.dumps([generation, ' '.join(query_string.split()), offset, limit, cwd, scope])
+        return '"%s"' % hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get_folder(self, name):
+        '''
+        Gets the absolute path of the folder named by a query argument
+        relative to the work_dir, or None if it is absent or names the
+        work_dir itself. Refuses paths that lead out of the work_dir.
+        '''
+        rel_path = self.get_query_argument(name, '').strip('/')
+        if not rel_path:
+            return None
+        path = os.path.normpath(os.path.join(self.work_dir, *rel_path.split('/')))
+        if path == os.path.normpath(self.work_dir):
+            return None
+        if not path.startswith(self.work_dir.rstrip(os.sep) + os.sep):
+            raise web.HTTPError(400, '%s must be a folder in the notebook directory' % name)
+        return path
+
+    def add_urls(self, results):
+        '''
+        Adds the URLs and work_dir relative paths of each result.
+        '''
         for result in results:
             rel_path = result['path'][self.work_dir_len:]
             if rel_path.endswith('.ipynb'):
@@ -35,15 +113,62 @@ class SearchHandler(IPythonHandler):
             # Add relative paths
             result['rel_dirname'] = os.path.dirname(rel_path)
             result['rel_path'] = rel_path
-        
-        self.write(dict(results=results, total=total))
+
+class SuggestHandler(SearchHandler):
+    '''
+    Completes a filename prefix from the in-memory list of indexed files.
+    '''
+    @web.authenticated
+    @gen.coroutine
+    def get(self):
+        prefix = self.get_query_argument('prefix')
+        try:
+            limit = int(self.get_query_argument('limit', '10'))
+        except ValueError:
+            raise web.HTTPError(400, 'limit must be an integer')
+        if not 0 < limit <= MAX_SUGGESTIONS:
+            raise web.HTTPError(400, 'limit must be in 1..%d' % MAX_SUGGESTIONS)
+
+        results = []
+        if prefix:
+            # the first call builds the list from the index, so stay off the IOLoop
+            results = yield self.executor.submit(self.index.suggest, prefix, limit)
+        self.add_urls(results)
+        self.write(dict(results=results, prefix=prefix))
+        self.finish()
+
+class MetricsHandler(IPythonHandler):
+    '''
+    Serves the search and index metrics in the Prometheus text format.
+    '''
+    def initialize(self, manager):
+        self.index = manager.index
+        self.executor = manager.executor
+
+    @gen.coroutine
+    def get(self):
+        # let scrapers in without a login if the server allows it for its
+        # own /metrics endpoint
+        if self.settings.get('authenticate_prometheus', True) and not self.logged_in:
+            raise web.HTTPError(403)
+        # read the index size and segments at scrape time
+        yield self.executor.submit(self.index.stats)
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(metrics.REGISTRY.render())
         self.finish()
 
 def load_jupyter_server_extension(nb_app):
+    manager = IndexManager(parent=nb_app, log=nb_app.log, work_dir=nb_app.notebook_dir)
+    manager.start()
+
     web_app = nb_app.web_app
     host_pattern = '.*$'
     route_pattern = url_path_join(web_app.settings['base_url'], '/search')
-    handler_kwargs = dict(work_dir=nb_app.notebook_dir)
+    handler_kwargs = dict(work_dir=nb_app.notebook_dir, manager=manager)
+    suggest_route_pattern = url_path_join(web_app.settings['base_url'], '/search/suggest')
+    metrics_route_pattern = url_path_join(web_app.settings['base_url'], '/search/metrics')
     web_app.add_handlers(host_pattern, [
-        (route_pattern, SearchHandler, handler_kwargs)
+        (route_pattern, SearchHandler, handler_kwargs),
+        (suggest_route_pattern, SuggestHandler, handler_kwargs),
+        (metrics_route_pattern, MetricsHandler, dict(manager=manager))
     ])
@@ -0,0 +1,316 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+'''
+Search index split into one sub-index per top-level directory.
+'''
+from .index import Index, root_digest, LOCK_SKIPS, INDEX_DOCUMENTS, INDEX_SEGMENTS, INDEX_SIZE_BYTES
+from .scanrules import ScanRules, VENV_MARKER
+from jupyter_core.paths import jupyter_data_dir
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import shutil
+import threading
+
+# Use the built-in version of scandir if possible, otherwise
+# use the scandir module version
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+# Name of the shard that holds the files directly in the root
+ROOT_SHARD = ''
+
+
+class ShardedIndex(object):
+    '''
+    Stands in for an Index by keeping one Index per top-level directory of
+    the work_dir, plus one for the files directly in it. An update only
+    takes the locks and rewrites the segments of the shards whose trees
+    changed, and searches fan out across the shards on a thread pool.
+    '''
+    # shared instances by absolute notebook root
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    # let every shard fork writer processes, as Index.fork_writers
+    fork_writers = Index.fork_writers
+
+    # number of recent result pages each shard keeps until its next commit
+    result_cache_size = 128
+
+    # bytes of each notebook every shard reads to extract its cell sources
+    read_limit = Index.read_limit
+
+    # scan rules handed to every shard, relative to the work_dir
+    exclude = Index.exclude
+    ignore_files = Index.ignore_files
+    max_depth = Index.max_depth
+    max_dir_files = Index.max_dir_files
+
+    # query cost limits applied by every shard
+    search_time_limit = Index.search_time_limit
+    max_query_length = Index.max_query_length
+    max_expansions = Index.max_expansions
+
+    def __init__(self, work_dir, workers=1, limitmb=128, content_limit=1024*1024,
+                 use_manifest=True, threads=4, storage_dir=None, in_memory=False):
+        self.work_dir = work_dir
+        self.in_memory = in_memory
+        self.workers = workers
+        self.limitmb = limitmb
+        self.content_limit = content_limit
+        self.use_manifest = use_manifest
+        self.threads = threads
+        # searches and updates get pools of their own, so that searches never
+        # queue behind a slow shard update
+        self._pool = None
+        self._update_pool = None
+        self._shards = {}
+        self._shards_lock = threading.Lock()
+        self._update_lock = threading.Lock()
+        self._shards_dir = os.path.join(storage_dir or jupyter_data_dir(), 'index_shards',
+                                        root_digest(work_dir))
+
+    @classmethod
+    def for_root(cls, work_dir, **kwargs):
+        '''
+        Gets the ShardedIndex shared by everything serving the given notebook
+        root, creating it with the keyword arguments on first use.
+        '''
+        key = os.path.abspath(work_dir)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(work_dir, **kwargs)
+            return cls._instances[key]
+
+    def _digest(self, name):
+        return hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+    def _shard_name(self, path):
+        '''
+        Gets the name of the shard that holds path: its top-level directory
+        under the work_dir, or ROOT_SHARD. Returns None for paths outside the
+        work_dir or in hidden directories.
+        '''
+        rel_path = os.path.relpath(path, self.work_dir)
+        if rel_path == os.curdir:
+            return ROOT_SHARD
+        name = rel_path.split(os.sep, 1)[0]
+        if name == os.pardir or name.startswith('.'):
+            return None
+        if os.sep not in rel_path and name not in self._shards and not os.path.isdir(path):
+            return ROOT_SHARD
+        return name
+
+    def _index_dir(self, name):
+        return os.path.join(self._shards_dir, self._digest(name))
+
+    def _shard(self, name):
+        '''
+        Gets the shard with the given name, opening or creating it on first
+        use, configured like this index.
+        '''
+        with self._shards_lock:
+            shard = self._shards.get(name)
+            if shard is None:
+                shard = self._shards[name] = Index(
+                    os.path.join(self.work_dir, name) if name else self.work_dir,
+                    index_dir=self._index_dir(name),
+                    recursive=bool(name),
+                    in_memory=self.in_memory)
+        shard.workers = self.workers
+        shard.fork_writers = self.fork_writers
+        shard.limitmb = self.limitmb
+        shard.content_limit = self.content_limit
+        shard.read_limit = self.read_limit
+        shard.use_manifest = self.use_manifest
+        shard.result_cache_size = self.result_cache_size
+        shard.exclude = self.exclude
+        shard.ignore_files = self.ignore_files
+        shard.max_depth = self.max_depth
+        shard.max_dir_files = self.max_dir_files
+        shard.scan_root = self.work_dir
+        shard.search_time_limit = self.search_time_limit
+        shard.max_query_length = self.max_query_length
+        shard.max_expansions = self.max_expansions
+        return shard
+
+    def _find_shard(self, name):
+        '''
+        Gets the shard with the given name for a search, or None if it is
+        not open and no top-level directory the scan rules allow has that
+        name, so that searches never create indexes for made-up paths.
+        '''
+        with self._shards_lock:
+            known = name in self._shards
+        if not known and name:
+            path = os.path.join(self.work_dir, name)
+            rules = self._rules()
+            if (name.startswith('.') or not os.path.isdir(path) or
+                not rules.descend(self.work_dir) or rules.excluded(path, True) or
+                os.path.isfile(os.path.join(path, VENV_MARKER))):
+                return None
+        return self._shard(name)
+
+    def _drop_shard(self, name):
+        with self._shards_lock:
+            self._shards.pop(name, None)
+        shutil.rmtree(self._index_dir(name), True)
+
+    def _open_shards(self):
+        '''
+        Gets the shards of the top-level directories on disk, creating any
+        that are new and dropping any whose directory is gone.
+        '''
+        rules = self._rules()
+        names = set([ROOT_SHARD])
+        if rules.descend(self.work_dir):
+            for entry in scandir(self.work_dir):
+                path = os.path.join(self.work_dir, entry.name)
+                if (not entry.name.startswith('.') and entry.is_dir() and
+                    not rules.excluded(path, True) and
+                    not os.path.isfile(os.path.join(path, VENV_MARKER))):
+                    names.add(entry.name)
+        for name in set(self._shards) - names:
+            self._drop_shard(name)
+        return [self._shard(name) for name in sorted(names)]
+
+    def _rules(self):
+        return ScanRules(self.work_dir, self.exclude, self.ignore_files,
+                         self.max_depth, self.max_dir_files)
+
+    def _map(self, func, shards):
+        with self._shards_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.threads)
+        return list(self._pool.map(func, shards))
+
+    def _map_updates(self, func, shards):
+        with self._shards_lock:
+            if self._update_pool is None:
+                self._update_pool = ThreadPoolExecutor(self.threads)
+        return list(self._update_pool.map(func, shards))
+
+    def update_index(self, full=False):
+        '''
+        Updates every shard in parallel. Returns False if any of them was
+        locked and skipped.
+        '''
+        if not self._update_lock.acquire(False):
+            LOCK_SKIPS.inc(lock='update')
+            return False
+        try:
+            return all(self._map_updates(lambda shard: shard.update_index(full), self._open_shards()))
+        finally:
+            self._update_lock.release()
+
+    def update_paths(self, paths):
+        '''
+        Updates the given paths in the shards that hold them. A top-level
+        directory that is gone takes its shard with it.
+
+        Returns False if any shard was locked and skipped.
+        '''
+        rules = self._rules()
+        by_shard = {}
+        for path in paths:
+            name = self._shard_name(path)
+            if name is None:
+                continue
+            if name and not os.path.isdir(os.path.join(self.work_dir, name)):
+                self._drop_shard(name)
+                continue
+            if name and name not in self._shards and not rules.within(os.path.join(self.work_dir, name)):
+                # don't open a shard for a directory the rules exclude
+                continue
+            by_shard.setdefault(name, []).append(path)
+        return all(self._map_updates(lambda name: self._shard(name).update_paths(by_shard[name]),
+                                     list(by_shard)))
+
+    def _search_shards(self, root):
+        '''
+        Gets the shards that may hold files under root.
+        '''
+        if root is not None:
+            name = self._shard_name(root)
+            if name is None:
+                return []
+            if name:
+                shard = self._find_shard(name)
+                return [shard] if shard is not None else []
+        with self._shards_lock:
+            names = list(self._shards)
+        if not names:
+            return self._open_shards()
+        return [self._shard(name) for name in sorted(names)]
+
+    def search(self, query_string, limit=25, cwd=None, offset=0, root=None):
+        '''
+        Searches every shard that may hold files under root and merges their
+        hits by score. Scores come from each shard's own term statistics, so
+        they only approximate those of a single index. The results are
+        truncated if those of any shard were.
+        '''
+        pages = self._map(lambda shard: shard.search(query_string, limit=offset + limit,
+                                                     cwd=cwd, root=root),
+                          self._search_shards(root))
+        hits = sorted((hit for results, total, truncated in pages for hit in results),
+                      key=lambda hit: (-hit['score'], hit['path']))
+        return (hits[offset:offset + limit],
+                sum(total for results, total, truncated in pages),
+                any(truncated for results, total, truncated in pages))
+
+    def suggest(self, prefix, limit=10, root=None):
+        '''
+        Gets up to limit files whose basename starts with prefix from every
+        shard, or whose path relative to root does if the prefix names a
+        directory.
+        '''
+        if '/' in prefix or os.sep in prefix:
+            path = os.path.join(root or self.work_dir, prefix.replace('/', os.sep))
+            name = self._shard_name(path)
+            if not name:
+                # a separator can only lead into a shard's directory
+                return []
+            shard = self._find_shard(name)
+            if shard is None:
+                return []
+            if root is not None and len(root) > len(shard.work_dir):
+                return shard.suggest(prefix, limit, root)
+            return shard.suggest(path[len(shard.work_dir) + 1:], limit)
+        lower = prefix.lower()
+        results = [result for results in self._map(lambda shard: shard.suggest(prefix, limit, root),
+                                                   self._search_shards(root))
+                   for result in results if result['basename'].lower().startswith(lower)]
+        return sorted(results, key=lambda result: result['path'])[:limit]
+
+    def generation(self):
+        with self._shards_lock:
+            shards = sorted(self._shards.items())
+        key = ','.join('%s:%s' % (name, shard.generation()) for name, shard in shards)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def stats(self):
+        '''
+        Sums the document counts, segments, and sizes of the shards.
+        '''
+        stats = dict(documents=0, segments=0, size_bytes=0)
+        shards = self._open_shards()
+        for shard_stats in self._map(lambda shard: shard.stats(), shards):
+            for key in stats:
+                stats[key] += shard_stats[key]
+        INDEX_DOCUMENTS.set(stats['documents'])
+        INDEX_SEGMENTS.set(stats['segments'])
+        INDEX_SIZE_BYTES.set(stats['size_bytes'])
+        stats['shards'] = len(shards)
+        return stats
+
+    def reset_index(self):
+        '''
+        Clears the search index.
+        '''
+        with self._shards_lock:
+            self._shards = {}
+        shutil.rmtree(self._shards_dir, True)
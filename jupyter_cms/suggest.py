@@ -0,0 +1,94 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+'''
+In-memory prefix lookup of indexed file names for typeahead completions.
+'''
+from bisect import bisect_left
+import os
+import threading
+
+
+class PathSuggester(object):
+    '''
+    Sorted arrays of the lowercased basenames and relative paths of the
+    files under a root, searched by bisection for case-insensitive prefix
+    matches. Adds and removes are idempotent so that replaying a commit the
+    arrays were built after does no harm.
+    '''
+    def __init__(self, work_dir, paths=()):
+        self.work_dir_len = len(work_dir) + 1
+        self._lock = threading.Lock()
+        self._by_name = sorted(self._name_key(path) for path in paths)
+        self._by_path = sorted(self._path_key(path) for path in paths)
+
+    def __len__(self):
+        return len(self._by_path)
+
+    def _name_key(self, path):
+        return (os.path.basename(path).lower(), path)
+
+    def _path_key(self, path):
+        return (path[self.work_dir_len:].lower(), path)
+
+    def _insert(self, items, key):
+        i = bisect_left(items, key)
+        if i == len(items) or items[i] != key:
+            items.insert(i, key)
+
+    def _delete(self, items, key):
+        i = bisect_left(items, key)
+        if i < len(items) and items[i] == key:
+            del items[i]
+
+    def add(self, path):
+        with self._lock:
+            self._insert(self._by_name, self._name_key(path))
+            self._insert(self._by_path, self._path_key(path))
+
+    def remove(self, path):
+        with self._lock:
+            self._delete(self._by_name, self._name_key(path))
+            self._delete(self._by_path, self._path_key(path))
+
+    def remove_dir(self, dirname):
+        '''
+        Removes every path under a directory.
+        '''
+        prefix = self._path_key(dirname + os.sep)[0]
+        with self._lock:
+            for path in list(self._scan(self._by_path, prefix)):
+                self._delete(self._by_name, self._name_key(path))
+                self._delete(self._by_path, self._path_key(path))
+
+    def _scan(self, items, prefix):
+        i = bisect_left(items, (prefix,))
+        while i < len(items) and items[i][0].startswith(prefix):
+            yield items[i][1]
+            i += 1
+
+    def suggest(self, prefix, limit=10, within=None):
+        '''
+        Gets up to limit absolute paths of files whose basename starts with
+        prefix, then of those whose path relative to the root does. If within
+        names a directory under the root, only paths beneath it match, with
+        relative paths taken from there.
+        '''
+        prefix = prefix.lower().replace('/', os.sep)
+        rel_within = ''
+        under = None
+        if within is not None and len(within) >= self.work_dir_len:
+            under = within.rstrip(os.sep) + os.sep
+            rel_within = self._path_key(under)[0]
+        paths = []
+        with self._lock:
+            # a separator can only match a relative path
+            sources = [(self._by_path, rel_within + prefix)]
+            if os.sep not in prefix:
+                sources.insert(0, (self._by_name, prefix))
+            for items, key in sources:
+                for path in self._scan(items, key):
+                    if len(paths) >= limit:
+                        return paths
+                    if (under is None or path.startswith(under)) and path not in paths:
+                        paths.append(path)
+        return paths
@@ -27,6 +27,20 @@ try:
 except ImportError:
     install_requires.append('scandir>=1.1,<2.0')
 
+# Use the built-in version of concurrent.futures if possible,
+# otherwise require the backport
+try:
+    import concurrent.futures
+except ImportError:
+    install_requires.append('futures>=3.0')
+
+extras_require = {
+    # keep the search index current from filesystem events
+    'watch': ['watchdog>=0.8'],
+    # stream cell sources out of notebooks without loading their outputs
+    'ijson': ['ijson>=3.0'],
+}
+
 setup_args = dict(
     name='jupyter_cms',
     author='Jupyter Development Team',
@@ -55,6 +69,7 @@ for more information.
         'scripts/jupyter-cms',
     ],
     install_requires=install_requires,
+    extras_require=extras_require,
     classifiers=[
         'Intended Audience :: Developers',
         'Intended Audience :: System Administrators',
@@ -0,0 +1,23 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+from jupyter_cms.extensionapp import IndexBuildApp, IndexResetApp, IndexUpdateApp
+from test_index import IndexTestCase
+
+class TestIndexCommands(IndexTestCase):
+    '''Tests for the offline index commands.'''
+    def run_app(self, cls, *argv):
+        app = cls()
+        app.initialize(['--root-dir=' + self.work_dir] + list(argv))
+        app.start()
+        return app
+
+    def test_build_update_reset(self):
+        '''Should build, update, and clear the index of the root dir.'''
+        app = self.run_app(IndexBuildApp, '--workers=2')
+        index = app.get_index()
+        self.assertEqual(index.workers, 2)
+        self.assertEqual(index.stats()['documents'], 3)
+        self.run_app(IndexUpdateApp)
+        self.assertEqual(index.stats()['documents'], 3)
+        self.run_app(IndexResetApp)
+        self.assertEqual(app.get_index().stats()['documents'], 0)
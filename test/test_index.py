@@ -0,0 +1,934 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+
+import io
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join as pjoin
+import jupyter_cms.index as index_module
+from jupyter_cms.index import Index
+from jupyter_cms.indexer import IndexManager, Observer, _EventHandler
+
+def write_notebook(path, *sources):
+    '''Writes a minimal v4 notebook with one code cell per source.'''
+    nb = {
+        'cells': [{
+            'cell_type': 'code',
+            'execution_count': None,
+            'metadata': {},
+            'outputs': [],
+            'source': source
+        } for source in sources],
+        'metadata': {},
+        'nbformat': 4,
+        'nbformat_minor': 0
+    }
+    with io.open(path, 'w', encoding='utf-8') as fh:
+        fh.write(json.dumps(nb, ensure_ascii=False))
+
+class IndexTestCase(unittest.TestCase):
+    '''Base class that isolates the work dir and index storage.'''
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.work_dir = tempfile.mkdtemp()
+        self.save_data_dir = os.environ.get('JUPYTER_DATA_DIR')
+        os.environ['JUPYTER_DATA_DIR'] = self.data_dir
+
+        os.makedirs(pjoin(self.work_dir, 'sub'))
+        os.makedirs(pjoin(self.work_dir, '.hidden'))
+        write_notebook(pjoin(self.work_dir, 'alpha.ipynb'), 'import zebra')
+        write_notebook(pjoin(self.work_dir, 'sub', 'beta.ipynb'), 'print("giraffe")')
+        write_notebook(pjoin(self.work_dir, '.hidden', 'gamma.ipynb'), 'zebra = 1')
+        with open(pjoin(self.work_dir, 'sub', 'notes.txt'), 'w') as fh:
+            fh.write('zebra')
+
+    def tearDown(self):
+        if self.save_data_dir is None:
+            del os.environ['JUPYTER_DATA_DIR']
+        else:
+            os.environ['JUPYTER_DATA_DIR'] = self.save_data_dir
+        shutil.rmtree(self.data_dir, True)
+        shutil.rmtree(self.work_dir, True)
+
+    def paths(self, index, query_string):
+        results, total, truncated = index.search(query_string)
+        return sorted(result['path'] for result in results)
+
+class TestFileToDocument(unittest.TestCase):
+    '''Tests for extracting notebook text to index.'''
+    V4 = {
+        'cells': [
+            {'cell_type': 'markdown', 'metadata': {}, 'source': ['# Title\n', 'more']},
+            {'cell_type': 'code', 'metadata': {}, 'execution_count': 1, 'source': 'x = 1',
+             'outputs': [{'output_type': 'display_data', 'metadata': {},
+                          'data': {'image/png': 'iVBORw0KGgo' * 1000, 'text/plain': 'leaked'}}]}
+        ],
+        'metadata': {}, 'nbformat': 4, 'nbformat_minor': 0
+    }
+    V3 = {
+        'worksheets': [{'cells': [
+            {'cell_type': 'code', 'input': 'y = 2', 'outputs': [{'text': 'leaked'}]},
+            {'cell_type': 'markdown', 'source': 'words'}
+        ]}],
+        'metadata': {}, 'nbformat': 3, 'nbformat_minor': 0
+    }
+
+    def extract(self, nb, limit=1024):
+        f = io.BytesIO(json.dumps(nb).encode('utf-8'))
+        loaded = index_module._load_cell_sources(f, limit)
+        if index_module.ijson is not None:
+            f.seek(0)
+            self.assertEqual(index_module._stream_cell_sources(f, limit), loaded)
+        return loaded
+
+    def test_v4(self):
+        '''Should extract cell sources but no outputs.'''
+        self.assertEqual(self.extract(self.V4), u'# Title\nmore\nx = 1')
+
+    def test_v3(self):
+        '''Should extract cell inputs from v3 worksheets.'''
+        self.assertEqual(self.extract(self.V3), u'y = 2\nwords')
+
+    def test_limit(self):
+        '''Should stop at the content limit.'''
+        self.assertEqual(self.extract(self.V4, 5), u'# Tit')
+
+    def test_read_limit(self):
+        '''Should read no more than the byte budget of a notebook.'''
+        data = json.dumps(self.V4).encode('utf-8')
+        f = io.BytesIO(data)
+        reader = index_module._BudgetReader(f, len(data) // 2)
+        self.assertEqual(len(reader.read()), len(data) // 2)
+        self.assertEqual(reader.read(), b'')
+        self.assertTrue(reader.exhausted)
+        self.assertLessEqual(f.tell(), len(data) // 2 + 1)
+
+        # the json module cannot use part of a document
+        f.seek(0)
+        reader = index_module._BudgetReader(f, len(data) // 2)
+        self.assertEqual(index_module._load_cell_sources(reader, 1024), u'')
+        if index_module.ijson is not None:
+            # streaming keeps the sources before the cut
+            f.seek(0)
+            reader = index_module._BudgetReader(f, len(data) // 2)
+            self.assertEqual(index_module._stream_cell_sources(reader, 1024),
+                             u'# Title\nmore\nx = 1')
+
+        # a budget that covers the file reads all of it
+        f.seek(0)
+        reader = index_module._BudgetReader(f, len(data))
+        self.assertEqual(index_module._load_cell_sources(reader, 1024), u'# Title\nmore\nx = 1')
+        self.assertFalse(reader.exhausted)
+
+    def test_invalid(self):
+        '''Should index the filename of notebooks that fail to parse.'''
+        fd, path = tempfile.mkstemp(suffix='.ipynb')
+        os.write(fd, b'{"cells": [')
+        os.close(fd)
+        try:
+            meta = index_module.file_to_document(path, 0)
+            self.assertEqual(meta['content'], u'')
+            self.assertEqual(meta['basename'], os.path.basename(path))
+        finally:
+            os.remove(path)
+
+class TestIndex(IndexTestCase):
+    '''Tests for building and querying the search index.'''
+    def test_update_index(self):
+        '''Should index notebook content and all filenames outside hidden dirs.'''
+        index = Index(self.work_dir)
+        self.assertTrue(index.update_index())
+        self.assertEqual(self.paths(index, 'zebra'), [pjoin(self.work_dir, 'alpha.ipynb')])
+        self.assertEqual(self.paths(index, 'notes.txt'), [pjoin(self.work_dir, 'sub', 'notes.txt')])
+
+    def test_update_index_removes(self):
+        '''Should drop deleted files from the index.'''
+        index = Index(self.work_dir)
+        index.update_index()
+        os.remove(pjoin(self.work_dir, 'alpha.ipynb'))
+        index.update_index()
+        self.assertEqual(self.paths(index, 'zebra'), [])
+
+    def test_update_paths(self):
+        '''Should add, modify, and remove only the given paths.'''
+        index = Index(self.work_dir)
+        index.update_index()
+
+        write_notebook(pjoin(self.work_dir, 'sub', 'delta.ipynb'), 'zebra()')
+        write_notebook(pjoin(self.work_dir, 'alpha.ipynb'), 'import okapi')
+        self.assertTrue(index.update_paths([
+            pjoin(self.work_dir, 'sub', 'delta.ipynb'),
+            pjoin(self.work_dir, 'alpha.ipynb')
+        ]))
+        self.assertEqual(self.paths(index, 'zebra'), [pjoin(self.work_dir, 'sub', 'delta.ipynb')])
+        self.assertEqual(self.paths(index, 'okapi'), [pjoin(self.work_dir, 'alpha.ipynb')])
+
+        shutil.rmtree(pjoin(self.work_dir, 'sub'))
+        index.update_paths([pjoin(self.work_dir, 'sub')])
+        self.assertEqual(self.paths(index, 'zebra'), [])
+        self.assertEqual(self.paths(index, 'giraffe'), [])
+
+    def test_update_index_parallel(self):
+        '''Should build the same index with worker processes.'''
+        for i in range(8):
+            write_notebook(pjoin(self.work_dir, 'sub', 'nb%d.ipynb' % i), 'okapi%d' % i)
+        index = Index(self.work_dir, workers=2)
+        index.parallel_min_batch = 4
+        self.assertTrue(index.update_index())
+        self.assertEqual(self.paths(index, 'zebra'), [pjoin(self.work_dir, 'alpha.ipynb')])
+        self.assertEqual(self.paths(index, 'okapi7'), [pjoin(self.work_dir, 'sub', 'nb7.ipynb')])
+
+    def test_no_forked_writers(self):
+        '''Should only fork writer processes where allowed.'''
+        from whoosh.multiproc import MpWriter
+        index = Index(self.work_dir, workers=2)
+        writer = index._writer(index.parallel_min_batch)
+        self.assertNotIsInstance(writer, MpWriter)
+        writer.cancel()
+        index.fork_writers = True
+        writer = index._writer(index.parallel_min_batch)
+        self.assertIsInstance(writer, MpWriter)
+        writer.cancel()
+
+    def test_one_pool_per_update(self):
+        '''Should start one worker pool per update, without forking.'''
+        for i in range(8):
+            write_notebook(pjoin(self.work_dir, 'sub', 'nb%d.ipynb' % i), 'okapi%d' % i)
+        pools = []
+        executor = index_module.ProcessPoolExecutor
+        def counting_executor(*args, **kwargs):
+            pools.append(kwargs.get('mp_context'))
+            return executor(*args, **kwargs)
+        index_module.ProcessPoolExecutor = counting_executor
+        try:
+            index = Index(self.work_dir, workers=2, use_manifest=False)
+            index.parallel_min_batch = 2
+            index.stream_batch = 3
+            self.assertTrue(index.update_index())
+        finally:
+            index_module.ProcessPoolExecutor = executor
+        self.assertEqual(len(pools), 1)
+        self.assertNotEqual(pools[0].get_start_method(), 'fork')
+        self.assertIsNone(index._pool)
+        self.assertEqual(self.paths(index, 'okapi7'), [pjoin(self.work_dir, 'sub', 'nb7.ipynb')])
+
+    def test_search_pages(self):
+        '''Should page through results with offset and limit.'''
+        for i in range(7):
+            write_notebook(pjoin(self.work_dir, 'sub', 'nb%d.ipynb' % i), 'okapi')
+        index = Index(self.work_dir)
+        index.update_index()
+        seen = []
+        for offset, limit in [(0, 3), (3, 3), (6, 3)]:
+            results, total, truncated = index.search('okapi', limit=limit, offset=offset)
+            self.assertEqual(total, 7)
+            seen.extend(result['path'] for result in results)
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+
+        results, total, truncated = index.search('okapi', limit=4, offset=5)
+        self.assertEqual([result['path'] for result in results], seen[5:])
+        self.assertEqual(total, 7)
+
+    def test_for_root(self):
+        '''Should share one index per notebook root.'''
+        index = Index.for_root(self.work_dir)
+        self.assertIs(Index.for_root(self.work_dir + os.sep), index)
+
+    def test_searcher_refresh(self):
+        '''Should reuse the searcher until the index changes.'''
+        index = Index(self.work_dir)
+        index.update_index()
+        searcher = index._get_searcher()
+        self.assertIs(index._get_searcher(), searcher)
+
+        write_notebook(pjoin(self.work_dir, 'okapi.ipynb'), 'okapi')
+        index.update_paths([pjoin(self.work_dir, 'okapi.ipynb')])
+        self.assertEqual(self.paths(index, 'okapi'), [pjoin(self.work_dir, 'okapi.ipynb')])
+        self.assertIsNot(index._get_searcher(), searcher)
+
+    def test_other_process_commits(self):
+        '''Should see commits another instance makes to the same index.'''
+        index = Index(self.work_dir)
+        other = Index(self.work_dir)
+        index.update_index()
+        generation = index.generation()
+        self.assertEqual(self.paths(index, 'banana'), [])
+        self.assertEqual(index.suggest('ban'), [])
+
+        path = pjoin(self.work_dir, 'banana.ipynb')
+        write_notebook(path, 'banana')
+        other.update_paths([path])
+        self.assertNotEqual(index.generation(), generation)
+        self.assertEqual(self.paths(index, 'banana'), [path])
+        self.assertEqual([result['path'] for result in index.suggest('ban')], [path])
+
+    def test_searcher_per_thread(self):
+        '''Should give each thread its own searcher.'''
+        index = Index(self.work_dir)
+        index.update_index()
+        searchers = []
+        thread = threading.Thread(target=lambda: searchers.append(index._get_searcher()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(index._get_searcher(), searchers[0])
+
+    def test_concurrent_search(self):
+        '''Should answer searches from many threads at once.'''
+        index = Index(self.work_dir)
+        index.update_index()
+        with ThreadPoolExecutor(4) as pool:
+            futures = [pool.submit(self.paths, index, 'zebra') for i in range(40)]
+            for future in futures:
+                self.assertEqual(future.result(), [pjoin(self.work_dir, 'alpha.ipynb')])
+
+    def test_metrics(self):
+        '''Should count indexed documents and record index stats.'''
+        index = Index(self.work_dir)
+        added = index_module.DOCUMENTS.value(op='add')
+        searches = index_module.SEARCH_SECONDS.count()
+        index.update_index()
+        self.assertEqual(index_module.DOCUMENTS.value(op='add') - added, 3)
+        index.search('zebra')
+        self.assertEqual(index_module.SEARCH_SECONDS.count() - searches, 1)
+        stats = index.stats()
+        self.assertEqual(stats['documents'], 3)
+        self.assertEqual(stats['segments'], 1)
+        self.assertGreater(stats['size_bytes'], 0)
+        self.assertEqual(index_module.INDEX_DOCUMENTS.value(), 3)
+
+    def test_suggest(self):
+        '''Should complete filenames and follow later commits.'''
+        index = Index(self.work_dir)
+        index.update_index()
+        suggest = lambda prefix: [result['path'] for result in index.suggest(prefix)]
+        self.assertEqual(suggest('Be'), [pjoin(self.work_dir, 'sub', 'beta.ipynb')])
+        self.assertEqual(suggest('gam'), [])
+        path = pjoin(self.work_dir, 'sub', 'bear.ipynb')
+        write_notebook(path, '')
+        index.update_paths([path])
+        self.assertEqual(suggest('be'), [path, pjoin(self.work_dir, 'sub', 'beta.ipynb')])
+        shutil.rmtree(pjoin(self.work_dir, 'sub'))
+        index.update_paths([pjoin(self.work_dir, 'sub')])
+        self.assertEqual(suggest('sub/'), [])
+
+    def test_result_cache(self):
+        '''Should answer repeated searches from the cache until a commit.'''
+        index = Index(self.work_dir)
+        index.update_index()
+        generation = index.generation()
+        hits = index_module.RESULT_CACHE.value(result='hit')
+        results, total, truncated = index.search('zebra')
+        results[0]['url'] = 'decorated'
+        results, total, truncated = index.search(' zebra ')
+        self.assertEqual([result['path'] for result in results], [pjoin(self.work_dir, 'alpha.ipynb')])
+        self.assertNotIn('url', results[0])
+        self.assertEqual(index_module.RESULT_CACHE.value(result='hit') - hits, 1)
+        os.remove(pjoin(self.work_dir, 'alpha.ipynb'))
+        index.update_index()
+        self.assertNotEqual(index.generation(), generation)
+        self.assertEqual(index.search('zebra'), ([], 0, False))
+
+    def test_scope(self):
+        '''Should search only under root and rank files near cwd first.'''
+        os.makedirs(pjoin(self.work_dir, 'sub', 'deep'))
+        for path in [('okapi.ipynb',), ('sub', 'okapi.ipynb'), ('sub', 'deep', 'okapi.ipynb')]:
+            write_notebook(pjoin(self.work_dir, *path), 'okapi')
+        index = Index(self.work_dir)
+        index.update_index()
+        rank = lambda **kwargs: [os.path.relpath(result['path'], self.work_dir)
+                                 for result in index.search('okapi', **kwargs)[0]]
+        self.assertEqual(rank(cwd=pjoin(self.work_dir, 'sub')),
+                         [pjoin('sub', 'okapi.ipynb'), pjoin('sub', 'deep', 'okapi.ipynb'),
+                          'okapi.ipynb'])
+        self.assertEqual(rank(cwd=self.work_dir)[0], 'okapi.ipynb')
+        self.assertEqual(sorted(rank(root=pjoin(self.work_dir, 'sub') + os.sep)),
+                         [pjoin('sub', 'deep', 'okapi.ipynb'), pjoin('sub', 'okapi.ipynb')])
+        self.assertEqual(index.search('okapi', root=pjoin(self.work_dir, 'su'))[:2], ([], 0))
+
+    def test_query_length(self):
+        '''Should refuse queries over the length limit.'''
+        index = Index(self.work_dir)
+        index.max_query_length = 10
+        self.assertRaises(index_module.QueryError, index.search, 'zebra OR okapi')
+        self.assertEqual(self.paths(index, 'zebra'), [])
+
+    def test_max_expansions(self):
+        '''Should search only the first terms of a wildcard that expands to too many.'''
+        for i in range(5):
+            write_notebook(pjoin(self.work_dir, 'sub', 'nb%d.ipynb' % i), 'okapi%d' % i)
+        index = Index(self.work_dir)
+        index.update_index()
+        results, total, truncated = index.search('okapi*')
+        self.assertEqual((total, truncated), (5, False))
+        capped = Index(self.work_dir)
+        capped.max_expansions = 2
+        results, total, truncated = capped.search('okapi*')
+        self.assertEqual((total, truncated), (2, True))
+        self.assertEqual(sorted(os.path.basename(result['path']) for result in results),
+                         ['nb0.ipynb', 'nb1.ipynb'])
+
+    def test_time_limit(self):
+        '''Should return the hits collected when the time limit passes as truncated.'''
+        class ExpiredTimer(object):
+            def __init__(self, interval, function):
+                self.function = function
+            def start(self):
+                self.function()
+            def cancel(self):
+                pass
+        index = Index(self.work_dir)
+        index.update_index()
+        truncations = index_module.TRUNCATED.value(reason='time')
+        timer = threading.Timer
+        threading.Timer = ExpiredTimer
+        try:
+            # the time limit passes as the search starts
+            self.assertEqual(index.search('zebra'), ([], 0, True))
+        finally:
+            threading.Timer = timer
+        self.assertEqual(index_module.TRUNCATED.value(reason='time') - truncations, 1)
+        # partial results are not cached
+        self.assertEqual(len(index.search('zebra')[0]), 1)
+
+    def test_update_paths_hidden(self):
+        '''Should ignore paths under hidden directories.'''
+        index = Index(self.work_dir)
+        index.update_paths([pjoin(self.work_dir, '.hidden', 'gamma.ipynb')])
+        self.assertEqual(self.paths(index, 'zebra'), [])
+
+class TestScanRules(IndexTestCase):
+    '''Tests for keeping the scanner out of excluded trees.'''
+    def setUp(self):
+        super(TestScanRules, self).setUp()
+        for parts in [('node_modules', 'pkg'), ('venv',), ('parts',), ('deep', 'er')]:
+            os.makedirs(pjoin(self.work_dir, *parts))
+        write_notebook(pjoin(self.work_dir, 'node_modules', 'pkg', 'zebra.ipynb'), 'zebra')
+        write_notebook(pjoin(self.work_dir, 'venv', 'zebra.ipynb'), 'zebra')
+        with open(pjoin(self.work_dir, 'venv', 'pyvenv.cfg'), 'w') as fh:
+            fh.write('home = /usr/bin\n')
+        for i in range(5):
+            write_notebook(pjoin(self.work_dir, 'parts', 'zebra%d.ipynb' % i), 'zebra')
+        write_notebook(pjoin(self.work_dir, 'deep', 'er', 'zebra.ipynb'), 'zebra')
+        with open(pjoin(self.work_dir, '.jupyterignore'), 'w') as fh:
+            fh.write('beta.ipynb\n')
+        os.symlink(self.work_dir, pjoin(self.work_dir, 'deep', 'loop'))
+
+    def test_rules(self):
+        '''Should skip excluded, ignored, too deep, too big, and looping trees.'''
+        index = Index(self.work_dir)
+        index.max_depth = 1
+        index.max_dir_files = 4
+        for full in (True, False):
+            index.update_index(full)
+            self.assertEqual(self.paths(index, 'zebra'), [pjoin(self.work_dir, 'alpha.ipynb')])
+            self.assertEqual(self.paths(index, 'giraffe'), [])
+
+        index.max_depth = 0
+        index.update_index()
+        self.assertEqual(self.paths(index, 'zebra'), [
+            pjoin(self.work_dir, 'alpha.ipynb'),
+            pjoin(self.work_dir, 'deep', 'er', 'zebra.ipynb')
+        ])
+        index.update_paths([pjoin(self.work_dir, 'node_modules', 'pkg', 'zebra.ipynb'),
+                            pjoin(self.work_dir, 'venv', 'zebra.ipynb')])
+        self.assertEqual(len(self.paths(index, 'zebra')), 2)
+
+class TestSymlinks(IndexTestCase):
+    '''Tests for following symlinks only where they keep within their directory.'''
+    def setUp(self):
+        super(TestSymlinks, self).setUp()
+        for parts in [('data', 'b'), ('alice',), ('bob',)]:
+            os.makedirs(pjoin(self.work_dir, *parts))
+        write_notebook(pjoin(self.work_dir, 'data', 'b', 'okapi.ipynb'), 'okapi')
+        write_notebook(pjoin(self.work_dir, 'bob', 'secret.ipynb'), 'secret')
+        # the alias sorts before its target
+        os.symlink('b', pjoin(self.work_dir, 'data', 'a-alias'))
+        os.symlink(pjoin('..', 'bob'), pjoin(self.work_dir, 'alice', 'peek'))
+        os.symlink(pjoin('..', 'bob', 'secret.ipynb'), pjoin(self.work_dir, 'alice', 'copy.ipynb'))
+
+    def test_aliases(self):
+        '''Should index a tree under every path that leads to it within its directory.'''
+        for use_manifest, full in [(False, True), (True, True), (True, False)]:
+            index = Index(self.work_dir, use_manifest=use_manifest)
+            index.update_index(full)
+            self.assertEqual(self.paths(index, 'okapi'), [
+                pjoin(self.work_dir, 'data', 'a-alias', 'okapi.ipynb'),
+                pjoin(self.work_dir, 'data', 'b', 'okapi.ipynb')
+            ])
+            results, total, truncated = index.search('okapi', root=pjoin(self.work_dir, 'data', 'b'))
+            self.assertEqual([r['path'] for r in results],
+                             [pjoin(self.work_dir, 'data', 'b', 'okapi.ipynb')])
+            index.reset_index()
+
+    def test_links_out(self):
+        '''Should not follow links out of the directory holding them.'''
+        index = Index(self.work_dir)
+        for full in (True, False):
+            index.update_index(full)
+            self.assertEqual(self.paths(index, 'secret'), [pjoin(self.work_dir, 'bob', 'secret.ipynb')])
+            results, total, truncated = index.search('secret', root=pjoin(self.work_dir, 'alice'))
+            self.assertEqual(results, [])
+        index.update_paths([pjoin(self.work_dir, 'alice', 'peek'),
+                            pjoin(self.work_dir, 'alice', 'peek', 'secret.ipynb'),
+                            pjoin(self.work_dir, 'alice', 'copy.ipynb')])
+        self.assertEqual(self.paths(index, 'secret'), [pjoin(self.work_dir, 'bob', 'secret.ipynb')])
+
+class TestMergeUpdate(IndexTestCase):
+    '''Tests for full updates that merge the disk walk with the index.'''
+    def test_sorted_walk(self):
+        '''Should walk files in the same order as their full paths sort.'''
+        for name in ['a', 'a b', 'a-b', 'a.txt', 'a0']:
+            with open(pjoin(self.work_dir, 'sub', name), 'w') as fh:
+                fh.write('')
+        os.makedirs(pjoin(self.work_dir, 'sub', 'a-'))
+        with open(pjoin(self.work_dir, 'sub', 'a-', 'z'), 'w') as fh:
+            fh.write('')
+        index = Index(self.work_dir)
+        paths = [path for path, m_time in index._iter_disk(self.work_dir, None, time.time())]
+        self.assertEqual(paths, sorted(paths))
+        self.assertIn(pjoin(self.work_dir, 'sub', 'a-', 'z'), paths)
+        self.assertNotIn(pjoin(self.work_dir, '.hidden', 'gamma.ipynb'), paths)
+
+    def test_merge(self):
+        '''Should add, update, and remove documents without a manifest.'''
+        index = Index(self.work_dir, use_manifest=False)
+        index.stream_batch = 1
+        self.assertTrue(index.update_index())
+        self.assertEqual(self.paths(index, 'zebra'), [pjoin(self.work_dir, 'alpha.ipynb')])
+
+        generation = index.ix.latest_generation()
+        self.assertTrue(index.update_index())
+        self.assertEqual(index.ix.latest_generation(), generation)
+
+        os.remove(pjoin(self.work_dir, 'alpha.ipynb'))
+        write_notebook(pjoin(self.work_dir, 'sub', 'beta.ipynb'), 'okapi')
+        past = time.time() - 60
+        os.utime(pjoin(self.work_dir, 'sub', 'beta.ipynb'), (past, past))
+        write_notebook(pjoin(self.work_dir, 'zeta.ipynb'), 'okapi')
+        self.assertTrue(index.update_index())
+        self.assertEqual(self.paths(index, 'zebra'), [])
+        self.assertEqual(self.paths(index, 'giraffe'), [])
+        self.assertEqual(self.paths(index, 'okapi'), [
+            pjoin(self.work_dir, 'sub', 'beta.ipynb'),
+            pjoin(self.work_dir, 'zeta.ipynb')
+        ])
+
+class TestContentSignature(IndexTestCase):
+    '''Tests for skipping files whose mtime changed but content did not.'''
+    def touch(self, path):
+        future = time.time() + 10
+        os.utime(path, (future, future))
+
+    def assert_skipped(self, update):
+        index = Index(self.work_dir)
+        index.update_index()
+        generation = index.ix.latest_generation()
+        self.touch(pjoin(self.work_dir, 'alpha.ipynb'))
+        self.touch(pjoin(self.work_dir, 'sub', 'beta.ipynb'))
+        update(index)
+        self.assertEqual(index.ix.latest_generation(), generation)
+
+        # same size, different content
+        write_notebook(pjoin(self.work_dir, 'alpha.ipynb'), 'import zebu!')
+        self.touch(pjoin(self.work_dir, 'alpha.ipynb'))
+        update(index)
+        self.assertEqual(self.paths(index, 'zebu'), [pjoin(self.work_dir, 'alpha.ipynb')])
+
+    def test_merge_update(self):
+        '''Should not reindex touched files during a full update.'''
+        self.assert_skipped(lambda index: index.update_index(full=True))
+
+    def test_incremental_update(self):
+        '''Should not reindex touched files during an incremental update.'''
+        self.assert_skipped(lambda index: index.update_index())
+
+    def test_update_paths(self):
+        '''Should not reindex touched files passed as changed.'''
+        self.assert_skipped(lambda index: index.update_paths([
+            pjoin(self.work_dir, 'alpha.ipynb'),
+            pjoin(self.work_dir, 'sub', 'beta.ipynb')
+        ]))
+
+    def test_other_files(self):
+        '''Should rewrite other touched files without reading them.'''
+        index = Index(self.work_dir)
+        index.update_index()
+        notes = pjoin(self.work_dir, 'sub', 'notes.txt')
+        with index.ix.searcher() as searcher:
+            self.assertIsNone(searcher.document(path=notes).get('digest'))
+            self.assertIsNotNone(searcher.document(path=pjoin(self.work_dir, 'alpha.ipynb'))['digest'])
+
+        digested = []
+        file_digest = index_module.file_digest
+        def counting_digest(filename, limit):
+            digested.append(filename)
+            return file_digest(filename, limit)
+        index_module.file_digest = counting_digest
+        try:
+            generation = index.ix.latest_generation()
+            self.touch(notes)
+            index.update_paths([notes])
+        finally:
+            index_module.file_digest = file_digest
+        self.assertEqual(digested, [])
+        self.assertNotEqual(index.ix.latest_generation(), generation)
+
+    def test_touched_read_once(self):
+        '''Should not read touched but unchanged notebooks again.'''
+        index = Index(self.work_dir, use_manifest=False)
+        index.update_index()
+        generation = index.ix.latest_generation()
+        self.touch(pjoin(self.work_dir, 'alpha.ipynb'))
+        self.touch(pjoin(self.work_dir, 'sub', 'beta.ipynb'))
+
+        digested = []
+        file_digest = index_module.file_digest
+        def counting_digest(filename, limit):
+            digested.append(filename)
+            return file_digest(filename, limit)
+        index_module.file_digest = counting_digest
+        try:
+            index.update_index()
+            self.assertEqual(len(digested), 2)
+            index.update_index(full=True)
+            self.assertEqual(len(digested), 2)
+            # another instance remembers them too
+            Index(self.work_dir, use_manifest=False).update_index()
+            self.assertEqual(len(digested), 2)
+        finally:
+            index_module.file_digest = file_digest
+        self.assertEqual(index.ix.latest_generation(), generation)
+
+        # a change after the touch still gets indexed
+        write_notebook(pjoin(self.work_dir, 'alpha.ipynb'), 'import zebu!')
+        self.touch(pjoin(self.work_dir, 'alpha.ipynb'))
+        index.update_index()
+        self.assertEqual(self.paths(index, 'zebu'), [pjoin(self.work_dir, 'alpha.ipynb')])
+
+    def test_digest_read_limit(self):
+        '''Should digest the same bytes the content comes from.'''
+        path = pjoin(self.work_dir, 'alpha.ipynb')
+        size = os.path.getsize(path)
+        meta = index_module.file_to_document(path, 0, read_limit=size)
+        self.assertEqual(meta['digest'], index_module.file_digest(path, size))
+        self.assertEqual(index_module.file_to_document(path, 0, read_limit=size - 1)['digest'],
+                         index_module.file_digest(path, size - 1))
+        self.assertNotEqual(index_module.file_digest(path, size - 1), meta['digest'])
+
+    def test_old_schema(self):
+        '''Should rebuild an index created without signatures.'''
+        from whoosh.fields import Schema, TEXT, ID, STORED
+        from whoosh.index import create_in
+        index_path = pjoin(self.data_dir, 'index', index_module.root_digest(self.work_dir))
+        os.makedirs(index_path)
+        create_in(index_path, Schema(basename=TEXT(stored=True), dirname=ID(stored=True),
+                                     path=ID(stored=True, unique=True), content=TEXT,
+                                     time=STORED))
+        index = Index(self.work_dir)
+        self.assertEqual(index._index_path(), index_path)
+        self.assertIn('digest', index.ix.schema.names())
+        index.update_index()
+        self.assertEqual(self.paths(index, 'zebra'), [pjoin(self.work_dir, 'alpha.ipynb')])
+
+class TestManifest(IndexTestCase):
+    '''Tests for incremental updates using the scan manifest.'''
+    def setUp(self):
+        super(TestManifest, self).setUp()
+        # make every directory old enough for the manifest to trust
+        past = time.time() - 60
+        for dirpath, dirnames, filenames in os.walk(self.work_dir):
+            os.utime(dirpath, (past, past))
+        self.index = Index(self.work_dir)
+        self.index.update_index()
+
+    def test_noop(self):
+        '''Should not commit when nothing changed.'''
+        generation = self.index.ix.latest_generation()
+        self.assertTrue(self.index.update_index())
+        self.assertEqual(self.index.ix.latest_generation(), generation)
+
+    def test_persisted(self):
+        '''Should reuse the manifest saved by another instance.'''
+        index = Index(self.work_dir)
+        self.assertIsNotNone(index._load_manifest())
+        generation = index.ix.latest_generation()
+        self.assertTrue(index.update_index())
+        self.assertEqual(index.ix.latest_generation(), generation)
+
+    def test_add_remove(self):
+        '''Should pick up files and directories added or removed.'''
+        write_notebook(pjoin(self.work_dir, 'sub', 'delta.ipynb'), 'okapi')
+        os.remove(pjoin(self.work_dir, 'sub', 'notes.txt'))
+        os.remove(pjoin(self.work_dir, 'alpha.ipynb'))
+        self.index.update_index()
+        self.assertEqual(self.paths(self.index, 'okapi'), [pjoin(self.work_dir, 'sub', 'delta.ipynb')])
+        self.assertEqual(self.paths(self.index, 'zebra'), [])
+
+        shutil.rmtree(pjoin(self.work_dir, 'sub'))
+        self.index.update_index()
+        self.assertEqual(self.paths(self.index, 'okapi'), [])
+        self.assertEqual(self.paths(self.index, 'giraffe'), [])
+
+    def test_prune_unchanged(self):
+        '''Should skip directories with unchanged mtimes until a full update.'''
+        sub = pjoin(self.work_dir, 'sub')
+        dir_times = (os.stat(sub).st_atime, os.stat(sub).st_mtime)
+        write_notebook(pjoin(sub, 'beta.ipynb'), 'print("okapi")')
+        os.utime(sub, dir_times)
+
+        self.index.update_index()
+        self.assertEqual(self.paths(self.index, 'okapi'), [])
+        self.index.update_index(full=True)
+        self.assertEqual(self.paths(self.index, 'okapi'), [pjoin(sub, 'beta.ipynb')])
+
+    def test_update_paths(self):
+        '''Should keep the manifest in step with targeted updates.'''
+        os.makedirs(pjoin(self.work_dir, 'new'))
+        write_notebook(pjoin(self.work_dir, 'new', 'delta.ipynb'), 'okapi')
+        self.index.update_paths([pjoin(self.work_dir, 'new')])
+        dirs = self.index._load_manifest()
+        self.assertIn('new', dirs[self.work_dir]['dirs'])
+        self.assertIn('delta.ipynb', dirs[pjoin(self.work_dir, 'new')]['files'])
+
+        shutil.rmtree(pjoin(self.work_dir, 'new'))
+        self.index.update_paths([pjoin(self.work_dir, 'new')])
+        dirs = self.index._load_manifest()
+        self.assertNotIn('new', dirs[self.work_dir]['dirs'])
+        self.assertNotIn(pjoin(self.work_dir, 'new'), dirs)
+        self.assertEqual(self.paths(self.index, 'okapi'), [])
+
+    def manifest_files(self):
+        index_path = self.index._index_path()
+        manifest = os.stat(pjoin(index_path, index_module.MANIFEST_NAME))
+        journal = pjoin(index_path, index_module.JOURNAL_NAME)
+        return ((manifest.st_mtime, manifest.st_size),
+                os.path.getsize(journal) if os.path.exists(journal) else None)
+
+    def test_journal(self):
+        '''Should journal the directories an update changed and nothing else.'''
+        saved = self.manifest_files()
+        self.assertIsNone(saved[1])
+        self.index.update_paths([pjoin(self.work_dir, 'alpha.ipynb')])
+        self.index.update_index()
+        self.assertEqual(self.manifest_files(), saved)
+
+        write_notebook(pjoin(self.work_dir, 'sub', 'delta.ipynb'), 'okapi')
+        self.index.update_paths([pjoin(self.work_dir, 'sub', 'delta.ipynb')])
+        manifest, journal = self.manifest_files()
+        self.assertEqual(manifest, saved[0])
+        self.assertGreater(journal, 0)
+        with open(pjoin(self.index._index_path(), index_module.JOURNAL_NAME)) as f:
+            entry = json.loads(f.readline())
+        self.assertEqual(list(entry['dirs']), [pjoin(self.work_dir, 'sub')])
+
+        # another instance replays the journal onto the manifest
+        index = Index(self.work_dir)
+        dirs = index._load_manifest()
+        self.assertIn('delta.ipynb', dirs[pjoin(self.work_dir, 'sub')]['files'])
+        generation = index.ix.latest_generation()
+        self.assertTrue(index.update_index())
+        self.assertEqual(index.ix.latest_generation(), generation)
+
+    def test_journal_compacted(self):
+        '''Should rewrite the manifest once the journal outgrows it.'''
+        min_bytes = index_module.JOURNAL_MIN_BYTES
+        index_module.JOURNAL_MIN_BYTES = 0
+        try:
+            for i in range(20):
+                write_notebook(pjoin(self.work_dir, 'sub', 'nb%d.ipynb' % i), 'okapi')
+                self.index.update_paths([pjoin(self.work_dir, 'sub', 'nb%d.ipynb' % i)])
+                manifest, journal = self.manifest_files()
+                self.assertLessEqual(journal or 0, manifest[1])
+        finally:
+            index_module.JOURNAL_MIN_BYTES = min_bytes
+        dirs = Index(self.work_dir)._load_manifest()
+        self.assertEqual(len([name for name in dirs[pjoin(self.work_dir, 'sub')]['files']
+                              if name.startswith('nb')]), 20)
+
+class TestIndexStorage(IndexTestCase):
+    '''Tests for where the index keeps its data.'''
+    def test_per_root(self):
+        '''Should keep the indexes of different roots apart.'''
+        other_dir = tempfile.mkdtemp()
+        try:
+            write_notebook(pjoin(other_dir, 'okapi.ipynb'), 'import okapi')
+            index = Index(self.work_dir)
+            other = Index(other_dir)
+            index.update_index()
+            other.update_index()
+            index.update_index()
+            self.assertEqual(self.paths(index, 'okapi'), [])
+            self.assertEqual(self.paths(other, 'okapi'), [pjoin(other_dir, 'okapi.ipynb')])
+            self.assertEqual(len(os.listdir(pjoin(self.data_dir, 'index'))), 2)
+        finally:
+            shutil.rmtree(other_dir, True)
+
+    def test_legacy_index(self):
+        '''Should remove the index all roots shared from the data dir.'''
+        from whoosh.fields import Schema, ID
+        from whoosh.index import create_in
+        legacy_path = pjoin(self.data_dir, 'index')
+        os.makedirs(pjoin(legacy_path, 'other-root'))
+        create_in(legacy_path, Schema(path=ID(stored=True)))
+        with open(pjoin(legacy_path, 'manifest.json'), 'w') as f:
+            f.write('{}')
+        index = Index(self.work_dir)
+        self.assertEqual(sorted(os.listdir(legacy_path)),
+                         sorted(['other-root', index_module.root_digest(self.work_dir)]))
+
+    def test_storage_dir(self):
+        '''Should keep the index under the given storage directory.'''
+        storage_dir = tempfile.mkdtemp()
+        try:
+            index = Index(self.work_dir, storage_dir=storage_dir)
+            index.update_index()
+            self.assertEqual(self.paths(index, 'zebra'), [pjoin(self.work_dir, 'alpha.ipynb')])
+            self.assertEqual(os.listdir(pjoin(storage_dir, 'index')),
+                             [index_module.root_digest(self.work_dir)])
+            self.assertFalse(os.path.exists(pjoin(self.data_dir, 'index')))
+        finally:
+            shutil.rmtree(storage_dir, True)
+
+    def test_in_memory(self):
+        '''Should index in memory, write nothing to disk, and keep a manifest.'''
+        index = Index(self.work_dir, workers=2, in_memory=True)
+        index.parallel_min_batch = 1
+        self.assertTrue(index.update_index())
+        self.assertEqual(self.paths(index, 'zebra'), [pjoin(self.work_dir, 'alpha.ipynb')])
+        self.assertEqual(os.listdir(self.data_dir), [])
+        self.assertIsNotNone(index._load_manifest())
+        generation = index.ix.latest_generation()
+        self.assertTrue(index.update_index())
+        self.assertEqual(index.ix.latest_generation(), generation)
+        self.assertEqual(Index(self.work_dir, in_memory=True).stats()['documents'], 0)
+        index.reset_index()
+        self.assertEqual(self.paths(index, 'zebra'), [])
+
+class TestIndexManager(IndexTestCase):
+    '''Tests for keeping the index current in the background.'''
+    def wait_for(self, index, query_string, expected, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.paths(index, query_string) == expected:
+                return
+            time.sleep(0.1)
+        self.assertEqual(self.paths(index, query_string), expected)
+
+    def test_reconcile_on_start(self):
+        '''Should index the work dir as soon as it starts.'''
+        manager = IndexManager(work_dir=self.work_dir, watch=False)
+        manager.start()
+        try:
+            self.wait_for(manager.index, 'giraffe', [pjoin(self.work_dir, 'sub', 'beta.ipynb')])
+        finally:
+            manager.stop()
+
+    def test_notify(self):
+        '''Should index paths reported as changed.'''
+        manager = IndexManager(work_dir=self.work_dir, watch=False, event_delay=0)
+        manager.start()
+        try:
+            self.wait_for(manager.index, 'giraffe', [pjoin(self.work_dir, 'sub', 'beta.ipynb')])
+            path = pjoin(self.work_dir, 'epsilon.ipynb')
+            write_notebook(path, 'giraffe = 2')
+            manager.notify([path])
+            self.wait_for(manager.index, 'giraffe', [path, pjoin(self.work_dir, 'sub', 'beta.ipynb')])
+        finally:
+            manager.stop()
+
+    def test_notify_locked(self):
+        '''Should retry paths an update skipped because the index was locked.'''
+        manager = IndexManager(work_dir=self.work_dir, watch=False, event_delay=0,
+                               retry_delay=0.1, reconcile_interval=600)
+        manager.start()
+        try:
+            self.wait_for(manager.index, 'giraffe', [pjoin(self.work_dir, 'sub', 'beta.ipynb')])
+            path = pjoin(self.work_dir, 'sub', 'beta.ipynb')
+            with manager.index._update_lock:
+                write_notebook(path, 'print("okapi")')
+                manager.notify([path])
+                time.sleep(0.5)
+                self.assertEqual(self.paths(manager.index, 'okapi'), [])
+                self.assertEqual(manager._dirty, set([path]))
+            self.wait_for(manager.index, 'okapi', [path])
+        finally:
+            manager.stop()
+
+    def test_request_update(self):
+        '''Should share one update among concurrent and recent requests.'''
+        manager = IndexManager(work_dir=self.work_dir, min_update_interval=60)
+        calls = []
+        release = threading.Event()
+        def update_index():
+            calls.append(1)
+            release.wait(10)
+            return True
+        manager.index.update_index = update_index
+        try:
+            futures = [manager.request_update() for i in range(5)]
+            release.set()
+            self.assertTrue(all(future.result() for future in futures))
+            self.assertEqual(len(set(futures)), 1)
+            self.assertIs(manager.request_update(), futures[0])
+            self.assertEqual(len(calls), 1)
+
+            manager.min_update_interval = 0
+            manager.request_update().result()
+            self.assertEqual(len(calls), 2)
+        finally:
+            manager.stop()
+
+    def test_event_types(self):
+        '''Should forward only the events of paths that changed.'''
+        path = pjoin(self.work_dir, 'alpha.ipynb')
+        class Event(object):
+            def __init__(self, event_type, is_directory=False):
+                self.event_type = event_type
+                self.is_directory = is_directory
+                self.src_path = path
+        notified = []
+        class manager(object):
+            notify = staticmethod(notified.extend)
+        handler = _EventHandler(manager)
+        for event_type in ['opened', 'closed_no_write', 'created', 'modified', 'closed']:
+            handler.dispatch(Event(event_type))
+        handler.dispatch(Event('modified', True))
+        self.assertEqual(len(notified), 3)
+
+    @unittest.skipIf(Observer is None, 'requires watchdog')
+    def test_watch(self):
+        '''Should watch only trees the rules allow and ignore reads.'''
+        os.makedirs(pjoin(self.work_dir, 'node_modules'))
+        manager = IndexManager(work_dir=self.work_dir, event_delay=0)
+        self.assertFalse(manager.watching)
+        manager.start()
+        try:
+            self.assertTrue(manager.watching)
+            self.assertEqual(sorted(manager._watches), [self.work_dir, pjoin(self.work_dir, 'sub')])
+            self.wait_for(manager.index, 'giraffe', [pjoin(self.work_dir, 'sub', 'beta.ipynb')])
+
+            calls = []
+            update_paths = manager.index.update_paths
+            def counting_update_paths(paths):
+                calls.append(paths)
+                return update_paths(paths)
+            manager.index.update_paths = counting_update_paths
+            with open(pjoin(self.work_dir, 'sub', 'beta.ipynb')) as f:
+                f.read()
+            time.sleep(1)
+            self.assertEqual(calls, [])
+
+            os.makedirs(pjoin(self.work_dir, 'new'))
+            path = pjoin(self.work_dir, 'new', 'epsilon.ipynb')
+            write_notebook(path, 'giraffe = 2')
+            self.wait_for(manager.index, 'giraffe', [path, pjoin(self.work_dir, 'sub', 'beta.ipynb')])
+            self.assertIn(pjoin(self.work_dir, 'new'), manager._watches)
+        finally:
+            manager.stop()
@@ -0,0 +1,118 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+import asyncio
+import shutil
+import tempfile
+import threading
+from os import makedirs, symlink
+from os.path import join as pjoin
+from tornado.ioloop import IOLoop
+from jupyter_cms.index import QueryError
+from jupyter_cms.indexer import IndexManager
+from jupyter_cms.indexserver import IndexClient, listen
+from test_index import IndexTestCase, write_notebook
+
+class TestIndexServer(IndexTestCase):
+    '''Tests for sharing one index through the index daemon.'''
+    def setUp(self):
+        super(TestIndexServer, self).setUp()
+        self.socket_dir = tempfile.mkdtemp()
+        self.socket_path = pjoin(self.socket_dir, 'index.sock')
+        self.manager = IndexManager(work_dir=self.work_dir, watch=False)
+        self.manager.index.update_index()
+        self.loop = None
+        started = threading.Event()
+
+        def serve():
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            self.loop = IOLoop.current()
+            self.server = listen(self.manager, socket_path=self.socket_path, token='secret',
+                                 client_roots={'sub-secret': pjoin(self.work_dir, 'sub'),
+                                               'alice-secret': pjoin(self.work_dir, 'alice')})
+            started.set()
+            self.loop.start()
+        self.thread = threading.Thread(target=serve)
+        self.thread.start()
+        started.wait(10)
+
+    def tearDown(self):
+        self.loop.add_callback(self.server.stop)
+        self.loop.add_callback(self.loop.stop)
+        self.thread.join()
+        self.manager.stop()
+        shutil.rmtree(self.socket_dir, True)
+        super(TestIndexServer, self).tearDown()
+
+    def test_search(self):
+        '''Should search only under the client root and reuse the connection.'''
+        client = IndexClient(self.socket_path, self.work_dir, token='secret')
+        results, total, truncated = client.search('zebra')
+        self.assertEqual([r['path'] for r in results], [pjoin(self.work_dir, 'alpha.ipynb')])
+        conn = client._local.conn
+        sub_client = IndexClient(self.socket_path, pjoin(self.work_dir, 'sub'), token='secret')
+        self.assertEqual(sub_client.search('zebra'), ([], 0, False))
+        self.assertEqual([r['path'] for r in sub_client.suggest('be')],
+                         [pjoin(self.work_dir, 'sub', 'beta.ipynb')])
+        self.assertTrue(client.update_index())
+        self.assertEqual(client.stats()['documents'], 3)
+        self.assertIs(client._local.conn, conn)
+
+    def test_token(self):
+        '''Should refuse clients without the token.'''
+        client = IndexClient(self.socket_path, self.work_dir)
+        self.assertRaises(IOError, client.search, 'zebra')
+
+    def test_client_roots(self):
+        '''Should only serve clients with a root token under that root.'''
+        sub_client = IndexClient(self.socket_path, pjoin(self.work_dir, 'sub'), token='sub-secret')
+        self.assertEqual([r['path'] for r in sub_client.search('giraffe')[0]],
+                         [pjoin(self.work_dir, 'sub', 'beta.ipynb')])
+        self.assertEqual([r['path'] for r in sub_client.suggest('be')],
+                         [pjoin(self.work_dir, 'sub', 'beta.ipynb')])
+        # without a root, the search stays under the client's
+        resp = sub_client._request('GET', '/search', qs='zebra OR giraffe')
+        self.assertEqual([r['path'] for r in resp['results']],
+                         [pjoin(self.work_dir, 'sub', 'beta.ipynb')])
+
+        client = IndexClient(self.socket_path, self.work_dir, token='sub-secret')
+        self.assertRaises(IOError, client.search, 'zebra')
+        self.assertRaises(IOError, client.suggest, 'al')
+        self.assertRaises(IOError, sub_client.search, 'zebra', root=pjoin(self.work_dir, 'sub', '..'))
+        client = IndexClient(self.socket_path, pjoin(self.work_dir, 'sub2'), token='sub-secret')
+        self.assertRaises(IOError, client.search, 'zebra')
+
+    def test_client_root_links(self):
+        '''Should not serve another tree to a client through a symlink in its root.'''
+        for name in ['alice', 'bob']:
+            makedirs(pjoin(self.work_dir, name))
+        write_notebook(pjoin(self.work_dir, 'bob', 'secret.ipynb'), 'secret')
+        symlink(pjoin(self.work_dir, 'bob'), pjoin(self.work_dir, 'alice', 'peek'))
+        self.manager.index.update_index(full=True)
+        client = IndexClient(self.socket_path, pjoin(self.work_dir, 'alice'), token='alice-secret')
+        self.assertEqual(client.search('secret'), ([], 0, False))
+        self.assertEqual(client.suggest('peek'), [])
+
+    def test_paging(self):
+        '''Should refuse pages out of range.'''
+        client = IndexClient(self.socket_path, self.work_dir, token='secret')
+        self.assertRaises(QueryError, client.search, 'zebra', limit=1000)
+        self.assertRaises(QueryError, client.search, 'zebra', offset=-1)
+        self.assertRaises(IOError, client.suggest, 'al', limit=0)
+
+    def test_query_error(self):
+        '''Should pass on a refused query as a QueryError.'''
+        self.manager.index.max_query_length = 10
+        client = IndexClient(self.socket_path, self.work_dir, token='secret')
+        self.assertRaises(QueryError, client.search, 'zebra OR giraffe')
+        self.assertEqual(len(client.search('zebra')[0]), 1)
+
+    def test_manager(self):
+        '''Should stand in for a local index in a client IndexManager.'''
+        manager = IndexManager(work_dir=self.work_dir, server=self.socket_path, server_token='secret')
+        manager.start()
+        try:
+            self.assertTrue(manager.request_update().result())
+            self.assertEqual(self.paths(manager.index, 'giraffe'), [pjoin(self.work_dir, 'sub', 'beta.ipynb')])
+            self.assertIsNone(manager._thread)
+        finally:
+            manager.stop()
@@ -2,6 +2,9 @@
 # Distributed under the terms of the Modified BSD License.
 
 import os
+import shutil
+import sys
+import tempfile
 import unittest
 import jupyter_cms.loader as loader
 from os.path import join as pjoin
@@ -126,7 +129,68 @@ class TestNotebookFinder(unittest.TestCase):
             self.assertTrue(False, 'expected ImportError')
         finally:
             os.chdir(path)
-            
+
+    def test_find_spec(self):
+        '''Should find notebooks and folders as module specs.'''
+        path_finder, finder = loader._enabled
+        spec = finder.find_spec('mywb.test_injectable', [self.root])
+        self.assertEqual(spec.origin, pjoin(self.root, 'test_injectable.ipynb'))
+        self.assertTrue(spec.has_location)
+        self.assertIsNone(finder.find_spec('mywb.subdir', [self.root]))
+
+        spec = path_finder.find_spec('mywb.subdir', [self.root])
+        self.assertEqual(spec.submodule_search_locations, [pjoin(self.root, 'subdir')])
+        self.assertIsNone(path_finder.find_spec('mywb.test_injectable', [self.root]))
+
+class TestDirectoryListings(unittest.TestCase):
+    '''Tests for finding notebooks from cached directory listings.'''
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(pjoin(self.root, 'sub'))
+        self.listed = []
+        self.scandir = loader.scandir
+        def scandir(path):
+            self.listed.append(path)
+            return self.scandir(path)
+        loader.scandir = scandir
+        self.finder = loader.NotebookFinder(loader.NotebookLoader)
+
+    def tearDown(self):
+        loader.scandir = self.scandir
+        shutil.rmtree(self.root, True)
+
+    def touch(self, *names):
+        for name in names:
+            with open(pjoin(self.root, name), 'w') as f:
+                f.write('{}')
+
+    def test_listing(self):
+        '''Should list a directory once until it changes.'''
+        self.touch('a.ipynb', 'b.ipynb')
+        for name in ['a', 'b', 'c', 'a']:
+            self.finder.find_spec('mywb.' + name, [self.root])
+        self.assertEqual(self.listed, [self.root])
+        self.assertIsNone(self.finder.find_spec('mywb.sub', [self.root]))
+
+        self.touch('c.ipynb')
+        mtime = os.stat(self.root).st_mtime + 10
+        os.utime(self.root, (mtime, mtime))
+        self.assertIsNotNone(self.finder.find_spec('mywb.c', [self.root]))
+        self.assertEqual(self.listed, [self.root, self.root])
+
+    def test_invalidate_caches(self):
+        '''Should relist directories after importlib.invalidate_caches().'''
+        import importlib
+        self.touch('a.ipynb')
+        self.finder.find_spec('mywb.a', [self.root])
+        sys.meta_path.append(self.finder)
+        try:
+            importlib.invalidate_caches()
+        finally:
+            sys.meta_path.remove(self.finder)
+        self.finder.find_spec('mywb.a', [self.root])
+        self.assertEqual(self.listed, [self.root, self.root])
+
 
 class TestNotebookLoader(unittest.TestCase):
     '''Tests for loading notebooks within the loader root directory.'''
@@ -178,6 +242,107 @@ class TestNotebookLoader(unittest.TestCase):
             self.assertEqual(mod.__file__, path)
             self.assertEqual(mod.__package__, None)
 
+class TestNotebookCache(unittest.TestCase):
+    '''Tests for caching compiled notebooks in __pycache__.'''
+    def setUp(self):
+        self.root = pjoin(dirname(abspath(__file__)), 'resources')
+        self.work_dir = tempfile.mkdtemp()
+        self.path = pjoin(self.work_dir, 'test_injectable.ipynb')
+        shutil.copy(pjoin(self.root, 'test_injectable.ipynb'), self.path)
+        self.save_dont_write_bytecode = sys.dont_write_bytecode
+        sys.dont_write_bytecode = False
+        self.reader = loader.reader
+
+    def tearDown(self):
+        loader.reader = self.reader
+        sys.dont_write_bytecode = self.save_dont_write_bytecode
+        shutil.rmtree(self.work_dir, True)
+
+    def fail_reads(self):
+        class reader(object):
+            @staticmethod
+            def read(f):
+                raise AssertionError('notebook parsed')
+        loader.reader = reader
+
+    def test_cache(self):
+        '''Should build the module from the cache until the notebook changes.'''
+        loader.load_notebook(self.path)
+        cache_path = loader.NotebookLoader([], self.path).cache_path()
+        self.assertTrue(os.path.isfile(cache_path))
+        self.assertEqual(os.path.dirname(cache_path), pjoin(self.work_dir, '__pycache__'))
+
+        self.fail_reads()
+        mod = loader.load_notebook(self.path)
+        self.assertEqual(mod.some_func(), 'fake-return')
+        self.assertEqual(mod.SomeClass().some_method(), True)
+        self.assertTrue(mod.__doc__.startswith('# Fake Module!'))
+        self.assertEqual(mod.some_recipe.__richdoc__.cells[0].cell_type, 'markdown')
+        self.assertEqual(mod.some_recipe.__richdoc__.cells[1].source, 'print x + y')
+
+        mtime = os.stat(self.path).st_mtime + 10
+        os.utime(self.path, (mtime, mtime))
+        self.assertRaises(AssertionError, loader.load_notebook, self.path)
+
+    def test_dont_write_bytecode(self):
+        '''Should not write the cache if Python doesn't write bytecode.'''
+        sys.dont_write_bytecode = True
+        loader.load_notebook(self.path)
+        self.assertFalse(os.path.exists(pjoin(self.work_dir, '__pycache__')))
+
+class TestLoadNotebook(unittest.TestCase):
+    '''Tests for the modules load_notebook keeps.'''
+    def setUp(self):
+        self.root = pjoin(dirname(abspath(__file__)), 'resources')
+        self.work_dir = tempfile.mkdtemp()
+        self.paths = []
+        for name in ['a', 'b', 'c']:
+            path = pjoin(self.work_dir, name + '.ipynb')
+            shutil.copy(pjoin(self.root, 'test_injectable.ipynb'), path)
+            self.paths.append(path)
+        self.max_loaded_notebooks = loader.NotebookLoader.max_loaded_notebooks
+
+    def tearDown(self):
+        loader.NotebookLoader.max_loaded_notebooks = self.max_loaded_notebooks
+        shutil.rmtree(self.work_dir, True)
+
+    def change(self, path):
+        shutil.copy(pjoin(self.root, 'empty.ipynb'), path)
+
+    def test_names(self):
+        '''Should name modules for the notebook path and content.'''
+        a = loader.load_notebook(self.paths[0])
+        a2 = loader.load_notebook(self.paths[0])
+        self.assertIsNot(a, a2)
+        self.assertEqual(a.__name__, a2.__name__)
+        self.assertIs(sys.modules[a.__name__], a2)
+        self.assertNotEqual(loader.load_notebook(self.paths[1]).__name__, a.__name__)
+
+        self.change(self.paths[0])
+        a3 = loader.load_notebook(self.paths[0])
+        self.assertNotEqual(a3.__name__, a.__name__)
+        self.assertNotIn(a.__name__, sys.modules)
+
+    def test_reuse(self):
+        '''Should reuse the last module of an unchanged notebook on request.'''
+        a = loader.load_notebook(self.paths[0])
+        self.assertIs(loader.load_notebook(self.paths[0], reuse=True), a)
+        self.change(self.paths[0])
+        a2 = loader.load_notebook(self.paths[0], reuse=True)
+        self.assertIsNot(a2, a)
+        self.assertFalse(hasattr(a2, 'some_func'))
+
+    def test_limit(self):
+        '''Should drop the modules of the least recently loaded notebooks.'''
+        loader.NotebookLoader.max_loaded_notebooks = 2
+        a, b = [loader.load_notebook(path) for path in self.paths[:2]]
+        loader.load_notebook(self.paths[0], reuse=True)
+        c = loader.load_notebook(self.paths[2])
+        self.assertIn(a.__name__, sys.modules)
+        self.assertNotIn(b.__name__, sys.modules)
+        self.assertIn(c.__name__, sys.modules)
+        self.assertIsNot(loader.load_notebook(self.paths[1], reuse=True), b)
+
 class TestNotebookExposure(unittest.TestCase):
     '''Tests for APIs exposed by loaded notebooks.'''
     def setUp(self):
@@ -252,3 +417,63 @@ class TestNotebookExposure(unittest.TestCase):
         self.assertIn('1,2,3', self.render.call)
         self.assertIn(r'%%', self.render.call)
         self.assertNotIn('help', self.render.call)
+
+class TestRichHelpCache(unittest.TestCase):
+    '''Tests for caching the rendered HTML of rich help.'''
+    def setUp(self):
+        self.path = pjoin(dirname(abspath(__file__)), 'resources', 'test_injectable.ipynb')
+        self.rendered = []
+        self.export_html = loader.export_html
+        test = self
+
+        # purpose driven mocking
+        class export_html(object):
+            @staticmethod
+            def from_notebook_node(nb):
+                test.rendered.append(nb)
+                return '<p>%d cells</p>' % len(nb.cells), {}
+        loader.export_html = export_html
+        loader.display = lambda x: None
+        self.render = loader.HTML = lambda html: html
+
+    def tearDown(self):
+        loader.export_html = self.export_html
+
+    def test_cache(self):
+        '''Should render help once until cells are added to it.'''
+        mod = loader.load_notebook(self.path)
+        mod.help()
+        mod.help()
+        self.assertEqual(len(self.rendered), 1)
+        html = mod.help.__richhtml__
+
+        cell = mod.help.__richdoc__.cells[-1]
+        loader.NotebookLoader([], self.path).attach_richdoc(mod, cell, None, None)
+        mod.help()
+        self.assertEqual(len(self.rendered), 2)
+        self.assertNotEqual(mod.help.__richhtml__, html)
+
+    def test_class_help(self):
+        '''Should cache the help of classes on the class help function.'''
+        mod = loader.load_notebook(self.path)
+        mod.SomeClass.help()
+        mod.SomeClass.help()
+        self.assertEqual(len(self.rendered), 1)
+
+    def test_prerender(self):
+        '''Should render the help of a new module in the background.'''
+        nb_loader = loader.NotebookLoader([], self.path)
+        nb_loader.prerender_help = True
+        threads = []
+        prerender = nb_loader.prerender
+        nb_loader.prerender = lambda helps: threads.append(prerender(helps))
+        mod = nb_loader.load_module_by_path()
+        threads[0].join()
+        self.assertEqual(len(self.rendered), 5)
+        self.assertIsNotNone(mod.some_recipe.__richhtml__)
+        mod.help()
+        mod.some_func.help()
+        mod.SomeClass.help()
+        mod.some_recipe()
+        mod.r_recipe()
+        self.assertEqual(len(self.rendered), 5)
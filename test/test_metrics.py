@@ -0,0 +1,45 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+import unittest
+from jupyter_cms import metrics
+
+class TestMetrics(unittest.TestCase):
+    '''Tests for rendering metrics in the Prometheus text format.'''
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        '''Should render one sample per label set.'''
+        counter = metrics.Counter('docs_total', 'Documents', registry=self.registry)
+        counter.inc(op='add')
+        counter.inc(2, op='add')
+        counter.inc(op='remove')
+        self.assertEqual(counter.value(op='add'), 3)
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# HELP docs_total Documents',
+            '# TYPE docs_total counter',
+            'docs_total{op="add"} 3.0',
+            'docs_total{op="remove"} 1.0'
+        ]) + '\n')
+
+    def test_gauge(self):
+        '''Should render the last value set.'''
+        gauge = metrics.Gauge('size_bytes', 'Size', registry=self.registry)
+        gauge.set(10)
+        gauge.set(5)
+        self.assertIn('size_bytes 5.0\n', self.registry.render())
+
+    def test_histogram(self):
+        '''Should render cumulative buckets, sum, and count.'''
+        histogram = metrics.Histogram('seconds', 'Seconds', buckets=(0.1, 1), registry=self.registry)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        lines = self.registry.render().splitlines()
+        self.assertEqual(lines[2:], [
+            'seconds_bucket{le="0.1"} 1',
+            'seconds_bucket{le="1.0"} 2',
+            'seconds_bucket{le="+Inf"} 3',
+            'seconds_sum 5.55',
+            'seconds_count 3'
+        ])
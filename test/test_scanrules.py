@@ -0,0 +1,49 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+import os
+import shutil
+import tempfile
+import unittest
+from os.path import join as pjoin
+from jupyter_cms.scanrules import ScanRules
+
+class TestScanRules(unittest.TestCase):
+    '''Tests for deciding what the scanner skips.'''
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(pjoin(self.root, 'project', 'build'))
+        with open(pjoin(self.root, '.jupyterignore'), 'w') as fh:
+            fh.write('# comment\n*.log\n/data/\n!keep.log\n')
+        with open(pjoin(self.root, 'project', '.jupyterignore'), 'w') as fh:
+            fh.write('build/\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.root, True)
+
+    def test_exclude(self):
+        '''Should match globs against names and relative paths.'''
+        rules = ScanRules(self.root, exclude=['node_modules', 'project/*.csv'])
+        self.assertTrue(rules.excluded(pjoin(self.root, 'a', 'node_modules'), True))
+        self.assertTrue(rules.excluded(pjoin(self.root, 'project', 'big.csv'), False))
+        self.assertFalse(rules.excluded(pjoin(self.root, 'big.csv'), False))
+        self.assertFalse(rules.excluded(self.root, True))
+
+    def test_ignore_files(self):
+        '''Should apply ignore files to the trees of their directories.'''
+        rules = ScanRules(self.root, ignore_files=['.jupyterignore'])
+        self.assertTrue(rules.excluded(pjoin(self.root, 'project', 'run.log'), False))
+        self.assertFalse(rules.excluded(pjoin(self.root, 'project', 'keep.log'), False))
+        self.assertTrue(rules.excluded(pjoin(self.root, 'data'), True))
+        self.assertFalse(rules.excluded(pjoin(self.root, 'project', 'data'), True))
+        self.assertTrue(rules.excluded(pjoin(self.root, 'project', 'build'), True))
+        self.assertFalse(rules.excluded(pjoin(self.root, 'build'), True))
+        self.assertFalse(rules.within(pjoin(self.root, 'project', 'build', 'out.ipynb')))
+        self.assertTrue(rules.within(pjoin(self.root, 'project', 'out.ipynb')))
+
+    def test_max_depth(self):
+        '''Should only descend max_depth levels.'''
+        rules = ScanRules(self.root, max_depth=1)
+        self.assertTrue(rules.descend(self.root))
+        self.assertFalse(rules.descend(pjoin(self.root, 'project')))
+        self.assertTrue(rules.within(pjoin(self.root, 'project', 'a.ipynb')))
+        self.assertFalse(rules.within(pjoin(self.root, 'project', 'build', 'a.ipynb')))
@@ -0,0 +1,91 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+import json
+from os.path import join as pjoin
+from tornado import web
+from tornado.testing import AsyncHTTPTestCase
+from jupyter_cms.indexer import IndexManager
+from jupyter_cms.search import SearchHandler
+from test_index import IndexTestCase, write_notebook
+
+class LoggedInSearchHandler(SearchHandler):
+    '''Search handler that skips the notebook server login.'''
+    def get_current_user(self):
+        return 'user'
+
+class TestSearchHandler(IndexTestCase, AsyncHTTPTestCase):
+    '''Tests for the /search endpoint of the notebook server.'''
+    def setUp(self):
+        IndexTestCase.setUp(self)
+        self.manager = IndexManager(work_dir=self.work_dir, watch=False, min_update_interval=0)
+        AsyncHTTPTestCase.setUp(self)
+
+    def tearDown(self):
+        AsyncHTTPTestCase.tearDown(self)
+        self.manager.stop()
+        IndexTestCase.tearDown(self)
+
+    def get_app(self):
+        return web.Application([
+            ('/search', LoggedInSearchHandler, dict(work_dir=self.work_dir, manager=self.manager))
+        ], base_url='/')
+
+    def search(self, query, **headers):
+        response = self.fetch('/search?' + query, headers=headers)
+        body = json.loads(response.body.decode('utf-8')) if response.code == 200 else None
+        return response, body
+
+    def test_update_without_watcher(self):
+        '''Should update the index before searching if nothing watches the disk.'''
+        response, body = self.search('qs=zebra')
+        self.assertEqual([r['rel_path'] for r in body['results']], ['alpha.ipynb'])
+        write_notebook(pjoin(self.work_dir, 'sub', 'delta.ipynb'), 'import zebra')
+        response, body = self.search('qs=zebra')
+        self.assertEqual(sorted(r['rel_path'] for r in body['results']),
+                         ['alpha.ipynb', 'sub/delta.ipynb'])
+
+    def test_etag(self):
+        '''Should revalidate results by the index generation and the query.'''
+        response, body = self.search('qs=zebra')
+        etag = response.headers['Etag']
+        response, body = self.search('qs=zebra', **{'If-None-Match': etag})
+        self.assertEqual(response.code, 304)
+        response, body = self.search('qs=giraffe', **{'If-None-Match': etag})
+        self.assertEqual(response.code, 200)
+
+        write_notebook(pjoin(self.work_dir, 'sub', 'delta.ipynb'), 'import zebra')
+        response, body = self.search('qs=zebra', **{'If-None-Match': etag})
+        self.assertEqual(response.code, 200)
+        self.assertEqual(len(body['results']), 2)
+        self.assertNotEqual(response.headers['Etag'], etag)
+
+    def test_truncated_etag(self):
+        '''Should not tag partial results at all.'''
+        search = self.manager.index.search
+        self.manager.index.search = lambda *args, **kwargs: search(*args, **kwargs)[:2] + (True,)
+        response, body = self.search('qs=zebra')
+        self.assertTrue(body['truncated'])
+        self.assertNotIn('Etag', response.headers)
+
+    def test_folders(self):
+        '''Should refuse folders outside the notebook directory.'''
+        for folder in ['..', '../x', 'sub/../..', '/..']:
+            for name in ['cwd', 'scope']:
+                response, body = self.search('qs=zebra&%s=%s' % (name, folder))
+                self.assertEqual(response.code, 400, (name, folder))
+        # the notebook directory itself is not a scope
+        for folder in ['.', 'sub/..', './']:
+            response, body = self.search('qs=zebra&scope=' + folder)
+            self.assertEqual(response.code, 200, folder)
+            self.assertEqual([r['rel_path'] for r in body['results']], ['alpha.ipynb'])
+        response, body = self.search('qs=zebra+OR+giraffe&scope=sub&cwd=.')
+        self.assertEqual([r['rel_path'] for r in body['results']], ['sub/beta.ipynb'])
+
+    def test_paging_arguments(self):
+        '''Should refuse offsets and limits out of range.'''
+        for query in ['offset=-1', 'limit=0', 'limit=101', 'limit=ten', 'offset=1.5']:
+            response, body = self.search('qs=zebra&' + query)
+            self.assertEqual(response.code, 400, query)
+        response, body = self.search('qs=zebra&offset=0&limit=100')
+        self.assertEqual(response.code, 200)
+        self.assertEqual(body['limit'], 100)
@@ -0,0 +1,101 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+import os
+import shutil
+import threading
+import time
+from os.path import join as pjoin
+from jupyter_cms.shards import ShardedIndex
+from test_index import IndexTestCase, write_notebook
+
+class TestShardedIndex(IndexTestCase):
+    '''Tests for splitting the index by top-level directory.'''
+    def test_update_index(self):
+        '''Should index each top-level directory in its own shard.'''
+        index = ShardedIndex(self.work_dir)
+        self.assertTrue(index.update_index())
+        self.assertEqual(sorted(index._shards), ['', 'sub'])
+        self.assertEqual(self.paths(index, 'zebra'), [pjoin(self.work_dir, 'alpha.ipynb')])
+        self.assertEqual(self.paths(index, 'giraffe OR zebra'),
+                         [pjoin(self.work_dir, 'alpha.ipynb'), pjoin(self.work_dir, 'sub', 'beta.ipynb')])
+        self.assertEqual(index._shards[''].stats()['documents'], 1)
+        stats = index.stats()
+        self.assertEqual((stats['documents'], stats['shards']), (3, 2))
+
+    def test_search_pages(self):
+        '''Should merge the pages of every shard.'''
+        index = ShardedIndex(self.work_dir)
+        index.update_index()
+        results, total, truncated = index.search('zebra OR giraffe OR notes.txt', limit=2, offset=1)
+        self.assertEqual(total, 3)
+        self.assertEqual(len(results), 2)
+        results, total, truncated = index.search('zebra OR giraffe OR notes.txt', root=pjoin(self.work_dir, 'sub'))
+        self.assertEqual(total, 2)
+
+    def test_search_during_update(self):
+        '''Should not queue searches behind shard updates.'''
+        index = ShardedIndex(self.work_dir, threads=1)
+        index.update_index()
+        release = threading.Event()
+        shard = index._shards['sub']
+        update_index = shard.update_index
+        def slow_update(full=False):
+            release.wait(10)
+            return update_index(full)
+        shard.update_index = slow_update
+        updater = threading.Thread(target=index.update_index)
+        updater.start()
+        try:
+            start = time.time()
+            self.assertEqual(self.paths(index, 'zebra'), [pjoin(self.work_dir, 'alpha.ipynb')])
+            self.assertLess(time.time() - start, 5)
+        finally:
+            release.set()
+            updater.join()
+
+    def test_update_paths(self):
+        '''Should route paths to their shards and drop removed directories.'''
+        index = ShardedIndex(self.work_dir)
+        index.update_index()
+        os.makedirs(pjoin(self.work_dir, 'other'))
+        path = pjoin(self.work_dir, 'other', 'delta.ipynb')
+        write_notebook(path, 'import zebra')
+        index.update_paths([pjoin(self.work_dir, 'other')])
+        self.assertEqual(self.paths(index, 'zebra'), [pjoin(self.work_dir, 'alpha.ipynb'), path])
+        shutil.rmtree(pjoin(self.work_dir, 'sub'))
+        index.update_paths([pjoin(self.work_dir, 'sub')])
+        self.assertEqual(sorted(index._shards), ['', 'other'])
+        self.assertEqual(self.paths(index, 'giraffe'), [])
+
+    def test_no_phantom_shards(self):
+        '''Should not create shards for paths that searches make up.'''
+        os.makedirs(pjoin(self.work_dir, 'node_modules'))
+        index = ShardedIndex(self.work_dir)
+        index.update_index()
+        shard_dirs = sorted(os.listdir(index._shards_dir))
+        for name in ['nope', 'node_modules', '.hidden']:
+            self.assertEqual(index.search('zebra', root=pjoin(self.work_dir, name, 'x')), ([], 0, False))
+            self.assertEqual(index.suggest(name + '/a'), [])
+        self.assertEqual(index.suggest('ghost/a'), [])
+        self.assertEqual(sorted(index._shards), ['', 'sub'])
+        self.assertEqual(sorted(os.listdir(index._shards_dir)), shard_dirs)
+
+        # a directory that is there but not yet indexed is fine to open
+        os.makedirs(pjoin(self.work_dir, 'fresh'))
+        self.assertEqual(index.search('zebra', root=pjoin(self.work_dir, 'fresh')), ([], 0, False))
+        self.assertEqual(sorted(index._shards), ['', 'fresh', 'sub'])
+
+    def test_suggest(self):
+        '''Should complete basenames across shards and paths within one.'''
+        index = ShardedIndex(self.work_dir)
+        index.update_index()
+        suggest = lambda prefix: [result['path'] for result in index.suggest(prefix)]
+        self.assertEqual(suggest('al'), [pjoin(self.work_dir, 'alpha.ipynb')])
+        self.assertEqual(suggest('sub/n'), [pjoin(self.work_dir, 'sub', 'notes.txt')])
+
+    def test_in_memory(self):
+        '''Should keep every shard in memory.'''
+        index = ShardedIndex(self.work_dir, in_memory=True)
+        index.update_index()
+        self.assertEqual(self.paths(index, 'giraffe'), [pjoin(self.work_dir, 'sub', 'beta.ipynb')])
+        self.assertEqual(os.listdir(self.data_dir), [])
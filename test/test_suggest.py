@@ -0,0 +1,44 @@
+# Copyright (c) Jupyter Development Team.
+# Distributed under the terms of the Modified BSD License.
+import unittest
+from os.path import join as pjoin
+from jupyter_cms.suggest import PathSuggester
+
+ROOT = pjoin('/', 'work')
+
+class TestPathSuggester(unittest.TestCase):
+    '''Tests for completing filename prefixes.'''
+    def setUp(self):
+        self.suggester = PathSuggester(ROOT, [
+            pjoin(ROOT, 'Plot.ipynb'),
+            pjoin(ROOT, 'data', 'plotting.py'),
+            pjoin(ROOT, 'data', 'raw', 'points.csv'),
+            pjoin(ROOT, 'notes.txt')
+        ])
+
+    def test_basename_prefix(self):
+        '''Should match basenames regardless of case.'''
+        self.assertEqual(self.suggester.suggest('plot'),
+                         [pjoin(ROOT, 'Plot.ipynb'), pjoin(ROOT, 'data', 'plotting.py')])
+
+    def test_path_prefix(self):
+        '''Should match paths relative to the root after basenames.'''
+        self.assertEqual(self.suggester.suggest('data/r'), [pjoin(ROOT, 'data', 'raw', 'points.csv')])
+        self.assertEqual(self.suggester.suggest('p', limit=3), [
+            pjoin(ROOT, 'Plot.ipynb'),
+            pjoin(ROOT, 'data', 'plotting.py'),
+            pjoin(ROOT, 'data', 'raw', 'points.csv')
+        ])
+
+    def test_add_remove(self):
+        '''Should keep matches current and ignore repeated changes.'''
+        path = pjoin(ROOT, 'plan.md')
+        self.suggester.add(path)
+        self.suggester.add(path)
+        self.assertEqual(self.suggester.suggest('pla'), [path])
+        self.suggester.remove(path)
+        self.suggester.remove(path)
+        self.assertEqual(self.suggester.suggest('pla'), [])
+        self.suggester.remove_dir(pjoin(ROOT, 'data'))
+        self.assertEqual(self.suggester.suggest('p'), [pjoin(ROOT, 'Plot.ipynb')])
+        self.assertEqual(len(self.suggester), 2)